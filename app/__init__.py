@@ -10,8 +10,20 @@ db = SQLAlchemy()
 socketio = SocketIO(async_mode=os.getenv("SIO_ASYNC_MODE", "threading"),
                     cors_allowed_origins="*", ping_interval=25, ping_timeout=60)
 
-def create_app():
+from .broadcast import StatsBroadcaster, register_handlers
+from .write_behind import WriteBehindQueue
+from .metrics import Metrics
+from .retention import RetentionPruner
+from .label_memo import LabelMemo
+from .sketches import SketchStore
+from .ipc_bus import UnixSocketManager
+from . import storage
+from .jsoncodec import FastJSONProvider
+broadcaster = StatsBroadcaster(socketio)
+
+def create_app(config=None):
     app = Flask(__name__, instance_relative_config=True)
+    app.json = FastJSONProvider(app)
     os.makedirs(app.instance_path, exist_ok=True)
 
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret')
@@ -21,11 +33,64 @@ def create_app():
     )
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SWAGGER'] = {'title': 'ASS Data Labeling API', 'uiversion': 3}
+    app.config['RULES_PAGE_SIZE'] = int(os.environ.get('RULES_PAGE_SIZE', 500))
+    app.config['BATCH_MAX_ITEMS'] = int(os.environ.get('BATCH_MAX_ITEMS', 10000))
+    app.config['VECTORIZE_MIN_BATCH'] = int(os.environ.get('VECTORIZE_MIN_BATCH', 1000))
+    app.config['STREAM_CHUNK_SIZE'] = int(os.environ.get('STREAM_CHUNK_SIZE', 1000))
+    app.config['ROLLUP_BUCKET_SECONDS'] = int(os.environ.get('ROLLUP_BUCKET_SECONDS', 60))
+    app.config['STATS_ROLLUPS'] = os.environ.get('STATS_ROLLUPS', 'true').lower() in {'1', 'true', 'yes'}
+    app.config['STATS_BROADCAST_INTERVAL_MS'] = int(os.environ.get('STATS_BROADCAST_INTERVAL_MS', 250))
+    app.config['SOCKETIO_BUS_DIR'] = os.environ.get('SOCKETIO_BUS_DIR', '')
+    app.config['EXPORT_PAGE_SIZE'] = int(os.environ.get('EXPORT_PAGE_SIZE', 1000))
+    app.config['RELABEL_WORKERS'] = int(os.environ.get('RELABEL_WORKERS', os.cpu_count() or 1))
+    app.config['RELABEL_CHUNK_SIZE'] = int(os.environ.get('RELABEL_CHUNK_SIZE', 5000))
+    app.config['WRITE_BEHIND'] = os.environ.get('WRITE_BEHIND', 'false').lower() in {'1', 'true', 'yes'}
+    app.config['WRITE_BEHIND_MAX_QUEUE'] = int(os.environ.get('WRITE_BEHIND_MAX_QUEUE', 10000))
+    app.config['WRITE_BEHIND_FLUSH_SIZE'] = int(os.environ.get('WRITE_BEHIND_FLUSH_SIZE', 500))
+    app.config['WRITE_BEHIND_FLUSH_INTERVAL_MS'] = int(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL_MS', 200))
+    app.config['WRITE_BEHIND_BLOCK_SECONDS'] = float(os.environ.get('WRITE_BEHIND_BLOCK_SECONDS', 0))
+    app.config['PAYLOAD_STORAGE'] = os.environ.get('PAYLOAD_STORAGE', 'inline')
+    app.config['PAYLOAD_PROJECTION'] = os.environ.get('PAYLOAD_PROJECTION', 'false').lower() in {'1', 'true', 'yes'}
+    app.config['RETENTION_DAYS'] = int(os.environ.get('RETENTION_DAYS', 0))
+    app.config['RETENTION_PRUNE_INTERVAL_SECONDS'] = int(os.environ.get('RETENTION_PRUNE_INTERVAL_SECONDS', 3600))
+    app.config['RETENTION_PRUNE_BATCH'] = int(os.environ.get('RETENTION_PRUNE_BATCH', 1000))
+    app.config['STORAGE_PROFILE'] = os.environ.get('STORAGE_PROFILE', 'default')
+    app.config['STATS_READ_DATABASE_URL'] = os.environ.get('STATS_READ_DATABASE_URL')
+    app.config['SQLITE_POOL_SIZE'] = int(os.environ.get('SQLITE_POOL_SIZE', 10))
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    app.config['SQLITE_CACHE_KB'] = int(os.environ.get('SQLITE_CACHE_KB', 65536))
+    app.config['SQLITE_MMAP_BYTES'] = int(os.environ.get('SQLITE_MMAP_BYTES', 268435456))
+    app.config['LABEL_MEMO_SIZE'] = int(os.environ.get('LABEL_MEMO_SIZE', 10000))
+    app.config['ADAPTIVE_SAMPLE_N'] = int(os.environ.get('ADAPTIVE_SAMPLE_N', 64))
+    app.config['ADAPTIVE_REORDER_EVERY'] = int(os.environ.get('ADAPTIVE_REORDER_EVERY', 500))
+    app.config['SKETCHES_ENABLED'] = os.environ.get('SKETCHES_ENABLED', 'true').lower() in {'1', 'true', 'yes'}
+    app.config['SKETCH_BUCKET_SECONDS'] = int(os.environ.get('SKETCH_BUCKET_SECONDS', 3600))
+    app.config['SKETCH_FLUSH_SECONDS'] = int(os.environ.get('SKETCH_FLUSH_SECONDS', 30))
+    app.config['SKETCH_WINDOW_HOURS'] = int(os.environ.get('SKETCH_WINDOW_HOURS', 24))
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'false').lower() in {'1', 'true', 'yes'}
+    app.config['PROFILE_SAMPLE_N'] = int(os.environ.get('PROFILE_SAMPLE_N', 0))
+    if config:
+        app.config.update(config)
 
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
+    storage.configure(app)
     db.init_app(app)
-    socketio.init_app(app)
+    storage.install(app)
+    writer = WriteBehindQueue(app)
+    RetentionPruner(app)
+    SketchStore(app)
+    metrics = Metrics(app)
+    metrics.register_gauge('ass_write_behind_depth', 'Payload batches waiting in the write-behind queue', writer.depth)
+    metrics.register_gauge('ass_write_behind_lag_seconds', 'Age of the oldest queued write-behind batch', writer.lag_seconds)
+    memo = LabelMemo(app)
+    metrics.register_gauge('ass_label_memo_hits_total', 'Labeling results served from the memo', lambda: memo.hits, 'counter')
+    metrics.register_gauge('ass_label_memo_misses_total', 'Labeling memo lookups that evaluated the rules', lambda: memo.misses, 'counter')
+    metrics.register_gauge('ass_label_memo_entries', 'Entries held by the labeling memo', memo.__len__)
+    bus_dir = app.config['SOCKETIO_BUS_DIR']
+    socketio.init_app(app, client_manager=UnixSocketManager(bus_dir) if bus_dir else None)
+    broadcaster.init_app(app)
+    register_handlers(socketio)
     Swagger(app)
 
     from .routes.api import api_bp
@@ -0,0 +1,69 @@
+import threading
+from collections import Counter
+from typing import Dict
+from flask import request
+from flask_socketio import join_room
+
+def room_for(uid: str) -> str:
+    return f"user:{uid}"
+
+class StatsBroadcaster:
+    """Coalesces per-user statistics changes and emits them as deltas.
+
+    Ingest paths call ``record`` after committing; every ``interval`` seconds
+    the accumulated increments are sent as one ``stats_delta`` event to the
+    user's room. Clients get a full ``stats_resync`` when they subscribe.
+    """
+
+    def __init__(self, socketio):
+        self.socketio = socketio
+        self.interval = 0.25
+        self._pending: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._task = None
+
+    def init_app(self, app):
+        self.interval = app.config['STATS_BROADCAST_INTERVAL_MS'] / 1000.0
+
+    def record(self, uid: str, payloads: int, label_counts: Dict[str, int]):
+        with self._lock:
+            pending = self._pending.setdefault(uid, [0, Counter()])
+            pending[0] += payloads
+            pending[1].update(label_counts)
+            if self.interval > 0 and self._task is None:
+                self._task = self.socketio.start_background_task(self._run)
+        if self.interval <= 0:
+            self.flush()
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            with self._lock:
+                if not self._pending:
+                    self._task = None
+                    return
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for uid, (payloads, labels) in pending.items():
+            self.socketio.emit('stats_delta', {"total_payloads": payloads, "by_label": dict(labels)},
+                               to=room_for(uid))
+
+def register_handlers(socketio):
+    from .stats import compute_statistics
+
+    def subscribe(uid):
+        if not uid:
+            return
+        join_room(room_for(uid))
+        socketio.emit('stats_resync', compute_statistics(uid), to=request.sid)
+
+    @socketio.on('connect')
+    def on_connect(auth=None):
+        subscribe((auth or {}).get('user_id') or request.headers.get('X-User-Id'))
+
+    @socketio.on('subscribe')
+    def on_subscribe(data):
+        subscribe((data or {}).get('user_id'))
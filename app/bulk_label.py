@@ -0,0 +1,192 @@
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from typing import Callable, Dict, Iterator, List, Optional, TextIO
+from . import jsoncodec
+from .rule_engine import compile_rules
+from .rule_vector import apply_rules_batch
+
+_worker = {}
+
+def _init_worker(rule_dicts, single: bool, emit: str):
+    _worker['rules'] = compile_rules(rule_dicts)
+    _worker['by_id'] = {r.id: r for r in _worker['rules']}
+    _worker['single'] = single
+    _worker['emit'] = emit
+
+def rules_from_export(rules: List[dict]) -> List[dict]:
+    """Rule dicts for ``compile_rules`` from a ``GET /api/rules`` export;
+    inactive rules are dropped."""
+    return [{"id": r["id"], "label": r["label"], "priority": r.get("priority", 100),
+             "conditions": [(c.get("group", 1), c["operator"], c["key_path"], c.get("value"))
+                            for c in r.get("conditions", [])]}
+            for r in rules if r.get("active", True)]
+
+def file_shards(path: str, shard_bytes: int) -> List[tuple]:
+    """Split ``path`` into ``(path, start, end)`` byte ranges that end on line breaks."""
+    size = os.path.getsize(path)
+    if not size:
+        return []
+    shards = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = min(start + shard_bytes, size)
+            if end < size:
+                nl = mm.find(b'\n', end)
+                end = size if nl == -1 else nl + 1
+            shards.append((path, start, end))
+            start = end
+    return shards
+
+def _file_lines(path: str, start: int, end: int):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < end:
+            nl = mm.find(b'\n', pos, end)
+            if nl == -1:
+                nl = end
+            raw = mm[pos:nl]
+            if pos == 0 and raw.startswith(b'\xef\xbb\xbf'):
+                raw = raw[3:]
+            yield {"file": path, "offset": pos}, raw
+            pos = nl + 1
+
+def _top(labels, rule_ids):
+    if not rule_ids:
+        return labels, rule_ids
+    by_id = _worker['by_id']
+    top = min(rule_ids, key=lambda rid: (by_id[rid].priority, rid))
+    return [by_id[top].label], [top]
+
+def _label_items(items) -> tuple:
+    """Label ``(locator, raw_line)`` items in the worker. Returns
+    ``(output_text, rows, ok, errors)``: NDJSON output (only error lines when
+    emitting to the DB) and ``(text, rule_ids)`` rows for storage."""
+    parsed, slots = [], []
+    for loc, raw in items:
+        if not raw.strip():
+            continue
+        try:
+            text = bytes(raw).decode('utf-8').strip()
+            doc = jsoncodec.loads(text)
+        except ValueError:
+            slots.append((loc, None, "invalid JSON"))
+            continue
+        if not isinstance(doc, dict):
+            slots.append((loc, None, "payload must be a JSON object"))
+            continue
+        slots.append((loc, len(parsed), None))
+        parsed.append((text, doc))
+
+    results = apply_rules_batch([doc for _, doc in parsed], _worker['rules'])
+    if _worker['single']:
+        results = [_top(labels, rule_ids) for labels, rule_ids in results]
+    to_db = _worker['emit'] == 'db'
+    out, rows, errors = [], [], 0
+    for loc, i, err in slots:
+        if err is not None:
+            errors += 1
+            out.append(jsoncodec.dumps({**loc, "error": err}))
+            continue
+        text, _ = parsed[i]
+        labels, rule_ids = results[i]
+        if to_db:
+            rows.append((text, rule_ids))
+        else:
+            out.append(f'{{"labels":{jsoncodec.dumps(labels)},"applied_rule_ids":{jsoncodec.dumps(rule_ids)},'
+                       f'"payload":{text}}}')
+    return ("\n".join(out) + "\n") if out else "", rows, len(parsed), errors
+
+def _label_shard(shard) -> tuple:
+    if shard[0] == 'lines':
+        return _label_items(shard[1])
+    return _label_items(_file_lines(*shard[1:]))
+
+def _shards(inputs: List[str], shard_bytes: int, chunk_lines: int) -> Iterator[tuple]:
+    for path in inputs:
+        if path != '-':
+            for shard in file_shards(path, shard_bytes):
+                yield ('file',) + shard
+            continue
+        chunk = []
+        for lineno, raw in enumerate(sys.stdin.buffer, 1):
+            if lineno == 1 and raw.startswith(b'\xef\xbb\xbf'):
+                raw = raw[3:]
+            chunk.append(({"line": lineno}, raw))
+            if len(chunk) >= chunk_lines:
+                yield ('lines', chunk)
+                chunk = []
+        if chunk:
+            yield ('lines', chunk)
+
+def _shard_bytes(shard) -> int:
+    if shard[0] == 'lines':
+        return sum(len(raw) for _, raw in shard[1])
+    return shard[3] - shard[2]
+
+def label_inputs(inputs: List[str], rule_dicts: List[dict], out: TextIO, workers: int = 0,
+                 ordered: bool = True, single: bool = False, store: Optional[Callable] = None,
+                 shard_bytes: int = 4 << 20, chunk_lines: int = 5000) -> Dict:
+    """Label NDJSON files (``-`` for stdin) with ``rule_dicts``.
+
+    Files are memory-mapped and split into line-aligned shards; each worker
+    process holds the compiled rules and labels whole shards. Results are
+    written to ``out`` as NDJSON (``labels``, ``applied_rule_ids`` and the
+    original ``payload``), or, with ``store``, passed to it as
+    ``(text, rule_ids)`` rows from the main process, with only invalid lines
+    written to ``out``. ``ordered=False`` writes shards as they finish.
+    Returns a throughput report.
+    """
+    emit = 'db' if store else 'ndjson'
+    report = {"payloads": 0, "errors": 0, "bytes": 0, "shards": 0, "workers": workers}
+    started = time.perf_counter()
+
+    def collect(shard, result):
+        text, rows, ok, errors = result
+        if text:
+            out.write(text)
+        if rows:
+            store(rows)
+        report["payloads"] += ok
+        report["errors"] += errors
+        report["bytes"] += _shard_bytes(shard)
+        report["shards"] += 1
+
+    shards = _shards(inputs, shard_bytes, chunk_lines)
+    if workers <= 0:
+        _init_worker(rule_dicts, single, emit)
+        for shard in shards:
+            collect(shard, _label_shard(shard))
+    else:
+        window = workers * 2
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(rule_dicts, single, emit)) as pool:
+            pending = []
+            for shard in shards:
+                pending.append((shard, pool.submit(_label_shard, shard)))
+                if len(pending) < window:
+                    continue
+                if ordered:
+                    shard_done, fut = pending.pop(0)
+                    collect(shard_done, fut.result())
+                else:
+                    wait([f for _, f in pending], return_when=FIRST_COMPLETED)
+                    for item in [p for p in pending if p[1].done()]:
+                        pending.remove(item)
+                        collect(item[0], item[1].result())
+            if not ordered:
+                shard_of = {fut: shard_done for shard_done, fut in pending}
+                pending = [(shard_of[fut], fut) for fut in as_completed(shard_of)]
+            for shard_done, fut in pending:
+                collect(shard_done, fut.result())
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["payloads_per_sec"] = round(report["payloads"] / elapsed, 1) if elapsed else 0.0
+    report["mb_per_sec"] = round(report["bytes"] / elapsed / 1e6, 2) if elapsed else 0.0
+    return report
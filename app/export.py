@@ -0,0 +1,93 @@
+import csv
+import io
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+from . import db, jsoncodec
+from .models import Payload, PayloadLabel
+from .payload_store import PAYLOAD_COLUMNS, decode_payload, payload_source
+from .rule_engine import _Missing, get_by_path
+from .stats import _as_utc
+
+def iter_labeled_pages(uid: str, label: Optional[str] = None, from_dt: Optional[datetime] = None,
+                       to_dt: Optional[datetime] = None, page_size: int = 1000) -> Iterator[list]:
+    """Yield pages of ``(id, received_at, labels, payload)`` in id order.
+
+    Keyset pagination on ``payloads.id`` keeps every query bounded, and labels
+    for a page are fetched with one range query, so memory does not grow with
+    the size of the export.
+    """
+    last_id = 0
+    while True:
+        q = (payload_source(db.select(Payload.id, Payload.received_at, *PAYLOAD_COLUMNS))
+             .where(Payload.user_id == uid, Payload.id > last_id))
+        if from_dt:
+            q = q.where(Payload.received_at >= _as_utc(from_dt))
+        if to_dt:
+            q = q.where(Payload.received_at <= _as_utc(to_dt))
+        if label:
+            q = q.where(db.select(PayloadLabel.payload_id)
+                        .where(PayloadLabel.payload_id == Payload.id, PayloadLabel.label == label)
+                        .exists())
+        rows = db.session.execute(q.order_by(Payload.id).limit(page_size)).all()
+        if not rows:
+            return
+        first_id, last_id = rows[0][0], rows[-1][0]
+        labels = defaultdict(list)
+        for pid, lab in db.session.execute(
+                db.select(PayloadLabel.payload_id, PayloadLabel.label)
+                .join(Payload, Payload.id == PayloadLabel.payload_id)
+                .where(Payload.user_id == uid, PayloadLabel.payload_id.between(first_id, last_id))
+                .order_by(PayloadLabel.payload_id, PayloadLabel.rule_id)):
+            labels[pid].append(lab)
+        # end the read transaction between pages so a long export never pins one snapshot
+        db.session.rollback()
+        yield [(pid, received_at, labels.get(pid, []), decode_payload(*stored)) for pid, received_at, *stored in rows]
+        if len(rows) < page_size:
+            return
+
+def _key_values(payload, keys: List[str]):
+    out = []
+    for k in keys:
+        v = get_by_path(payload, k)
+        out.append(None if v is _Missing else v)
+    return out
+
+def _iso(dt: datetime) -> str:
+    return _as_utc(dt).isoformat() if dt else None
+
+def csv_chunks(pages: Iterable[list], keys: List[str]) -> Iterator[str]:
+    buf = io.StringIO(newline="")
+    writer = csv.writer(buf)
+    writer.writerow(["id", "received_at", "labels"] + keys)
+    for page in pages:
+        for pid, received_at, labels, payload in page:
+            values = [jsoncodec.dumps(v) if isinstance(v, (dict, list)) else ("" if v is None else v)
+                      for v in _key_values(payload, keys)]
+            writer.writerow([pid, _iso(received_at), "|".join(labels)] + values)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def ndjson_chunks(pages: Iterable[list], keys: List[str]) -> Iterator[str]:
+    for page in pages:
+        lines = []
+        for pid, received_at, labels, payload in page:
+            row = {"id": pid, "received_at": _iso(received_at), "labels": labels}
+            if keys:
+                row.update(zip(keys, _key_values(payload, keys)))
+            else:
+                row["payload"] = payload
+            lines.append(jsoncodec.dumps(row))
+        yield "\n".join(lines) + "\n"
+
+def gzip_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    comp = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = comp.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield comp.flush()
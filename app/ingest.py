@@ -0,0 +1,190 @@
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Iterable, List, Tuple
+from flask import current_app
+from sqlalchemy import insert
+from . import db, jsoncodec
+from .models import Payload, PayloadLabel
+from .label_memo import get_label_memo, memo_key
+from .rule_cache import RuleSet
+from .rule_stats import maybe_observe
+from .services import ensure_user
+from .rule_vector import apply_rules_batch
+from .payload_store import encode_payloads
+from .stats import record_rollups
+
+ALL = (None, False)
+FIRST = (1, True)
+EVAL_MODES = ('all', 'first', 'top_k', 'dedup')
+
+def eval_mode(args) -> tuple:
+    """``(limit, dedup)`` from the ``mode`` (``all``, ``first``, ``top_k`` with
+    ``k``, ``dedup``) and legacy ``single_label`` query parameters. Raises
+    ValueError on bad values."""
+    name = args.get('mode')
+    if name is None:
+        single = args.get('single_label', 'false').lower() in {'1', 'true', 'yes'}
+        return FIRST if single else ALL
+    if name not in EVAL_MODES:
+        raise ValueError(f"mode must be one of {', '.join(EVAL_MODES)}")
+    if name == 'top_k':
+        try:
+            k = int(args.get('k', ''))
+        except ValueError:
+            k = 0
+        if k < 1:
+            raise ValueError("top_k needs a positive integer k")
+        return (k, True)
+    return {'all': ALL, 'first': FIRST, 'dedup': (None, True)}[name]
+
+def limit_result(rule_set: RuleSet, labels, rule_ids, mode=ALL):
+    """Cut a full ``(labels, rule_ids)`` result down to what ``mode`` returns."""
+    limit, dedup = mode
+    if mode == ALL:
+        return labels, rule_ids
+    out_labels, out_ids = [], []
+    for rid in rule_ids:
+        label = rule_set.by_id[rid].label
+        if label in out_labels:
+            if not dedup:
+                out_ids.append(rid)
+            continue
+        out_labels.append(label)
+        out_ids.append(rid)
+        if limit is not None and len(out_labels) >= limit:
+            break
+    return out_labels, out_ids
+
+def _evaluate(rule_set: RuleSet, payload, mode, counters):
+    if mode == ALL:
+        return rule_set.matcher.apply(payload, counters)
+    return rule_set.matcher.apply_limited(payload, *mode, counters=counters)
+
+def label_payload(rule_set: RuleSet, payload, mode=ALL, counters=None) -> Tuple[List[str], List[int]]:
+    """Label one payload. ``mode`` is an ``eval_mode`` tuple; anything but
+    ``ALL`` stops early and is memoized separately."""
+    memo = get_label_memo()
+    if memo is None:
+        labels, rule_ids = _evaluate(rule_set, payload, mode, counters)
+        maybe_observe(rule_set, payload)
+        return labels, rule_ids
+    key = memo_key(rule_set, payload)
+    if mode != ALL:
+        key += (mode,)
+    cached = memo.get(key)
+    if cached is None:
+        cached = tuple(map(tuple, _evaluate(rule_set, payload, mode, counters)))
+        memo.put(key, cached)
+        maybe_observe(rule_set, payload)
+    return list(cached[0]), list(cached[1])
+
+def label_batch(rule_set: RuleSet, payloads, mode=ALL) -> List[Tuple[List[str], List[int]]]:
+    """Label many payloads. Large batches use the vectorized evaluator, which
+    evaluates column-wise, and are cut down to ``mode`` afterwards."""
+    if len(payloads) < current_app.config['VECTORIZE_MIN_BATCH']:
+        return [label_payload(rule_set, p, mode) for p in payloads]
+    results = apply_rules_batch(payloads, rule_set.rules)
+    if mode != ALL:
+        results = [limit_result(rule_set, labels, rule_ids, mode) for labels, rule_ids in results]
+    return results
+
+def _text(raw: bytes) -> str:
+    if raw.startswith(b'\xef\xbb\xbf'):
+        raw = raw[3:]
+    return raw.decode('utf-8').strip()
+
+def parse_payload(body: bytes) -> Tuple[dict, str]:
+    """Parse one JSON object body into ``(payload, text)``; ``text`` is the
+    request body itself, stored as-is instead of re-serializing ``payload``.
+    Raises ValueError if the body is not a UTF-8 JSON object."""
+    text = _text(body)
+    payload = jsoncodec.loads(text)
+    if not isinstance(payload, dict):
+        raise ValueError("Payload must be a JSON object")
+    return payload, text
+
+def parse_batch(body: bytes, content_type: str = '') -> List[Tuple[dict, str]]:
+    """Parse a JSON array or NDJSON body into ``(payload, text)`` pairs.
+
+    NDJSON lines are kept as sent; array items are serialized once.
+    Raises ValueError with a message naming the offending item/line.
+    """
+    try:
+        text = _text(body)
+    except UnicodeDecodeError:
+        raise ValueError("Body is not valid UTF-8")
+    if text.startswith('[') and 'ndjson' not in content_type:
+        try:
+            items = jsoncodec.loads(text)
+        except ValueError:
+            raise ValueError("Body is not valid JSON")
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise ValueError(f"Item {i} must be a JSON object")
+        return [(item, jsoncodec.dumps(item)) for item in items]
+    items = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = jsoncodec.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {lineno} is not valid JSON")
+        if not isinstance(item, dict):
+            raise ValueError(f"Line {lineno} must be a JSON object")
+        items.append((item, line))
+    return items
+
+def iter_ndjson_chunks(stream, chunk_size: int):
+    """Read NDJSON from a binary stream, yielding lists of at most
+    ``chunk_size`` ``(lineno, payload, text, error)`` tuples, ``text`` being
+    the line as sent. Only one chunk is held in memory at a time."""
+    chunk = []
+    for lineno, raw in enumerate(stream, 1):
+        if not raw.strip():
+            continue
+        try:
+            text = _text(raw) if lineno == 1 else raw.decode('utf-8').strip()
+            item = jsoncodec.loads(text)
+        except ValueError:
+            chunk.append((lineno, None, None, "invalid JSON"))
+        else:
+            if isinstance(item, dict):
+                chunk.append((lineno, item, text, None))
+            else:
+                chunk.append((lineno, None, None, "payload must be a JSON object"))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def store_labeled(uid: str, rule_set: RuleSet, rows: Iterable[Tuple[str, List[int]]],
+                  received_at: datetime = None):
+    """Bulk insert ``(payload_json, rule_ids)`` rows, their labels and the
+    matching rollup increments.
+
+    Runs inside the caller's transaction (which also creates the user row if
+    needed); returns the new payload ids in input order and the label row
+    counts.
+    """
+    rows = list(rows)
+    if not rows:
+        return [], Counter()
+    ensure_user(db.session, uid)
+    now = received_at or datetime.now(timezone.utc)
+    stored = encode_payloads(rule_set.key_paths, (pj for pj, _ in rows))
+    ids = db.session.scalars(
+        insert(Payload).returning(Payload.id, sort_by_parameter_order=True),
+        [{"user_id": uid, "received_at": now, **values} for values in stored],
+    ).all()
+    label_rows = [
+        {"payload_id": pid, "rule_id": rid, "label": rule_set.by_id[rid].label}
+        for pid, (_, rule_ids) in zip(ids, rows) for rid in rule_ids
+    ]
+    if label_rows:
+        db.session.execute(insert(PayloadLabel), label_rows)
+    label_counts = Counter(r["label"] for r in label_rows)
+    record_rollups(uid, now, len(ids), label_counts)
+    return ids, label_counts
@@ -0,0 +1,122 @@
+import atexit
+import contextlib
+import logging
+import os
+import socket
+import struct
+import uuid
+from collections import OrderedDict
+from socketio import PubSubManager
+from . import jsoncodec
+
+log = logging.getLogger(__name__)
+
+MAX_MESSAGE = 1 << 18
+# below the default socket send buffer; larger messages go out in fragments
+FRAGMENT_SIZE = 1 << 16
+_FRAG_HEADER = struct.Struct('!c16sHH')
+_MAX_PARTIAL = 64
+
+class UnixSocketManager(PubSubManager):
+    """Socket.IO client manager that fans emits out to the other worker
+    processes on this machine over Unix datagram sockets, with no broker.
+
+    Each process that serves clients binds ``<bus_dir>/<pid>-<id>.sock`` and
+    publishes by sending every message to each socket in the directory, so
+    workers join and leave without coordination. Sockets left by dead
+    workers are removed when a send to them is refused. Messages are JSON,
+    split into ``FRAGMENT_SIZE`` datagrams when larger. A send waits up to
+    ``send_timeout`` seconds for room in a peer's queue (the kernel holds
+    only a few datagrams per socket), so bursts are delivered; only a peer
+    stalled for longer loses messages, which are counted in ``dropped``.
+    """
+    name = 'unix'
+
+    def __init__(self, bus_dir: str, channel: str = 'flask-socketio', write_only: bool = False, logger=None,
+                 send_timeout: float = 1.0):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.send_timeout = send_timeout
+        os.makedirs(bus_dir, mode=0o700, exist_ok=True)
+        self.bus_dir = bus_dir
+        self.path = None
+        self.dropped = 0
+        self._pid = None
+        self._sender = None
+        self._listener = None
+
+    def _ensure_process(self):
+        # state created before a fork (gunicorn --preload) must not be shared
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.host_id = uuid.uuid4().hex
+        self.path = None
+        self._listener = None
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.settimeout(self.send_timeout)
+
+    def initialize(self):
+        self._ensure_process()
+        if not self.write_only and self._listener is None:
+            self.path = os.path.join(self.bus_dir, f"{self._pid}-{self.host_id[:8]}.sock")
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+            self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._listener.bind(self.path)
+            atexit.register(self.close)
+        super().initialize()
+
+    def close(self):
+        if self.path and self._pid == os.getpid():
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+
+    def peers(self):
+        own = self.path and os.path.basename(self.path)
+        return [os.path.join(self.bus_dir, name) for name in os.listdir(self.bus_dir)
+                if name.endswith('.sock') and name != own]
+
+    def _datagrams(self, message: bytes):
+        if len(message) <= FRAGMENT_SIZE:
+            return [message]
+        msg_id = uuid.uuid4().bytes
+        chunks = [message[i:i + FRAGMENT_SIZE] for i in range(0, len(message), FRAGMENT_SIZE)]
+        return [_FRAG_HEADER.pack(b'F', msg_id, i, len(chunks)) + chunk for i, chunk in enumerate(chunks)]
+
+    def _publish(self, data):
+        self._ensure_process()
+        datagrams = self._datagrams(jsoncodec.dumps(data, default=str).encode('utf-8'))
+        for path in self.peers():
+            try:
+                for datagram in datagrams:
+                    self._sender.sendto(datagram, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+            except (socket.timeout, BlockingIOError):
+                self.dropped += 1
+                log.warning("socket.io bus: %s did not read for %ss, message dropped", path, self.send_timeout)
+            except OSError:
+                self.dropped += 1
+                log.exception("socket.io bus: send to %s failed", path)
+
+    def _listen(self):
+        partial = OrderedDict()
+        while True:
+            raw = self._listener.recv(MAX_MESSAGE)
+            if raw[:1] == b'F':
+                _, msg_id, index, count = _FRAG_HEADER.unpack_from(raw)
+                chunks = partial.setdefault(msg_id, {})
+                chunks[index] = raw[_FRAG_HEADER.size:]
+                if len(chunks) < count:
+                    if len(partial) > _MAX_PARTIAL:
+                        partial.popitem(last=False)
+                    continue
+                del partial[msg_id]
+                raw = b''.join(chunks[i] for i in range(count))
+            try:
+                message = jsoncodec.loads(raw)
+            except ValueError:
+                continue
+            if isinstance(message, dict):
+                yield message
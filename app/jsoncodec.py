@@ -0,0 +1,61 @@
+"""JSON encoding and decoding for the app.
+
+Uses orjson when it is installed and the standard library otherwise. Values
+orjson cannot handle (integers beyond 64 bits, NaN literals on input) fall
+back to the standard library, so both backends accept the same documents.
+orjson would read such integers as floats instead of failing, so any text
+with a run of 19 or more digits is parsed by the standard library.
+
+On output orjson writes NaN and infinities as ``null`` (the standard library
+would write ``NaN``/``Infinity`` literals, which are not JSON).
+"""
+import json
+import re
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# int64 has at most 19 digits; shorter runs are always exact under orjson
+_LONG_DIGITS = re.compile(r'\d{19}')
+_LONG_DIGITS_B = re.compile(rb'\d{19}')
+
+def loads(data):
+    """Parse ``str`` or ``bytes`` JSON. Raises ValueError on invalid input."""
+    if orjson is not None:
+        long_digits = _LONG_DIGITS_B if isinstance(data, (bytes, bytearray, memoryview)) else _LONG_DIGITS
+        try:
+            if not long_digits.search(data):
+                return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+def dumps(obj, sort_keys: bool = False, default=None) -> str:
+    """Compact JSON text. ``default`` also receives datetimes, as with the
+    standard library."""
+    if orjson is not None:
+        option = (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_PASSTHROUGH_DATETIME if default else 0)
+        try:
+            return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(obj, sort_keys=sort_keys, default=default, separators=(',', ':'))
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider (``jsonify``, ``request.get_json``) backed by this codec."""
+
+    def dumps(self, obj, **kwargs):
+        # response() always passes separators; anything else (indent in debug) goes to the stdlib
+        if kwargs.keys() - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, sort_keys=self.sort_keys, default=self.default)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
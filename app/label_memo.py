@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+from flask import current_app
+from . import jsoncodec
+from .rule_engine import resolve_path
+
+def _freeze(v):
+    if isinstance(v, (dict, list)):
+        return ('json', jsoncodec.dumps(v, sort_keys=True, default=str))
+    return v
+
+def memo_key(rule_set, payload) -> tuple:
+    """``(uid, version, values)`` where ``values`` are the payload's values at
+    every key path the rule set references (``_Missing`` where absent). Two
+    payloads with the same key label identically, whatever else they hold."""
+    return (rule_set.uid, rule_set.version,
+            tuple(_freeze(resolve_path(payload, steps)) for steps in rule_set.memo_paths))
+
+class LabelMemo:
+    """Bounded LRU of ``memo_key -> (labels, rule_ids)``.
+
+    Keys carry the rule-set version, so a rules change (which bumps it) makes
+    old entries unreachable and they age out.
+    """
+
+    def __init__(self, app):
+        self.maxsize = app.config['LABEL_MEMO_SIZE']
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        app.extensions['label_memo'] = self
+
+    def get(self, key):
+        with self._lock:
+            result = self._data.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._data[key] = result
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def status(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self), "max_size": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+def get_label_memo():
+    """The app's memo, or None when ``LABEL_MEMO_SIZE`` is 0."""
+    memo = current_app.extensions['label_memo']
+    return memo if memo.maxsize > 0 else None
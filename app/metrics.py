@@ -0,0 +1,164 @@
+import cProfile
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _fmt_labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in labels) + '}'
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, n):
+        self.counts = [0] * n
+        self.sum = 0.0
+        self.count = 0
+
+class _NullStopwatch:
+    def lap(self, stage):
+        pass
+
+_NULL_STOPWATCH = _NullStopwatch()
+
+class _Stopwatch:
+    __slots__ = ('metrics', 'name', 'last')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.metrics.observe(self.name, now - self.last, stage=stage)
+        self.last = now
+
+class Metrics:
+    """In-process counters and histograms rendered in Prometheus text format.
+
+    When ``METRICS_ENABLED`` is off every method returns immediately (and
+    ``stopwatch`` hands out a shared no-op), so instrumented code paths pay
+    only an attribute check.
+    """
+
+    HELP = {
+        'ass_process_stage_seconds': 'Time spent per stage of POST /api/process',
+        'ass_payloads_processed_total': 'Payloads labeled, by endpoint',
+        'ass_rules_evaluated_total': 'Candidate rules evaluated by the engine',
+        'ass_conditions_evaluated_total': 'Conditions evaluated by the engine',
+        'ass_missing_path_total': 'Conditions that failed because the key path was missing',
+        'ass_rule_matches_total': 'Payloads matched, by rule id',
+    }
+
+    def __init__(self, app):
+        self.enabled = app.config['METRICS_ENABLED']
+        self.buckets = DEFAULT_BUCKETS
+        self.profile_every = app.config['PROFILE_SAMPLE_N']
+        self.profile_dir = os.path.join(app.instance_path, 'profiles')
+        self._profile_seq = itertools.count(1)
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+        app.extensions['metrics'] = self
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled or not value:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = _Histogram(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h.counts[i] += 1
+                    break
+            h.sum += seconds
+            h.count += 1
+
+    def stopwatch(self, name):
+        """Record the time between successive ``lap(stage)`` calls into ``name``."""
+        return _Stopwatch(self, name) if self.enabled else _NULL_STOPWATCH
+
+    def engine_counters(self):
+        """A fresh ``[rules, conditions, missing]`` list for the matcher to fill,
+        or None when disabled (the matcher then takes its uninstrumented path)."""
+        return [0, 0, 0] if self.enabled else None
+
+    def record_engine(self, counters, matched_rule_ids):
+        if counters is None:
+            return
+        self.inc('ass_rules_evaluated_total', counters[0])
+        self.inc('ass_conditions_evaluated_total', counters[1])
+        self.inc('ass_missing_path_total', counters[2])
+        for rid in matched_rule_ids:
+            self.inc('ass_rule_matches_total', rule_id=rid)
+
+    def register_gauge(self, name, help_text, fn, kind='gauge'):
+        """``fn()`` is called at scrape time; ``kind='counter'`` for values
+        that only grow but are kept elsewhere."""
+        self._gauges.append((name, help_text, fn, kind))
+
+    @contextmanager
+    def maybe_profile(self, tag):
+        """Run the block under cProfile on every ``PROFILE_SAMPLE_N``-th call and
+        dump the stats to ``instance/profiles``."""
+        if not self.profile_every or next(self._profile_seq) % self.profile_every:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{tag}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{time.monotonic_ns()}.prof"))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: (list(h.counts), h.sum, h.count) for k, h in self._histograms.items()}
+        seen = set()
+        for (name, labels), value in sorted(counters.items(), key=lambda kv: (kv[0][0], str(kv[0][1]))):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in sorted(histograms.items(), key=lambda kv: (kv[0][0], str(kv[0][1]))):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {total}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {count}")
+        for name, help_text, fn, kind in self._gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {fn()}")
+        return "\n".join(lines) + "\n"
+
+def get_metrics() -> Metrics:
+    return current_app.extensions['metrics']
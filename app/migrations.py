@@ -0,0 +1,39 @@
+from sqlalchemy import inspect, text
+from . import db
+
+def upgrade_schema():
+    """Bring an existing database up to the current models.
+
+    ``create_all`` only creates missing tables, so nullable columns and
+    indexes added to existing tables are created here. Rollup tables created
+    for a database that already holds payloads are filled from the raw rows,
+    so statistics do not start from zero. Safe to run on every start;
+    returns the names of the columns and indexes it added (and
+    ``'rollups'`` when it rebuilt them).
+    """
+    from .models import LabelRollup, PayloadRollup
+    from .stats import rebuild_rollups
+    engine = db.engine
+    existing = set(inspect(engine).get_table_names())
+    db.create_all()
+    created = []
+    rollups = {PayloadRollup.__tablename__, LabelRollup.__tablename__}
+    if 'payloads' in existing and not rollups <= existing:
+        rebuild_rollups()
+        created.append('rollups')
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        columns = {c['name'] for c in inspect(engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                with engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                                      f'{column.type.compile(dialect=engine.dialect)}'))
+                created.append(f'{table.name}.{column.name}')
+        present = {ix['name'] for ix in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(engine)
+                created.append(index.name)
+    return created
@@ -1,6 +1,5 @@
 from datetime import datetime, timezone
-import json
-from . import db
+from . import db, jsoncodec
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -11,6 +10,7 @@ class User(db.Model):
 
 class Rule(db.Model):
     __tablename__ = 'rules'
+    __table_args__ = (db.Index('ix_rules_user_priority', 'user_id', 'priority', 'id'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.String(64), db.ForeignKey('users.id'), index=True, nullable=True)
     name = db.Column(db.String(255), nullable=False)
@@ -32,28 +32,118 @@ class RuleCondition(db.Model):
 
     def value(self):
         try:
-            return json.loads(self.value_json)
+            return jsoncodec.loads(self.value_json)
         except Exception:
             return self.value_json
 
+class RuleSetVersion(db.Model):
+    __tablename__ = 'rule_set_versions'
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def _bump(model, uid: str):
+    updated = model.query.filter_by(user_id=uid).update(
+        {model.version: model.version + 1}, synchronize_session=False)
+    if not updated:
+        db.session.add(model(user_id=uid, version=1))
+
+def bump_rules_version(uid: str):
+    """Mark ``uid``'s rule set as changed; call inside the transaction that changes it."""
+    _bump(RuleSetVersion, uid)
+
+class SketchKeyVersion(db.Model):
+    """Change counter for a user's ``SketchKey`` rows, kept apart from the rule
+    set version so choosing sketched keys leaves compiled rules cached."""
+    __tablename__ = 'sketch_key_versions'
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def bump_sketch_keys_version(uid: str):
+    _bump(SketchKeyVersion, uid)
+
+class SelectivityResetVersion(db.Model):
+    """Counts resets of a user's rule selectivity statistics, so every worker
+    drops its sampled statistics and evaluation order, not only the one that
+    served the reset."""
+    __tablename__ = 'selectivity_reset_versions'
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def bump_selectivity_version(uid: str):
+    _bump(SelectivityResetVersion, uid)
+
+class PayloadBody(db.Model):
+    """A stored payload document, shared by every payload with the same content."""
+    __tablename__ = 'payload_bodies'
+    hash = db.Column(db.String(64), primary_key=True)
+    codec = db.Column(db.String(8), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
 class Payload(db.Model):
     __tablename__ = 'payloads'
+    __table_args__ = (db.Index('ix_payloads_user_received', 'user_id', 'received_at'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.String(64), db.ForeignKey('users.id'), index=True, nullable=True)
+    # inline JSON text; empty when the document is stored in payload_bodies
     payload_json = db.Column(db.Text, nullable=False)
+    body_hash = db.Column(db.String(64), db.ForeignKey('payload_bodies.hash'), index=True, nullable=True)
     received_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
 
     labels = db.relationship("PayloadLabel", backref="payload", cascade="all, delete-orphan")
+    body = db.relationship("PayloadBody")
 
     def payload(self):
-        return json.loads(self.payload_json)
+        if self.body_hash is None:
+            return jsoncodec.loads(self.payload_json)
+        from .payload_store import decode_payload
+        return decode_payload(self.payload_json, self.body.codec, self.body.data)
 
 class PayloadLabel(db.Model):
     __tablename__ = 'payload_labels'
+    __table_args__ = (db.Index('ix_payload_labels_label_payload', 'label', 'payload_id'),)
     payload_id = db.Column(db.Integer, db.ForeignKey('payloads.id'), primary_key=True)
     rule_id = db.Column(db.Integer, db.ForeignKey('rules.id'), primary_key=True)
     label = db.Column(db.String(128), index=True, nullable=False)
 
+class PayloadRollup(db.Model):
+    __tablename__ = 'payload_rollups'
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'), primary_key=True)
+    bucket = db.Column(db.BigInteger, primary_key=True)
+    payloads = db.Column(db.Integer, nullable=False, default=0)
+
+class LabelRollup(db.Model):
+    __tablename__ = 'label_rollups'
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'), primary_key=True)
+    bucket = db.Column(db.BigInteger, primary_key=True)
+    label = db.Column(db.String(128), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class RetentionPolicy(db.Model):
+    """Per-user raw payload retention. ``pruned_before`` (epoch seconds, on a
+    rollup bucket boundary) marks the range whose raw rows have been deleted;
+    only rollups answer for it."""
+    __tablename__ = 'retention_policies'
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'), primary_key=True)
+    raw_days = db.Column(db.Integer, nullable=True)
+    pruned_before = db.Column(db.BigInteger, nullable=True)
+
+class SketchKey(db.Model):
+    """A key path a user wants value sketches for; only these are sketched."""
+    __tablename__ = 'sketch_keys'
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'), primary_key=True)
+    key_path = db.Column(db.String(512), primary_key=True)
+
+class KeySketch(db.Model):
+    """Serialized value sketches of one key path over one time bucket, as
+    accumulated by one worker process (``writer``); readers merge them."""
+    __tablename__ = 'key_sketches'
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'), primary_key=True)
+    key_path = db.Column(db.String(512), primary_key=True)
+    bucket = db.Column(db.BigInteger, primary_key=True)
+    writer = db.Column(db.String(32), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.Text, nullable=False)
+
 def seed_demo_data():
     from . import db
     if not User.query.get('demo_user'):
@@ -83,4 +173,5 @@ def seed_demo_data():
         db.session.add(RuleCondition(rule_id=r4.id, group_id=2, key_path='CompanyName', operator='=', value_json='"Amazon"'))
         db.session.add(RuleCondition(rule_id=r4.id, group_id=2, key_path='Price', operator='<', value_json='2.5'))
 
+        bump_rules_version('demo_user')
         db.session.commit()
@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import zlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+from flask import current_app
+from sqlalchemy import update
+from . import db, jsoncodec
+from .models import Payload, PayloadBody
+from .storage import upsert
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+STORAGE_FORMATS = ('inline', 'json', 'zlib', 'zstd')
+
+def storage_codec(fmt: str) -> str:
+    """The codec actually used for ``fmt``; zstd falls back to zlib when the
+    ``zstandard`` package is not installed."""
+    if fmt not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown PAYLOAD_STORAGE {fmt!r}")
+    if fmt == 'zstd' and zstandard is None:
+        log.warning("PAYLOAD_STORAGE=zstd but zstandard is not installed; using zlib")
+        return 'zlib'
+    return fmt
+
+def compress(codec: str, raw: bytes) -> bytes:
+    if codec == 'zlib':
+        return zlib.compress(raw, 6)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return raw
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed payloads need the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return bytes(data)
+
+def decode_payload(payload_json, codec=None, data=None):
+    """Decode a payload from its ``payload_json``/``payload_bodies`` columns."""
+    if codec is None:
+        return jsoncodec.loads(payload_json)
+    return jsoncodec.loads(decompress(codec, data))
+
+def payload_source(q):
+    """Join ``payload_bodies`` onto a ``Payload`` select; add
+    ``*PAYLOAD_COLUMNS`` to its columns and pass them to ``decode_payload``."""
+    return q.outerjoin(PayloadBody, PayloadBody.hash == Payload.body_hash)
+
+PAYLOAD_COLUMNS = (Payload.payload_json, PayloadBody.codec, PayloadBody.data)
+
+@lru_cache(maxsize=256)
+def projection(key_paths: frozenset):
+    """A trie of the parts of a document that ``key_paths`` can reach.
+
+    Leaves are True (keep the whole value). A path is kept whole from its
+    first list index on, so indexing (including negative indexes) resolves
+    exactly as on the full document.
+    """
+    trie = {}
+    for steps in key_paths:
+        node = trie
+        for i, (name, idx) in enumerate(steps):
+            if node.get(name) is True:
+                break
+            if idx is not None or i == len(steps) - 1:
+                node[name] = True
+                break
+            node = node.setdefault(name, {})
+    return trie
+
+def project(doc, trie):
+    if not isinstance(doc, dict):
+        return doc
+    out = {}
+    for name, sub in trie.items():
+        if name in doc:
+            out[name] = doc[name] if sub is True else project(doc[name], sub)
+    return out
+
+def _insert_bodies(bodies: Dict[str, Tuple[str, bytes]]):
+    upsert(db.session, PayloadBody, [{"hash": h, "codec": codec, "data": data} for h, (codec, data) in bodies.items()],
+           ['hash'])
+
+def encode_payloads(key_paths: frozenset, texts: Iterable[str]) -> List[dict]:
+    """Turn serialized payloads into ``payload_json``/``body_hash`` column values
+    for the configured ``PAYLOAD_STORAGE``, inserting any new bodies.
+
+    ``PAYLOAD_PROJECTION`` keeps only what ``key_paths`` reference. Runs in the
+    caller's transaction.
+    """
+    cfg = current_app.config
+    codec = storage_codec(cfg['PAYLOAD_STORAGE'])
+    trie = projection(key_paths) if cfg['PAYLOAD_PROJECTION'] else None
+    out, bodies = [], {}
+    for text in texts:
+        if trie is not None:
+            text = jsoncodec.dumps(project(jsoncodec.loads(text), trie))
+        if codec == 'inline':
+            out.append({"payload_json": text, "body_hash": None})
+            continue
+        raw = text.encode('utf-8')
+        h = hashlib.sha256(raw).hexdigest()
+        if h not in bodies:
+            bodies[h] = (codec, compress(codec, raw))
+        out.append({"payload_json": "", "body_hash": h})
+    _insert_bodies(bodies)
+    return out
+
+def storage_size() -> int:
+    """Approximate bytes held by payload documents (inline text plus bodies)."""
+    inline = db.session.execute(db.select(db.func.coalesce(db.func.sum(db.func.length(Payload.payload_json)), 0))).scalar()
+    bodies = db.session.execute(db.select(db.func.coalesce(db.func.sum(db.func.length(PayloadBody.data)), 0))).scalar()
+    return int(inline) + int(bodies)
+
+def compact_payloads(batch_size: int = 1000, on_progress=None) -> dict:
+    """Rewrite stored payloads into the configured ``PAYLOAD_STORAGE``.
+
+    Rows in another format are re-encoded (and projected, if enabled, using
+    each user's current rules), bodies in another codec are recompressed and
+    bodies no payload references any more are deleted. Commits per batch, so
+    it can be interrupted and re-run.
+    """
+    from .rule_cache import get_rule_set
+    codec = storage_codec(current_app.config['PAYLOAD_STORAGE'])
+    stats = {"bytes_before": storage_size(), "rewritten": 0, "recompressed": 0, "orphans_deleted": 0}
+
+    wrong_format = Payload.body_hash.is_(None) if codec != 'inline' else Payload.body_hash.isnot(None)
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            payload_source(db.select(Payload.id, Payload.user_id, *PAYLOAD_COLUMNS))
+            .where(wrong_format, Payload.id > last_id).order_by(Payload.id).limit(batch_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        by_user: Dict[str, list] = {}
+        for pid, uid, pj, c, data in rows:
+            text = pj if c is None else decompress(c, data).decode('utf-8')
+            by_user.setdefault(uid, []).append((pid, text))
+        updates = []
+        for uid, items in by_user.items():
+            key_paths = get_rule_set(uid).key_paths if uid else frozenset()
+            values = encode_payloads(key_paths, [t for _, t in items])
+            updates.extend({"id": pid, **v} for (pid, _), v in zip(items, values))
+        db.session.execute(update(Payload), updates)
+        db.session.commit()
+        stats["rewritten"] += len(updates)
+        if on_progress:
+            on_progress(stats)
+
+    if codec != 'inline':
+        while True:
+            bodies = db.session.execute(
+                db.select(PayloadBody.hash, PayloadBody.codec, PayloadBody.data)
+                .where(PayloadBody.codec != codec).limit(batch_size)).all()
+            if not bodies:
+                break
+            db.session.execute(update(PayloadBody), [
+                {"hash": h, "codec": codec, "data": compress(codec, decompress(c, data))} for h, c, data in bodies])
+            db.session.commit()
+            stats["recompressed"] += len(bodies)
+
+    stats["orphans_deleted"] = db.session.execute(
+        db.delete(PayloadBody).where(~db.select(Payload.id).where(Payload.body_hash == PayloadBody.hash).exists())
+    ).rowcount
+    db.session.commit()
+    stats["bytes_after"] = storage_size()
+    return stats
@@ -0,0 +1,178 @@
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import insert
+from . import db
+from .models import Payload, PayloadLabel
+from .payload_store import PAYLOAD_COLUMNS, decode_payload, payload_source
+from .rule_cache import get_rule_set
+from .rule_engine import compile_rules
+from .rule_vector import apply_rules_batch
+from .stats import _as_utc, adjust_label_rollups, bucket_of
+
+log = logging.getLogger(__name__)
+
+_worker_rules = None
+
+def _init_worker(rule_dicts):
+    global _worker_rules
+    _worker_rules = compile_rules(rule_dicts)
+
+def _label_rows(rows, rules):
+    """``[(id, payload_json, codec, data)]`` -> ``[(id, rule_ids)]``."""
+    payloads = [decode_payload(*stored) for _, *stored in rows]
+    return [(row[0], rule_ids) for row, (_, rule_ids) in zip(rows, apply_rules_batch(payloads, rules))]
+
+def _label_chunk(rows):
+    return _label_rows(rows, _worker_rules)
+
+class RelabelJob:
+    """Re-evaluate a user's stored payloads against the current rule set.
+
+    Payloads are read in id order, ``chunk_size`` at a time, labeled in a
+    process pool and written back one transaction per chunk: the chunk's
+    ``payload_labels`` rows are replaced and the label rollups adjusted by the
+    difference. ``checkpoint`` is the last payload id whose chunk is committed;
+    pass it back as ``after_id`` to resume. With ``dry_run`` nothing is
+    written and ``label_diff`` holds the per-label change in counts.
+    """
+
+    def __init__(self, uid: str, from_dt: Optional[datetime] = None, to_dt: Optional[datetime] = None,
+                 after_id: int = 0, dry_run: bool = False, workers: int = 0, chunk_size: int = 5000):
+        self.id = uuid.uuid4().hex
+        self.uid = uid
+        self.from_dt = _as_utc(from_dt) if from_dt else None
+        self.to_dt = _as_utc(to_dt) if to_dt else None
+        self.checkpoint = after_id
+        self.dry_run = dry_run
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.state = 'pending'
+        self.error = None
+        self.total = None
+        self.processed = 0
+        self.changed = 0
+        self.label_diff: Counter = Counter()
+        self.started_at = None
+        self.finished_at = None
+        self.on_progress = None
+
+    def _filtered(self, q):
+        q = q.where(Payload.user_id == self.uid)
+        if self.from_dt:
+            q = q.where(Payload.received_at >= self.from_dt)
+        if self.to_dt:
+            q = q.where(Payload.received_at <= self.to_dt)
+        return q
+
+    def _chunks(self):
+        last_id = self.checkpoint
+        while True:
+            rows = db.session.execute(
+                self._filtered(payload_source(db.select(Payload.id, Payload.received_at, *PAYLOAD_COLUMNS)))
+                .where(Payload.id > last_id).order_by(Payload.id).limit(self.chunk_size)).all()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield rows
+
+    def run(self):
+        self.state = 'running'
+        self.started_at = time.time()
+        try:
+            rule_set = get_rule_set(self.uid)
+            labels_by_id = {r.id: r.label for r in rule_set.rules}
+            self.total = db.session.execute(
+                self._filtered(db.select(db.func.count(Payload.id))).where(Payload.id > self.checkpoint)).scalar()
+            if self.workers > 0:
+                ctx = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(self.workers, mp_context=ctx, initializer=_init_worker,
+                                         initargs=([r.to_dict() for r in rule_set.rules],)) as pool:
+                    self._drive(pool, labels_by_id)
+            else:
+                self._drive(None, labels_by_id, rule_set.rules)
+            self.state = 'done'
+        except Exception as e:
+            db.session.rollback()
+            self.state = 'failed'
+            self.error = str(e)
+            log.exception("relabel job %s failed", self.id)
+        self.finished_at = time.time()
+        return self
+
+    def _drive(self, pool, labels_by_id, rules=None):
+        # keep a bounded window of chunks in flight and commit them in id order
+        window = max(1, self.workers * 2)
+        pending = []
+        for rows in self._chunks():
+            meta = {pid: received_at for pid, received_at, *_ in rows}
+            work = [(pid, *stored) for pid, _, *stored in rows]
+            pending.append((meta, pool.submit(_label_chunk, work) if pool else _label_rows(work, rules)))
+            if len(pending) >= window:
+                meta, res = pending.pop(0)
+                self._apply(meta, res.result() if pool else res, labels_by_id)
+        for meta, res in pending:
+            self._apply(meta, res.result() if pool else res, labels_by_id)
+
+    def _apply(self, received: Dict[int, datetime], results: List, labels_by_id: Dict[int, str]):
+        ids = list(received)
+        old: Dict[int, List[str]] = {}
+        for pid, lab in db.session.execute(
+                db.select(PayloadLabel.payload_id, PayloadLabel.label).where(PayloadLabel.payload_id.in_(ids))):
+            old.setdefault(pid, []).append(lab)
+
+        rollup_diff: Counter = Counter()
+        new_rows = []
+        for pid, rule_ids in results:
+            new_labels = [labels_by_id[rid] for rid in rule_ids]
+            before, after = Counter(old.get(pid, [])), Counter(new_labels)
+            if before != after:
+                self.changed += 1
+                bucket = bucket_of(received[pid])
+                for lab in before | after:
+                    rollup_diff[(bucket, lab)] += after[lab] - before[lab]
+            new_rows.extend({"payload_id": pid, "rule_id": rid, "label": labels_by_id[rid]} for rid in rule_ids)
+        for (_, lab), n in rollup_diff.items():
+            self.label_diff[lab] += n
+
+        if not self.dry_run:
+            db.session.execute(db.delete(PayloadLabel).where(PayloadLabel.payload_id.in_(ids)))
+            if new_rows:
+                db.session.execute(insert(PayloadLabel), new_rows)
+            adjust_label_rollups(self.uid, rollup_diff)
+            db.session.commit()
+        else:
+            db.session.rollback()
+        self.processed += len(ids)
+        self.checkpoint = ids[-1]
+        if self.on_progress:
+            self.on_progress(self)
+
+    def status(self) -> dict:
+        return {
+            "id": self.id, "state": self.state, "error": self.error, "dry_run": self.dry_run,
+            "total": self.total, "processed": self.processed, "changed": self.changed,
+            "checkpoint": self.checkpoint,
+            "label_diff": {k: v for k, v in sorted(self.label_diff.items()) if v},
+            "elapsed_seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else 0.0,
+        }
+
+def start_job(app, job: RelabelJob) -> RelabelJob:
+    """Run ``job`` on a background thread; it stays listed in ``app.extensions``."""
+    app.extensions.setdefault('relabel_jobs', {})[job.id] = job
+
+    def target():
+        with app.app_context():
+            try:
+                job.run()
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=target, name=f'relabel-{job.id[:8]}', daemon=True).start()
+    return job
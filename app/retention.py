@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from flask import current_app
+from . import db
+from .models import KeySketch, Payload, PayloadBody, PayloadLabel, RetentionPolicy, User
+from .stats import bucket_of, bucket_start
+
+log = logging.getLogger(__name__)
+
+def effective_days(policy: Optional[RetentionPolicy]) -> int:
+    """Raw retention in days for a user; 0 keeps payloads forever."""
+    if policy is not None and policy.raw_days is not None:
+        return policy.raw_days
+    return current_app.config['RETENTION_DAYS']
+
+def pruned_before(uid: str) -> Optional[int]:
+    return db.session.execute(
+        db.select(RetentionPolicy.pruned_before).where(RetentionPolicy.user_id == uid)).scalar()
+
+def set_policy(uid: str, raw_days: Optional[int]) -> RetentionPolicy:
+    policy = db.session.get(RetentionPolicy, uid)
+    if policy is None:
+        policy = RetentionPolicy(user_id=uid)
+        db.session.add(policy)
+    policy.raw_days = raw_days
+    return policy
+
+def policy_status(uid: str) -> dict:
+    policy = db.session.get(RetentionPolicy, uid)
+    horizon = policy.pruned_before if policy else None
+    return {"raw_days": policy.raw_days if policy else None, "effective_days": effective_days(policy),
+            "pruned_before": bucket_start(horizon).isoformat() if horizon is not None else None}
+
+def prune_user(uid: str, cutoff: datetime, batch_size: int = 1000, pause: float = 0.0) -> int:
+    """Delete ``uid``'s payloads received before ``cutoff`` in small
+    transactions; the rollups are kept, so statistics still cover them.
+    Value sketches of buckets that end before the cutoff are deleted too.
+
+    The cutoff is rounded down to a rollup bucket boundary and recorded as the
+    user's ``pruned_before`` first, so statistics read whole buckets from the
+    rollups for the pruned range.
+
+    Raw rows are deleted in batches rather than dropped by time partition:
+    ``payloads`` is a single table that ingest, export, relabel and
+    statistics all query directly.
+    """
+    horizon = bucket_of(cutoff)
+    cutoff = bucket_start(horizon)
+    policy = db.session.get(RetentionPolicy, uid) or RetentionPolicy(user_id=uid)
+    if policy.pruned_before is None or policy.pruned_before < horizon:
+        policy.pruned_before = horizon
+    db.session.add(policy)
+    prune_sketches(uid, cutoff)
+    db.session.commit()
+
+    deleted = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Payload.id, Payload.body_hash)
+            .where(Payload.user_id == uid, Payload.received_at < cutoff)
+            .order_by(Payload.received_at).limit(batch_size)).all()
+        if not rows:
+            return deleted
+        ids = [pid for pid, _ in rows]
+        hashes = {h for _, h in rows if h is not None}
+        db.session.execute(db.delete(PayloadLabel).where(PayloadLabel.payload_id.in_(ids)))
+        db.session.execute(db.delete(Payload).where(Payload.id.in_(ids)))
+        if hashes:
+            db.session.execute(db.delete(PayloadBody).where(
+                PayloadBody.hash.in_(hashes),
+                ~db.select(Payload.id).where(Payload.body_hash == PayloadBody.hash).exists()))
+        db.session.commit()
+        deleted += len(ids)
+        if pause:
+            time.sleep(pause)
+
+def prune_sketches(uid: str, cutoff: datetime) -> int:
+    """Delete ``uid``'s stored value sketches whose bucket ends before ``cutoff``."""
+    size = current_app.config['SKETCH_BUCKET_SECONDS']
+    return db.session.execute(db.delete(KeySketch).where(
+        KeySketch.user_id == uid, KeySketch.bucket + size <= bucket_of(cutoff, 1))).rowcount
+
+def prune_expired(now: datetime = None, batch_size: int = None, pause: float = 0.0) -> Dict[str, int]:
+    """One pruning pass over every user with a retention period."""
+    now = now or datetime.now(timezone.utc)
+    batch_size = batch_size or current_app.config['RETENTION_PRUNE_BATCH']
+    users = db.session.execute(
+        db.select(User.id, RetentionPolicy)
+        .outerjoin(RetentionPolicy, RetentionPolicy.user_id == User.id)).all()
+    targets = [(uid, effective_days(policy)) for uid, policy in users]
+    db.session.rollback()
+    deleted = {}
+    for uid, days in targets:
+        if days > 0:
+            deleted[uid] = prune_user(uid, now - timedelta(days=days), batch_size, pause)
+    return deleted
+
+class RetentionPruner:
+    """Runs ``prune_expired`` every ``RETENTION_PRUNE_INTERVAL_SECONDS`` on a
+    background thread. Deletes go in ``RETENTION_PRUNE_BATCH`` sized
+    transactions with a short pause between them so ingest is never blocked
+    for long. Started explicitly by the server entry points."""
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['RETENTION_PRUNE_INTERVAL_SECONDS']
+        self.last_run = None
+        self.last_deleted = {}
+        self._stop = threading.Event()
+        self._thread = None
+        app.extensions['retention'] = self
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='retention-pruner', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    self.last_deleted = prune_expired(pause=0.01)
+                    self.last_run = datetime.now(timezone.utc)
+                except Exception:
+                    db.session.rollback()
+                    log.exception("retention pruning failed")
+                finally:
+                    db.session.remove()
+
+    def shutdown(self):
+        self._stop.set()
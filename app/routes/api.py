@@ -1,20 +1,52 @@
-from flask import Blueprint, request, jsonify, send_file
-from sqlalchemy import and_
+from flask import Blueprint, Response, current_app, request, jsonify, send_file, stream_with_context
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import selectinload
 from io import StringIO
 import io, csv
+import base64
+import hashlib
 import json
+import os
 from datetime import datetime, timezone
 from dateutil import parser as dateparser
-from flask_socketio import SocketIO, emit
-from app import socketio 
+from app import socketio, broadcaster
+from ..broadcast import room_for
 
-from .. import db
-from ..models import Rule, RuleCondition, Payload, PayloadLabel
+from .. import db, jsoncodec
+from ..models import (Rule, RuleCondition, SketchKey, bump_rules_version,
+                      bump_selectivity_version, bump_sketch_keys_version)
 from ..services import current_user_id, ensure_user, parse_iso_date, extract_keys_recursive
-from ..rule_engine import apply_rules
+from ..rule_cache import get_rule_set, rules_version
+from ..rule_stats import selectivity_report
+from ..rule_engine import compile_path
+from ..sketches import distributions, get_sketches
+from ..stats import compute_statistics
+from ..export import csv_chunks, gzip_chunks, iter_labeled_pages, ndjson_chunks
+from ..relabel import RelabelJob, start_job
+from ..write_behind import QueueFull, get_write_behind
+from ..metrics import get_metrics
+from ..retention import policy_status, set_policy
+from ..ingest import eval_mode, iter_ndjson_chunks, label_batch, label_payload, parse_batch, parse_payload, store_labeled
 
 api_bp = Blueprint('api', __name__)
 
+@api_bp.route('/keys/extract', methods=['POST'])
+def extract_keys():
+    data = request.get_json(force=True, silent=True)
+    if data is None or not isinstance(data, dict):
+        return jsonify({"error": "Provide a sample JSON object"}), 400
+    keys = extract_keys_recursive(data)
+    return jsonify({"keys": sorted(set(keys))})
+
+_MAX_RULES_PAGE = 5000
+
+def _rule_cursor(rule: Rule) -> str:
+    return base64.urlsafe_b64encode(f"{rule.priority}:{rule.id}".encode()).decode('ascii')
+
+def _parse_rule_cursor(cursor: str):
+    priority, rid = base64.urlsafe_b64decode(cursor.encode('ascii')).decode().split(':')
+    return int(priority), int(rid)
+
 def _serialize_rule(rule: Rule):
     return {
         "id": rule.id,
@@ -28,25 +60,46 @@ def _serialize_rule(rule: Rule):
                 "group": c.group_id,
                 "key_path": c.key_path,
                 "operator": c.operator,
-                "value": json.loads(c.value_json)
+                "value": jsoncodec.loads(c.value_json)
             } for c in rule.conditions
-        ]
+        ],
     }
 
-@api_bp.route('/keys/extract', methods=['POST'])
-def extract_keys():
-    data = request.get_json(force=True, silent=True)
-    if data is None or not isinstance(data, dict):
-        return jsonify({"error": "Provide a sample JSON object"}), 400
-    keys = extract_keys_recursive(data)
-    return jsonify({"keys": sorted(set(keys))})
-
 @api_bp.route('/rules', methods=['GET'])
 def list_rules():
+    """Rules in ``(priority, id)`` order, conditions eager-loaded.
+
+    All of them unless ``limit`` or ``after`` (the ``X-Next-Cursor`` of the
+    previous page) is given; then one page of ``limit`` (default
+    ``RULES_PAGE_SIZE``). The weak ETag is the user's rules version, so
+    ``If-None-Match`` gets a 304 while nothing changed.
+    """
     uid = current_user_id()
-    ensure_user(db.session, uid)
-    rules = Rule.query.filter_by(user_id=uid).order_by(Rule.priority.asc()).all()
-    return jsonify([_serialize_rule(r) for r in rules])
+    etag = f"rules-{hashlib.sha1(uid.encode()).hexdigest()[:8]}-{rules_version(uid)}"
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        paged = 'limit' in request.args or 'after' in request.args
+        try:
+            limit = int(request.args.get('limit', current_app.config['RULES_PAGE_SIZE']))
+            after = _parse_rule_cursor(request.args['after']) if request.args.get('after') else None
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({"error": "invalid limit or cursor"}), 400
+        if paged and not 1 <= limit <= _MAX_RULES_PAGE:
+            return jsonify({"error": f"limit must be between 1 and {_MAX_RULES_PAGE}"}), 400
+        q = (db.select(Rule).options(selectinload(Rule.conditions)).where(Rule.user_id == uid)
+             .order_by(Rule.priority.asc(), Rule.id.asc()))
+        if paged:
+            q = q.limit(limit + 1)
+        if after is not None:
+            q = q.where(or_(Rule.priority > after[0], and_(Rule.priority == after[0], Rule.id > after[1])))
+        rules = db.session.execute(q).scalars().all()
+        resp = jsonify([_serialize_rule(r) for r in (rules[:limit] if paged else rules)])
+        if paged and len(rules) > limit:
+            resp.headers['X-Next-Cursor'] = _rule_cursor(rules[limit - 1])
+    resp.set_etag(etag, weak=True)
+    resp.headers['Vary'] = 'X-User-Id'
+    return resp
 
 @api_bp.route('/rules', methods=['POST'])
 def create_rule():
@@ -82,6 +135,7 @@ def create_rule():
             operator=c['operator'],
             value_json=json.dumps(c.get('value'))
         ))
+    bump_rules_version(uid)
     db.session.commit()
     return jsonify({"message": "created", "id": rule.id}), 201
 
@@ -107,6 +161,7 @@ def update_rule(rid: int):
                 operator=c['operator'],
                 value_json=json.dumps(c.get('value'))
             ))
+    bump_rules_version(uid)
     db.session.commit()
     return jsonify({"message": "updated"})
 
@@ -117,6 +172,7 @@ def delete_rule(rid: int):
     if not rule:
         return jsonify({"error": "rule not found"}), 404
     db.session.delete(rule)
+    bump_rules_version(uid)
     db.session.commit()
     return jsonify({"message": "deleted"})
 
@@ -127,46 +183,77 @@ def toggle_rule(rid: int):
     if not rule:
         return jsonify({"error": "rule not found"}), 404
     rule.active = not rule.active
+    bump_rules_version(uid)
     db.session.commit()
     return jsonify({"message": "toggled", "active": rule.active})
 
+@api_bp.get('/rules/selectivity')
+def rule_selectivity():
+    return jsonify(selectivity_report(get_rule_set(current_user_id())))
+
+@api_bp.delete('/rules/selectivity')
+def reset_rule_selectivity():
+    """Start statistics and evaluation order over in every worker: each one
+    recompiles the rule set when it sees the bumped reset counter."""
+    uid = current_user_id()
+    ensure_user(db.session, uid)
+    bump_selectivity_version(uid)
+    db.session.commit()
+    return jsonify(selectivity_report(get_rule_set(uid)))
+
+def _persist(uid, rule_set, rows, sw=None) -> bool:
+    """Store labeled rows now, or hand them to the write-behind queue.
+    Returns False when the queue rejected them."""
+    writer = get_write_behind()
+    if writer.enabled:
+        try:
+            writer.submit(uid, rule_set, rows)
+        except QueueFull:
+            return False
+        if sw:
+            sw.lap('persist')
+        return True
+    ids, label_counts = store_labeled(uid, rule_set, rows)
+    db.session.commit()
+    if sw:
+        sw.lap('persist')
+    broadcaster.record(uid, len(ids), label_counts)
+    if sw:
+        sw.lap('emit')
+    return True
+
 @api_bp.route('/process', methods=['POST'])
 def process_payload():
+    metrics = get_metrics()
+    with metrics.maybe_profile('process'):
+        return _process_payload(metrics)
+
+def _process_payload(metrics):
+    sw = metrics.stopwatch('ass_process_stage_seconds')
     uid = current_user_id()
-    ensure_user(db.session, uid)
 
-    payload = request.get_json(force=True, silent=True)
-    if payload is None or not isinstance(payload, dict):
+    try:
+        payload, text = parse_payload(request.get_data(cache=False))
+    except ValueError:
         return jsonify({"error": "Payload must be a JSON object"}), 400
+    sw.lap('parse')
 
-    q = Rule.query.filter_by(user_id=uid, active=True).order_by(Rule.priority.asc()).all()
-    rules = []
-    for r in q:
-        conds = []
-        for c in r.conditions:
-            conds.append((c.group_id, c.operator, c.key_path, json.loads(c.value_json)))
-        rules.append({"id": r.id, "label": r.label, "priority": r.priority, "conditions": conds})
-
-    labels, rule_ids = apply_rules(payload, rules)
-
-    single = request.args.get('single_label', 'false').lower() in {'1', 'true', 'yes'}
-    if single and rule_ids:
-        priority_by_id = {r['id']: r['priority'] for r in rules}
-        top_rid = min(rule_ids, key=lambda rid: (priority_by_id.get(rid, 10**9), rid))
-        labels = [next(r['label'] for r in rules if r['id'] == top_rid)]
-        rule_ids = [top_rid]
-
-    p = Payload(user_id=uid, payload_json=json.dumps(payload))
-    db.session.add(p); db.session.flush()
-
-    id_to_label = {r['id']: r['label'] for r in rules}
-    for rid in rule_ids:
-        db.session.add(PayloadLabel(payload_id=p.id, rule_id=rid, label=id_to_label[rid]))
-        
-    db.session.commit()
-
-    stats = statistics().get_json()
-    socketio.emit('stats_update', stats)
+    try:
+        mode = eval_mode(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rule_set = get_rule_set(uid)
+    sw.lap('rule_load')
+    counters = metrics.engine_counters()
+    labels, rule_ids = label_payload(rule_set, payload, mode, counters)
+    metrics.record_engine(counters, rule_ids)
+    get_sketches().observe(uid, rule_set, [payload])
+    metrics.inc('ass_payloads_processed_total', endpoint='process')
+    sw.lap('evaluate')
+
+    rows = [(text, rule_ids)]
+    if not _persist(uid, rule_set, rows, sw):
+        return jsonify({"error": "Ingest queue is full, retry later"}), 503
 
     return jsonify({
         "labels": labels,
@@ -175,89 +262,238 @@ def process_payload():
 
     })
 
-@api_bp.route('/statistics', methods=['GET'])
-def statistics():
+@api_bp.route('/process/batch', methods=['POST'])
+def process_batch():
+    uid = current_user_id()
+
+    try:
+        items = parse_batch(request.get_data(cache=False), request.content_type or '')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    max_items = current_app.config['BATCH_MAX_ITEMS']
+    if len(items) > max_items:
+        return jsonify({"error": f"Batch exceeds {max_items} payloads"}), 413
+
+    try:
+        mode = eval_mode(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rule_set = get_rule_set(uid)
+    results = label_batch(rule_set, [p for p, _ in items], mode)
+    get_sketches().observe(uid, rule_set, (p for p, _ in items))
+    get_metrics().inc('ass_payloads_processed_total', len(results), endpoint='batch')
+
+    rows = [(text, rule_ids) for (_, text), (_, rule_ids) in zip(items, results)]
+    if not _persist(uid, rule_set, rows):
+        return jsonify({"error": "Ingest queue is full, retry later"}), 503
+
+    return jsonify({
+        "count": len(results),
+        "results": [{"labels": labels, "applied_rule_ids": rule_ids} for labels, rule_ids in results],
+        "processed_at": datetime.now(timezone.utc).isoformat()
+    })
+
+@api_bp.route('/process/stream', methods=['POST'])
+def process_stream():
     uid = current_user_id()
-    label = request.args.get('label')
+    try:
+        mode = eval_mode(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rule_set = get_rule_set(uid)
+    chunk_size = current_app.config['STREAM_CHUNK_SIZE']
+    stream = request.stream
+    metrics = get_metrics()
+    sketches = get_sketches()
+
+    def generate():
+        processed = errors = 0
+        for chunk in iter_ndjson_chunks(stream, chunk_size):
+            good = [(lineno, p, text) for lineno, p, text, err in chunk if err is None]
+            results = dict(zip((lineno for lineno, _, _ in good),
+                               label_batch(rule_set, [p for _, p, _ in good], mode)))
+            sketches.observe(uid, rule_set, (p for _, p, _ in good))
+            try:
+                ids, label_counts = store_labeled(uid, rule_set, [(text, results[lineno][1]) for lineno, _, text in good])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            broadcaster.record(uid, len(ids), label_counts)
+            metrics.inc('ass_payloads_processed_total', len(ids), endpoint='stream')
+            out = []
+            for lineno, _, _, err in chunk:
+                if err is not None:
+                    errors += 1
+                    out.append(jsoncodec.dumps({"line": lineno, "error": err}))
+                else:
+                    processed += 1
+                    labels, rule_ids = results[lineno]
+                    out.append(jsoncodec.dumps({"line": lineno, "labels": labels, "applied_rule_ids": rule_ids}))
+            yield "\n".join(out) + "\n"
+        yield jsoncodec.dumps({"summary": {"processed": processed, "errors": errors,
+                                      "processed_at": datetime.now(timezone.utc).isoformat()}}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+_MAX_RELABEL_CHUNK = 50000
+
+@api_bp.route('/relabel', methods=['POST'])
+def start_relabel():
+    uid = current_user_id()
+    body = request.get_json(force=True, silent=True) or {}
+    cfg = current_app.config
+    caps = {"workers": cfg['RELABEL_WORKERS'] or os.cpu_count() or 1, "chunk_size": _MAX_RELABEL_CHUNK}
+    sizes = {"workers": cfg['RELABEL_WORKERS'], "chunk_size": cfg['RELABEL_CHUNK_SIZE']}
+    for name, cap in caps.items():
+        if name in body:
+            n = body[name]
+            if not isinstance(n, int) or isinstance(n, bool) or n < 1:
+                return jsonify({"error": f"{name} must be a positive integer"}), 400
+            sizes[name] = min(n, cap)
+    try:
+        job = RelabelJob(
+            uid,
+            from_dt=parse_iso_date(body['from']) if body.get('from') else None,
+            to_dt=parse_iso_date(body['to']) if body.get('to') else None,
+            after_id=int(body.get('after_id', 0)),
+            dry_run=bool(body.get('dry_run', False)),
+            workers=sizes["workers"],
+            chunk_size=sizes["chunk_size"],
+        )
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid relabel request"}), 400
+    start_job(current_app._get_current_object(), job)
+    return jsonify(job.status()), 202
+
+@api_bp.get('/relabel/<job_id>')
+def relabel_status(job_id: str):
+    job = current_app.extensions.get('relabel_jobs', {}).get(job_id)
+    if not job or job.uid != current_user_id():
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.status())
+
+@api_bp.get('/retention')
+def get_retention():
+    return jsonify(policy_status(current_user_id()))
+
+@api_bp.put('/retention')
+def put_retention():
+    uid = current_user_id()
+    ensure_user(db.session, uid)
+    body = request.get_json(force=True, silent=True) or {}
+    raw_days = body.get('raw_days')
+    if raw_days is not None and (not isinstance(raw_days, int) or isinstance(raw_days, bool) or raw_days < 0):
+        return jsonify({"error": "raw_days must be a non-negative integer or null"}), 400
+    set_policy(uid, raw_days)
+    db.session.commit()
+    return jsonify(policy_status(uid))
+
+@api_bp.get('/metrics')
+def metrics_endpoint():
+    metrics = get_metrics()
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled (set METRICS_ENABLED)"}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@api_bp.get('/ingest/queue')
+def ingest_queue():
+    return jsonify(get_write_behind().status())
+
+def _statistics_args():
     from_s = request.args.get('from')
     to_s = request.args.get('to')
-    from_dt = parse_iso_date(from_s) if from_s else None
-    to_dt = parse_iso_date(to_s) if to_s else None
-
-    q = Payload.query.filter_by(user_id=uid)
-    if from_dt:
-        q = q.filter(Payload.received_at >= from_dt)
-    if to_dt:
-        q = q.filter(Payload.received_at <= to_dt)
-    payloads = q.all()
-    total = len(payloads)
-    by_label = {}
-    if total > 0:
-        ids = [p.id for p in payloads]
-        lab_q = PayloadLabel.query.filter(PayloadLabel.payload_id.in_(ids))
-        if label:
-            lab_q = lab_q.filter(PayloadLabel.label == label)
-        for pl in lab_q.all():
-            by_label[pl.label] = by_label.get(pl.label, 0) + 1
-
-    breakdown = [{"label": k, "count": v, "percentage": (v*100.0/total if total else 0.0)}
-                 for k, v in sorted(by_label.items(), key=lambda x: x[0])]
-    return jsonify({"total_payloads": total, "by_label": breakdown})
+    return {
+        "label": request.args.get('label'),
+        "from_dt": parse_iso_date(from_s) if from_s else None,
+        "to_dt": parse_iso_date(to_s) if to_s else None,
+    }
+
+@api_bp.route('/statistics', methods=['GET'])
+def statistics():
+    return jsonify(compute_statistics(current_user_id(), **_statistics_args()))
+
 
+@api_bp.get('/statistics/distributions')
+def statistics_distributions():
+    uid = current_user_id()
+    keys = [k.strip() for k in request.args.get('keys', '').split(',') if k.strip()]
+    if not keys:
+        keys = [kp for kp, _ in get_rule_set(uid).sketch_paths]
+    try:
+        quantiles = [float(q) for q in request.args.get('quantiles', '0.05,0.25,0.5,0.75,0.95').split(',')]
+        top = int(request.args.get('top', 10))
+    except ValueError:
+        return jsonify({"error": "quantiles must be numbers and top an integer"}), 400
+    if not all(0 <= q <= 1 for q in quantiles) or top < 0:
+        return jsonify({"error": "quantiles must be within [0, 1] and top non-negative"}), 400
+    args = _statistics_args()
+    return jsonify(distributions(uid, keys, args["from_dt"], args["to_dt"], quantiles, top))
+
+@api_bp.get('/statistics/distributions/keys')
+def get_sketch_keys():
+    uid = current_user_id()
+    chosen = db.session.execute(db.select(SketchKey.key_path).where(SketchKey.user_id == uid)
+                                .order_by(SketchKey.key_path)).scalars().all()
+    return jsonify({"keys": chosen, "tracked": [kp for kp, _ in get_rule_set(uid).sketch_paths]})
+
+@api_bp.put('/statistics/distributions/keys')
+def put_sketch_keys():
+    uid = current_user_id()
+    body = request.get_json(force=True, silent=True) or {}
+    keys = body.get('keys')
+    if not isinstance(keys, list) or not all(isinstance(k, str) and k.strip() for k in keys):
+        return jsonify({"error": "keys must be a list of key paths"}), 400
+    keys = sorted({k.strip() for k in keys})
+    bad = [k for k in keys if compile_path(k) is None]
+    if bad:
+        return jsonify({"error": f"invalid key paths: {', '.join(bad)}"}), 400
+    ensure_user(db.session, uid)
+    SketchKey.query.filter_by(user_id=uid).delete()
+    db.session.add_all(SketchKey(user_id=uid, key_path=k) for k in keys)
+    bump_sketch_keys_version(uid)
+    db.session.commit()
+    return get_sketch_keys()
 
 @api_bp.route('/statistics/socket', methods=['GET'])
 def statistics_socket():
     uid = current_user_id()
-    label = request.args.get('label')
-    from_s = request.args.get('from')
-    to_s = request.args.get('to')
-    
-    from_dt = parse_iso_date(from_s) if from_s else None
-    to_dt = parse_iso_date(to_s) if to_s else None
-
-    q = Payload.query.filter_by(user_id=uid)
-
-    if from_dt:
-        q = q.filter(Payload.received_at >= from_dt)
-    if to_dt:
-        q = q.filter(Payload.received_at <= to_dt)
-    
-    payloads = q.all()
-    total = len(payloads)
-    
-    by_label = {}
-    if total > 0:
-        ids = [p.id for p in payloads]
-        lab_q = PayloadLabel.query.filter(PayloadLabel.payload_id.in_(ids))
-        
-        if label:
-            lab_q = lab_q.filter(PayloadLabel.label == label)
-        
-        for pl in lab_q.all():
-            by_label[pl.label] = by_label.get(pl.label, 0) + 1
-
-    breakdown = [{"label": k, "count": v, "percentage": (v*100.0/total if total else 0.0)}
-                 for k, v in sorted(by_label.items(), key=lambda x: x[0])]
-
-    stats = {"total_payloads": total, "by_label": breakdown}
-
-    socketio.emit('stats_update', stats)
+    stats = compute_statistics(uid, **_statistics_args())
+
+    socketio.emit('stats_resync', compute_statistics(uid), to=room_for(uid))
 
     return jsonify(stats)
 
 
 @api_bp.get('/statistics/export')
 def export_statistics():
-    resp = statistics()
-    stats = resp.get_json()
-
-    return generate_csv(stats)
+    return generate_csv(compute_statistics(current_user_id(), **_statistics_args()))
 
 
 @api_bp.get('/statistics/export.csv')
 def export_statistics_csv():
-    resp = statistics()
-    return generate_csv(resp.get_json())
+    return generate_csv(compute_statistics(current_user_id(), **_statistics_args()))
+
+@api_bp.get('/payloads/export')
+def export_payloads():
+    uid = current_user_id()
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in {'csv', 'ndjson'}:
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    keys = [k.strip() for k in request.args.get('keys', '').split(',') if k.strip()]
+    gzipped = request.args.get('gzip', 'false').lower() in {'1', 'true', 'yes'}
+
+    pages = iter_labeled_pages(uid, page_size=current_app.config['EXPORT_PAGE_SIZE'], **_statistics_args())
+    chunks = csv_chunks(pages, keys) if fmt == 'csv' else ndjson_chunks(pages, keys)
+    mimetype = "text/csv" if fmt == 'csv' else "application/x-ndjson"
+    filename = f"payloads_{uid}_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.{fmt}"
+    if gzipped:
+        chunks = gzip_chunks(chunks)
+        mimetype = "application/gzip"
+        filename += ".gz"
+
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 def generate_csv(stats):
     text_buf = io.StringIO(newline="")
@@ -0,0 +1,87 @@
+import threading
+from typing import Dict
+from flask import current_app
+from sqlalchemy.orm import selectinload
+from . import db, jsoncodec
+from .models import Rule, RuleSetVersion, SelectivityResetVersion, SketchKey, SketchKeyVersion
+from .rule_engine import CompiledRule, compile_path, compile_rule
+from .rule_index import RuleMatcher
+from .rule_stats import SelectivityStats
+
+class RuleSet:
+    """A user's active rules, compiled and in priority order."""
+
+    def __init__(self, uid: str, version: int, rules, sketch_keys=(), sketch_version: int = 0):
+        self.uid = uid
+        self.version = version
+        self.rules = rules
+        self.by_id: Dict[int, CompiledRule] = {r.id: r for r in rules}
+        self.matcher = RuleMatcher(rules)
+        self.key_paths = frozenset(c.steps for r in rules for g in r.groups for c in g if c.steps is not None)
+        self.memo_paths = tuple(sorted(self.key_paths, key=repr))
+        self.selectivity = SelectivityStats()
+        self.selectivity_version = 0
+        self.set_sketch_keys(sketch_keys, sketch_version)
+
+    def set_sketch_keys(self, sketch_keys, sketch_version: int):
+        self.sketch_paths = tuple((kp, compile_path(kp)) for kp in sorted(set(sketch_keys)) if compile_path(kp) is not None)
+        self.sketch_version = sketch_version
+
+    def __len__(self):
+        return len(self.rules)
+
+_lock = threading.Lock()
+
+def _cache() -> Dict[str, RuleSet]:
+    return current_app.extensions.setdefault('rule_cache', {})
+
+def rules_version(uid: str) -> int:
+    v = db.session.execute(
+        db.select(RuleSetVersion.version).where(RuleSetVersion.user_id == uid)
+    ).scalar()
+    return v or 0
+
+def _versions(uid: str):
+    """The user's rule set, sketch key and selectivity reset counters, in one query."""
+    counters = [db.select(m.version).where(m.user_id == uid).scalar_subquery()
+                for m in (RuleSetVersion, SketchKeyVersion, SelectivityResetVersion)]
+    return tuple(v or 0 for v in db.session.execute(db.select(*counters)).one())
+
+def _sketch_keys(uid: str):
+    return db.session.execute(db.select(SketchKey.key_path).where(SketchKey.user_id == uid)).scalars().all()
+
+def load_rule_set(uid: str, version: int, sketch_version: int = 0, selectivity_version: int = 0) -> RuleSet:
+    q = (Rule.query.options(selectinload(Rule.conditions))
+         .filter_by(user_id=uid, active=True)
+         .order_by(Rule.priority.asc(), Rule.id.asc()))
+    rules = []
+    for r in q:
+        conds = [(c.group_id, c.operator, c.key_path, jsoncodec.loads(c.value_json)) for c in r.conditions]
+        rules.append(compile_rule({"id": r.id, "label": r.label, "priority": r.priority, "conditions": conds}))
+    rs = RuleSet(uid, version, rules, _sketch_keys(uid), sketch_version)
+    rs.selectivity_version = selectivity_version
+    return rs
+
+def get_rule_set(uid: str) -> RuleSet:
+    """Return the cached rule set for ``uid``, reloading it when the version
+    counter or the selectivity reset counter in the database moved (possibly
+    bumped by another worker). A change to the user's sketched keys only
+    refreshes ``sketch_paths``."""
+    cache = _cache()
+    version, sketch_version, selectivity_version = _versions(uid)
+    rs = cache.get(uid)
+    if rs is not None and rs.version == version and rs.selectivity_version == selectivity_version:
+        if rs.sketch_version != sketch_version:
+            rs.set_sketch_keys(_sketch_keys(uid), sketch_version)
+        return rs
+    rs = load_rule_set(uid, version, sketch_version, selectivity_version)
+    with _lock:
+        cache[uid] = rs
+    return rs
+
+def invalidate(uid: str = None):
+    with _lock:
+        if uid is None:
+            _cache().clear()
+        else:
+            _cache().pop(uid, None)
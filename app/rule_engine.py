@@ -1,31 +1,49 @@
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, List, Tuple, Union
+from functools import lru_cache
 import numbers
+import operator
 
-def get_by_path(obj: Any, path: str):
-    cur = obj
+class _MissingType: pass
+_Missing = _MissingType()
+
+@lru_cache(maxsize=4096)
+def compile_path(path: str):
+    """Tokenize a dot/bracket path into ``(name, index)`` steps.
+
+    ``index`` is None for plain keys. Returns None when the path can never
+    resolve (non-integer index), so callers can treat it as always missing.
+    """
+    steps = []
     for seg in path.replace(']', '').split('.'):
         if seg == '':
             continue
         if '[' in seg:
-            name, idx = seg.split('[')
-            if not isinstance(cur, dict) or name not in cur:
-                return _Missing
-            cur = cur[name]
+            name, idx = seg.split('[', 1)
             try:
                 idx = int(idx)
             except Exception:
-                return _Missing
-            if not isinstance(cur, list) or idx >= len(cur):
-                return _Missing
-            cur = cur[idx]
+                return None
+            steps.append((name, idx))
         else:
-            if not isinstance(cur, dict) or seg not in cur:
+            steps.append((seg, None))
+    return tuple(steps)
+
+def resolve_path(obj: Any, steps):
+    if steps is None:
+        return _Missing
+    cur = obj
+    for name, idx in steps:
+        if not isinstance(cur, dict) or name not in cur:
+            return _Missing
+        cur = cur[name]
+        if idx is not None:
+            if not isinstance(cur, list) or not -len(cur) <= idx < len(cur):
                 return _Missing
-            cur = cur[seg]
+            cur = cur[idx]
     return cur
 
-class _MissingType: pass
-_Missing = _MissingType()
+def get_by_path(obj: Any, path: str):
+    return resolve_path(obj, compile_path(path))
 
 def _coerce_numeric(x):
     if isinstance(x, numbers.Number):
@@ -52,31 +70,94 @@ def _compare(op: str, left, right):
         return left != right
     return False
 
-def evaluate_rule(payload: Dict[str, Any], conditions: List[Tuple[int, str, Any, Any]]):
-    if not conditions:
+_ORDERING_OPS = {'<': operator.lt, '>': operator.gt, '<=': operator.le, '>=': operator.ge}
+
+def _never(_v):
+    return False
+
+def _make_test(op: str, value):
+    if op in _ORDERING_OPS:
+        cmp, rnum = _ORDERING_OPS[op], _coerce_numeric(value)
+        if rnum is None:
+            return _never
+        def test(v):
+            lnum = _coerce_numeric(v)
+            return lnum is not None and cmp(lnum, rnum)
+        return test
+    if op == '=':
+        return lambda v: v == value
+    if op == '!=':
+        return lambda v: v != value
+    return _never
+
+class CompiledCondition:
+    __slots__ = ('op', 'key_path', 'steps', 'value', 'operand', 'test')
+
+    def __init__(self, op: str, key_path: str, value):
+        self.op = op
+        self.key_path = key_path
+        self.steps = compile_path(key_path)
+        self.value = value
+        self.operand = _coerce_numeric(value) if op in _ORDERING_OPS else value
+        self.test = _make_test(op, value)
+
+    def __call__(self, payload) -> bool:
+        v = resolve_path(payload, self.steps)
+        return v is not _Missing and self.test(v)
+
+class CompiledRule:
+    __slots__ = ('id', 'label', 'priority', 'groups')
+
+    def __init__(self, rid, label, priority, groups):
+        self.id = rid
+        self.label = label
+        self.priority = priority
+        self.groups = groups
+
+    def matches(self, payload) -> bool:
+        for conds in self.groups:
+            for cond in conds:
+                if not cond(payload):
+                    break
+            else:
+                return True
         return False
+
+    def to_dict(self) -> Dict:
+        """Plain (picklable) rule dict that ``compile_rule`` turns back into this rule."""
+        return {"id": self.id, "label": self.label, "priority": self.priority,
+                "conditions": [(g, c.op, c.key_path, c.value)
+                               for g, conds in enumerate(self.groups, 1) for c in conds]}
+
+def compile_conditions(conditions: Iterable[Tuple[int, str, Any, Any]]):
+    """Group ``(group, op, key_path, value)`` tuples into a tuple of AND groups,
+    kept in first-appearance order."""
     groups = {}
     for g, op, key_path, val in conditions:
-        groups.setdefault(g, []).append((op, key_path, val))
-    for g_id, conds in groups.items():
-        and_ok = True
-        for op, key_path, val in conds:
-            v = get_by_path(payload, key_path)
-            if v is _Missing:
-                and_ok = False
-                break
-            if not _compare(op, v, val):
-                and_ok = False
-                break
-        if and_ok:
-            return True
-    return False
+        groups.setdefault(g, []).append(CompiledCondition(op, key_path, val))
+    return tuple(tuple(conds) for conds in groups.values())
+
+def compile_rule(rule: Dict) -> CompiledRule:
+    return CompiledRule(rule['id'], rule['label'], rule['priority'],
+                        compile_conditions(rule['conditions']))
+
+def compile_rules(rules: Iterable[Union[Dict, CompiledRule]]) -> List[CompiledRule]:
+    return [r if isinstance(r, CompiledRule) else compile_rule(r) for r in rules]
+
+def evaluate_rule(payload: Dict[str, Any], conditions):
+    if isinstance(conditions, CompiledRule):
+        return conditions.matches(payload)
+    if not conditions:
+        return False
+    return CompiledRule(None, None, None, compile_conditions(conditions)).matches(payload)
 
-def apply_rules(payload: Dict[str, Any], rules: List[Dict]) -> Tuple[List[str], List[int]]:
+def apply_rules(payload: Dict[str, Any], rules: List[Union[Dict, CompiledRule]]) -> Tuple[List[str], List[int]]:
     matched = []
     for r in rules:
-        if evaluate_rule(payload, r['conditions']):
-            matched.append((r['priority'], r['label'], r['id']))
+        if not isinstance(r, CompiledRule):
+            r = compile_rule(r)
+        if r.matches(payload):
+            matched.append((r.priority, r.label, r.id))
     matched.sort(key=lambda x: x[0])
     labels = []
     rule_ids = []
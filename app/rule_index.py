@@ -0,0 +1,208 @@
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Tuple
+from .rule_engine import CompiledRule, _Missing, _coerce_numeric, _never, compile_rules, resolve_path
+
+_INF = float('inf')
+_LOWER = ('>', '>=')
+_UPPER = ('<', '<=')
+
+class _IntervalIndex:
+    """Closed intervals on one key path, answering "which intervals contain x".
+
+    One-sided intervals live in sorted lists (a prefix/suffix is the answer);
+    bounded ones are split over the elementary segments between endpoints.
+    Bounds are widened to inclusive, so the answer may contain extra
+    candidates but never misses one.
+    """
+
+    def __init__(self, intervals: List[Tuple[float, float, Any]]):
+        lower_only = sorted(((lo, e) for lo, hi, e in intervals if hi == _INF and lo != -_INF),
+                            key=lambda t: t[0])
+        upper_only = sorted(((hi, e) for lo, hi, e in intervals if lo == -_INF and hi != _INF),
+                            key=lambda t: t[0])
+        self._lo_keys = [lo for lo, _ in lower_only]
+        self._lo_entries = [e for _, e in lower_only]
+        self._hi_keys = [hi for hi, _ in upper_only]
+        self._hi_entries = [e for _, e in upper_only]
+        self._unbounded = [e for lo, hi, e in intervals if lo == -_INF and hi == _INF]
+
+        bounded = [(lo, hi, e) for lo, hi, e in intervals if lo != -_INF and hi != _INF]
+        self._points = sorted({p for lo, hi, _ in bounded for p in (lo, hi)})
+        # region 2i+1 is the point _points[i]; region 2i is the gap before it
+        self._regions: List[list] = [[] for _ in range(2 * len(self._points) + 1)]
+        for lo, hi, e in bounded:
+            start = 2 * bisect_left(self._points, lo) + 1
+            end = 2 * bisect_left(self._points, hi) + 1
+            for region in range(start, end + 1):
+                self._regions[region].append(e)
+
+    def stab(self, x) -> List:
+        out = list(self._unbounded)
+        if self._lo_keys:
+            out.extend(self._lo_entries[:bisect_right(self._lo_keys, x)])
+        if self._hi_keys:
+            out.extend(self._hi_entries[bisect_left(self._hi_keys, x):])
+        if self._points:
+            i = bisect_left(self._points, x)
+            region = 2 * i + 1 if i < len(self._points) and self._points[i] == x else 2 * i
+            out.extend(self._regions[region])
+        return out
+
+def _range_bounds(conds):
+    lo, hi = -_INF, _INF
+    for c in conds:
+        if c.op in _LOWER:
+            lo = max(lo, c.operand)
+        else:
+            hi = min(hi, c.operand)
+    return lo, hi
+
+class RuleMatcher:
+    """Candidate-based evaluation of a compiled rule set.
+
+    Every AND group is filed under one anchor: an ``=`` condition goes into a
+    hash index on ``(key_path, value)``, otherwise the numeric range its
+    ``<, <=, >, >=`` conditions allow on one key path goes into an interval
+    index. Groups with neither are always candidates. Only candidate groups are
+    evaluated, and results are identical to ``apply_rules``.
+    """
+
+    def __init__(self, rules):
+        self.rules: List[CompiledRule] = compile_rules(rules)
+        self._eq: Dict[tuple, Dict[Any, list]] = {}
+        ranges: Dict[tuple, list] = {}
+        self._always = []
+        for pos, rule in enumerate(self.rules):
+            for group in rule.groups:
+                # a NaN operand never passes =, <, <=, >, >= (but always passes !=)
+                if any(c.steps is None or c.test is _never or c.op != '!=' and c.operand != c.operand for c in group):
+                    continue
+                entry = (pos, rule, group)
+                if self._index_equality(group, entry):
+                    continue
+                ordering = [c for c in group if c.op in _LOWER + _UPPER]
+                if ordering:
+                    steps = ordering[0].steps
+                    lo, hi = _range_bounds([c for c in ordering if c.steps == steps])
+                    if lo != lo or hi != hi or lo > hi:
+                        continue
+                    ranges.setdefault(steps, []).append((lo, hi, entry))
+                else:
+                    self._always.append(entry)
+        self._ranges = {steps: _IntervalIndex(iv) for steps, iv in ranges.items()}
+
+    def _index_equality(self, group, entry) -> bool:
+        for c in group:
+            if c.op != '=':
+                continue
+            try:
+                self._eq.setdefault(c.steps, {}).setdefault(c.value, []).append(entry)
+            except TypeError:
+                continue
+            return True
+        return False
+
+    def candidates(self, payload) -> List:
+        cands = list(self._always)
+        for steps, by_value in self._eq.items():
+            v = resolve_path(payload, steps)
+            if v is _Missing:
+                continue
+            try:
+                hit = by_value.get(v)
+            except TypeError:
+                continue
+            if hit:
+                cands.extend(hit)
+        for steps, index in self._ranges.items():
+            x = _coerce_numeric(resolve_path(payload, steps))
+            if x is None or x != x:
+                continue
+            cands.extend(index.stab(x))
+        return cands
+
+    def match(self, payload, counters=None) -> List[CompiledRule]:
+        """Matching rules in ``apply_rules`` order (priority, then list order).
+
+        ``counters``, a ``[rules, conditions, missing]`` list, switches to a
+        slower path that tallies evaluated rules, evaluated conditions and
+        conditions that failed on a missing key path.
+        """
+        if counters is not None:
+            return self._match_counted(payload, counters)
+        matched = set()
+        for pos, rule, group in self.candidates(payload):
+            if pos in matched:
+                continue
+            for cond in group:
+                if not cond(payload):
+                    break
+            else:
+                matched.add(pos)
+        rules = self.rules
+        return [rules[pos] for pos in sorted(matched, key=lambda p: (rules[p].priority, p))]
+
+    def _match_counted(self, payload, counters) -> List[CompiledRule]:
+        matched, evaluated = set(), set()
+        for pos, rule, group in self.candidates(payload):
+            if pos in matched:
+                continue
+            evaluated.add(pos)
+            for cond in group:
+                counters[1] += 1
+                v = resolve_path(payload, cond.steps)
+                if v is _Missing:
+                    counters[2] += 1
+                    break
+                if not cond.test(v):
+                    break
+            else:
+                matched.add(pos)
+        counters[0] += len(evaluated)
+        rules = self.rules
+        return [rules[pos] for pos in sorted(matched, key=lambda p: (rules[p].priority, p))]
+
+    def apply_limited(self, payload, limit=None, dedup=True, counters=None) -> Tuple[List[str], List[int]]:
+        """Early-exit ``apply``: candidate rules are tried in priority order,
+        stopping once ``limit`` labels are found. With ``dedup`` a rule whose
+        label is already assigned is skipped, so ``rule_ids`` holds only the
+        first rule per label. Labels are always a prefix of ``apply``'s."""
+        groups_of: Dict[int, list] = {}
+        for pos, _, group in self.candidates(payload):
+            groups_of.setdefault(pos, []).append(group)
+        rules = self.rules
+        labels, rule_ids, seen = [], [], set()
+        for pos in sorted(groups_of, key=lambda p: (rules[p].priority, p)):
+            rule = rules[pos]
+            if dedup and rule.label in seen:
+                continue
+            if counters is not None:
+                counters[0] += 1
+            for group in groups_of[pos]:
+                for cond in group:
+                    if counters is not None:
+                        counters[1] += 1
+                        if resolve_path(payload, cond.steps) is _Missing:
+                            counters[2] += 1
+                    if not cond(payload):
+                        break
+                else:
+                    break
+            else:
+                continue
+            rule_ids.append(rule.id)
+            if rule.label not in seen:
+                seen.add(rule.label)
+                labels.append(rule.label)
+                if limit is not None and len(labels) >= limit:
+                    break
+        return labels, rule_ids
+
+    def apply(self, payload, counters=None) -> Tuple[List[str], List[int]]:
+        labels, rule_ids, seen = [], [], set()
+        for r in self.match(payload, counters):
+            if r.label not in seen:
+                seen.add(r.label)
+                labels.append(r.label)
+            rule_ids.append(r.id)
+        return labels, rule_ids
@@ -0,0 +1,111 @@
+import threading
+import time
+from flask import current_app
+from .rule_index import RuleMatcher
+
+_INF = float('inf')
+
+class SelectivityStats:
+    """Sampled runtime statistics for one rule set.
+
+    ``conditions`` maps each compiled condition to ``[evaluations, failures,
+    cost_ns]``; ``groups`` maps an AND group (as a frozenset of its
+    conditions, so it survives reordering) to ``[evaluations, matches,
+    cost_ns]``. Counters are updated without locking and are approximate
+    under concurrency.
+    """
+
+    def __init__(self):
+        self.conditions = {}
+        self.groups = {}
+        self.calls = 0
+        self.samples = 0
+        self.reorders = 0
+        self.lock = threading.Lock()
+
+def observe(rule_set, payload):
+    """Evaluate every condition of every candidate group for ``payload``
+    (no short-circuit, so pass rates are not skewed by the current order)."""
+    stats = rule_set.selectivity
+    clock = time.perf_counter_ns
+    for _, _, group in rule_set.matcher.candidates(payload):
+        matched, group_cost = True, 0
+        for cond in group:
+            t0 = clock()
+            ok = cond(payload)
+            dt = clock() - t0
+            s = stats.conditions.get(cond)
+            if s is None:
+                s = stats.conditions[cond] = [0, 0, 0]
+            s[0] += 1
+            s[1] += not ok
+            s[2] += dt
+            if matched:
+                group_cost += dt
+                matched = ok
+        key = frozenset(group)
+        g = stats.groups.get(key)
+        if g is None:
+            g = stats.groups[key] = [0, 0, 0]
+        g[0] += 1
+        g[1] += matched
+        g[2] += group_cost
+    stats.samples += 1
+
+def _condition_rank(stats, cond):
+    # expected cost per failure: the cheapest, most often failing check goes first
+    evals, fails, cost = stats.conditions.get(cond, (0, 0, 0))
+    return cost / fails if fails else _INF
+
+def _group_rank(stats, group):
+    # most likely to match per unit of cost first
+    evals, matches, cost = stats.groups.get(frozenset(group), (0, 0, 0))
+    return -matches / max(cost, 1) if evals else 0.0
+
+def reorder(rule_set):
+    """Reorder conditions within each AND group and the OR groups of each
+    rule by the observed statistics, then rebuild the matcher. Results are
+    unchanged; only the amount of work done to reach them."""
+    stats = rule_set.selectivity
+    with stats.lock:
+        for rule in rule_set.rules:
+            groups = [tuple(sorted(g, key=lambda c: _condition_rank(stats, c))) for g in rule.groups]
+            rule.groups = tuple(sorted(groups, key=lambda g: _group_rank(stats, g)))
+        rule_set.matcher = RuleMatcher(rule_set.rules)
+        stats.reorders += 1
+
+def maybe_observe(rule_set, payload):
+    """Sample one in ``ADAPTIVE_SAMPLE_N`` evaluations and reorder every
+    ``ADAPTIVE_REORDER_EVERY`` samples. ``ADAPTIVE_SAMPLE_N=0`` disables."""
+    cfg = current_app.config
+    every = cfg['ADAPTIVE_SAMPLE_N']
+    if not every:
+        return
+    stats = rule_set.selectivity
+    stats.calls += 1
+    if stats.calls % every:
+        return
+    observe(rule_set, payload)
+    if stats.samples % cfg['ADAPTIVE_REORDER_EVERY'] == 0:
+        reorder(rule_set)
+
+def selectivity_report(rule_set) -> dict:
+    stats = rule_set.selectivity
+
+    def rate(n, d):
+        return round(n / d, 4) if d else None
+
+    rules = []
+    for rule in rule_set.rules:
+        groups = []
+        for group in rule.groups:
+            g_evals, g_matches, g_cost = stats.groups.get(frozenset(group), (0, 0, 0))
+            conds = []
+            for c in group:
+                evals, fails, cost = stats.conditions.get(c, (0, 0, 0))
+                conds.append({"key_path": c.key_path, "operator": c.op, "value": c.value, "evaluations": evals,
+                              "pass_rate": rate(evals - fails, evals), "avg_cost_ns": rate(cost, evals)})
+            groups.append({"evaluations": g_evals, "match_rate": rate(g_matches, g_evals),
+                           "avg_cost_ns": rate(g_cost, g_evals), "conditions": conds})
+        rules.append({"id": rule.id, "label": rule.label, "priority": rule.priority, "groups": groups})
+    return {"version": rule_set.version, "samples": stats.samples, "reorders": stats.reorders, "rules": rules}
@@ -0,0 +1,159 @@
+from typing import Any, Dict, List, Sequence, Tuple
+import operator
+import numpy as np
+from .rule_engine import CompiledRule, _Missing, _coerce_numeric, compile_rules, resolve_path
+
+_ORDERING_UFUNCS = {'<': operator.lt, '>': operator.gt, '<=': operator.le, '>=': operator.ge}
+_EXACT_FLOAT_INT = 2 ** 53
+
+class _Column:
+    """Values at one key path across a batch, with lazily built numeric and
+    categorical views."""
+
+    def __init__(self, values: List[Any]):
+        self.values = values
+        self.missing = np.fromiter((v is _Missing for v in values), dtype=bool, count=len(values))
+        self._numeric = None
+        self._codes = None
+
+    def numeric(self):
+        """float64 view (NaN where missing or not coercible) and whether it is exact."""
+        if self._numeric is None:
+            nums = np.full(len(self.values), np.nan)
+            exact = True
+            for i, v in enumerate(self.values):
+                if v is _Missing:
+                    continue
+                x = _coerce_numeric(v)
+                if x is None:
+                    continue
+                if not isinstance(x, (int, float)) or isinstance(x, int) and abs(x) > _EXACT_FLOAT_INT:
+                    exact = False
+                nums[i] = x
+            self._numeric = (nums, exact)
+        return self._numeric
+
+    def codes(self):
+        """Integer codes of hashable values (-1 missing, -2 unhashable, -3 NaN)
+        and the value -> code lookup. The dict collapses values that compare
+        equal (1, 1.0, True), matching ``==``; NaN is kept out of it, as the
+        dict would match a NaN object to itself although ``nan == nan`` is
+        False."""
+        if self._codes is None:
+            lookup: Dict[Any, int] = {}
+            codes = np.full(len(self.values), -1, dtype=np.int64)
+            unhashable = []
+            for i, v in enumerate(self.values):
+                if v is _Missing:
+                    continue
+                if isinstance(v, float) and v != v:
+                    codes[i] = -3
+                    continue
+                try:
+                    codes[i] = lookup.setdefault(v, len(lookup))
+                except TypeError:
+                    codes[i] = -2
+                    unhashable.append(i)
+            self._codes = (codes, lookup, unhashable)
+        return self._codes
+
+def _python_mask(col: _Column, cond) -> np.ndarray:
+    return np.fromiter((v is not _Missing and bool(cond.test(v)) for v in col.values),
+                       dtype=bool, count=len(col.values))
+
+def _equal_mask(col: _Column, value) -> np.ndarray:
+    codes, lookup, unhashable = col.codes()
+    try:
+        code = lookup.get(value)
+    except TypeError:
+        mask = np.zeros(len(codes), dtype=bool)
+        for i in unhashable:
+            mask[i] = bool(col.values[i] == value)
+        return mask
+    if code is None or value != value:
+        return np.zeros(len(codes), dtype=bool)
+    return codes == code
+
+def _condition_mask(col: _Column, cond) -> np.ndarray:
+    if cond.op == '=':
+        return _equal_mask(col, cond.value)
+    if cond.op == '!=':
+        return ~_equal_mask(col, cond.value) & ~col.missing
+    if cond.op in _ORDERING_UFUNCS:
+        rnum = cond.operand
+        if rnum is None:
+            return np.zeros(len(col.values), dtype=bool)
+        nums, exact = col.numeric()
+        if not exact or not isinstance(rnum, (int, float)) or isinstance(rnum, int) and abs(rnum) > _EXACT_FLOAT_INT:
+            return _python_mask(col, cond)
+        return _ORDERING_UFUNCS[cond.op](nums, float(rnum))
+    return np.zeros(len(col.values), dtype=bool)
+
+class BatchEvaluator:
+    """Evaluates a rule set over a batch of payloads one condition at a time.
+
+    Each referenced key path is extracted once into a column; each distinct
+    condition becomes a boolean mask over the batch; groups AND their masks
+    and rules OR their groups. Semantics match ``apply_rules``.
+    """
+
+    def __init__(self, payloads: Sequence[Dict[str, Any]]):
+        self.payloads = payloads
+        self._columns: Dict[tuple, _Column] = {}
+        self._masks: Dict[tuple, np.ndarray] = {}
+
+    def column(self, steps) -> _Column:
+        col = self._columns.get(steps)
+        if col is None:
+            col = _Column([resolve_path(p, steps) for p in self.payloads])
+            self._columns[steps] = col
+        return col
+
+    def condition(self, cond) -> np.ndarray:
+        try:
+            key = (cond.steps, cond.op, cond.value)
+            mask = self._masks.get(key)
+        except TypeError:
+            key, mask = None, None
+        if mask is None:
+            mask = _condition_mask(self.column(cond.steps), cond)
+            if key is not None:
+                self._masks[key] = mask
+        return mask
+
+    def rule(self, rule: CompiledRule) -> np.ndarray:
+        out = np.zeros(len(self.payloads), dtype=bool)
+        for group in rule.groups:
+            gmask = None
+            for cond in group:
+                m = self.condition(cond)
+                gmask = m if gmask is None else gmask & m
+                if not gmask.any():
+                    break
+            if gmask is not None:
+                out |= gmask
+        return out
+
+def match_batch(payloads: Sequence[Dict[str, Any]], rules) -> List[List[CompiledRule]]:
+    """Per payload, the matching rules in priority order (a sparse view of the
+    payload x rule match matrix)."""
+    rules = compile_rules(rules)
+    ev = BatchEvaluator(payloads)
+    matched: List[List[CompiledRule]] = [[] for _ in payloads]
+    for pos in sorted(range(len(rules)), key=lambda p: (rules[p].priority, p)):
+        rule = rules[pos]
+        for i in np.flatnonzero(ev.rule(rule)):
+            matched[i].append(rule)
+    return matched
+
+def apply_rules_batch(payloads: Sequence[Dict[str, Any]], rules) -> List[Tuple[List[str], List[int]]]:
+    results = []
+    for rules_matched in match_batch(payloads, rules):
+        labels, rule_ids, seen = [], [], set()
+        for r in rules_matched:
+            if r.label not in seen:
+                seen.add(r.label)
+                labels.append(r.label)
+            rule_ids.append(r.id)
+        results.append((labels, rule_ids))
+    return results
@@ -1,17 +1,28 @@
 import json
 from datetime import datetime
 from dateutil import parser as dateparser
-from flask import request
+from flask import current_app, request
 from .models import User
+from .storage import upsert
 from . import db
 
 def current_user_id():
     return request.headers.get('X-User-Id', 'demo_user')
 
 def ensure_user(db_session, uid: str):
-    if uid and db_session.get(User, uid) is None:
-        db_session.add(User(id=uid, email=None, name=None))
-        db_session.commit()
+    """Create the user row, if missing, inside the caller's transaction.
+
+    Ids found to exist already are remembered per app, so the common case
+    runs no query at all.
+    """
+    if not uid:
+        return
+    known = current_app.extensions.setdefault('known_users', set())
+    if uid in known:
+        return
+    created = upsert(db_session, User, [{"id": uid}], ['id'])
+    if not created:
+        known.add(uid)
 
 def parse_iso_date(s: str):
     try:
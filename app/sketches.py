@@ -0,0 +1,399 @@
+import base64
+import hashlib
+import logging
+import math
+import random
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from flask import current_app
+from . import db, jsoncodec
+from .models import KeySketch
+from .rule_engine import _Missing, resolve_path
+from .services import ensure_user
+from .stats import bucket_of, bucket_start
+from .storage import read_session, upsert
+
+log = logging.getLogger(__name__)
+
+def _hash(item: str) -> int:
+    return int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class QuantileSketch:
+    """KLL quantile sketch over floats. Level ``h`` items weigh ``2**h``;
+    rank error is roughly ``1.7 / k`` with ``O(k)`` items held."""
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.n = 0
+        self.levels: List[list] = [[]]
+
+    def _capacity(self, h: int) -> int:
+        return max(2, math.ceil(self.k * (2 / 3) ** (len(self.levels) - h - 1)))
+
+    def add(self, x: float):
+        self.n += 1
+        self.levels[0].append(x)
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) >= self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append([])
+                items = sorted(self.levels[h])
+                self.levels[h] = [items.pop()] if len(items) % 2 else []
+                self.levels[h + 1].extend(items[random.getrandbits(1)::2])
+            h += 1
+
+    def merge(self, other: 'QuantileSketch'):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, items in enumerate(other.levels):
+            self.levels[h].extend(items)
+        self.n += other.n
+        self._compress()
+
+    def quantiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        weighted = sorted((x, 1 << h) for h, items in enumerate(self.levels) for x in items)
+        total = sum(w for _, w in weighted)
+        out = []
+        for q in qs:
+            if not total:
+                out.append(None)
+                continue
+            target, seen = q * total, 0
+            for x, w in weighted:
+                seen += w
+                if seen >= target:
+                    break
+            out.append(x)
+        return out
+
+    def to_dict(self) -> dict:
+        return {"k": self.k, "n": self.n, "levels": self.levels}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'QuantileSketch':
+        sk = cls(d["k"])
+        sk.n = d["n"]
+        sk.levels = [list(items) for items in d["levels"]]
+        return sk
+
+class FrequencySketch:
+    """Count-min sketch plus the ``top`` items with the highest estimates.
+    Estimates never undercount; the top list may miss items that were only
+    frequent before it filled up."""
+
+    def __init__(self, width: int = 256, depth: int = 4, top: int = 32):
+        self.width, self.depth, self.top_size = width, depth, top
+        self.table = [0] * (width * depth)
+        self.top: Dict[str, int] = {}
+
+    def _cells(self, h: int) -> List[int]:
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        w = self.width
+        return [i * w + (h1 + i * h2) % w for i in range(self.depth)]
+
+    def estimate(self, item: str, h: int = None) -> int:
+        table = self.table
+        return min(table[c] for c in self._cells(_hash(item) if h is None else h))
+
+    def add(self, item: str, h: int):
+        table = self.table
+        cells = self._cells(h)
+        for c in cells:
+            table[c] += 1
+        est = min(table[c] for c in cells)
+        top = self.top
+        if item in top or len(top) < self.top_size:
+            top[item] = est
+            return
+        low = min(top, key=top.get)
+        if est > top[low]:
+            del top[low]
+            top[item] = est
+
+    def merge(self, other: 'FrequencySketch'):
+        self.table = [a + b for a, b in zip(self.table, other.table)]
+        estimates = {item: self.estimate(item) for item in set(self.top) | set(other.top)}
+        self.top = dict(sorted(estimates.items(), key=lambda kv: -kv[1])[:self.top_size])
+
+    def to_dict(self) -> dict:
+        return {"width": self.width, "depth": self.depth, "top_size": self.top_size,
+                "table": self.table, "top": self.top}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'FrequencySketch':
+        sk = cls(d["width"], d["depth"], d["top_size"])
+        sk.table = list(d["table"])
+        sk.top = dict(d["top"])
+        return sk
+
+class DistinctSketch:
+    """HyperLogLog with ``2**p`` registers (about ``1.04 / sqrt(2**p)`` error)."""
+
+    def __init__(self, p: int = 10):
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add(self, h: int):
+        p = self.p
+        rest = h & ((1 << (64 - p)) - 1)
+        rank = 64 - p - rest.bit_length() + 1
+        idx = h >> (64 - p)
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        est = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if est <= 2.5 * m and zeros:
+            est = m * math.log(m / zeros)
+        return round(est)
+
+    def merge(self, other: 'DistinctSketch'):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def to_dict(self) -> dict:
+        return {"p": self.p, "registers": base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'DistinctSketch':
+        sk = cls(d["p"])
+        sk.registers = bytearray(base64.b64decode(d["registers"]))
+        return sk
+
+class ValueSketch:
+    """All sketches of one key path: quantiles of numeric values (numbers and
+    numeric strings, as ordering conditions compare them), top-K of the other
+    values and a distinct count of all of them. Fixed size, whatever the
+    number of values added."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = self.max = None
+        self.numeric = QuantileSketch()
+        self.frequent = FrequencySketch()
+        self.distinct = DistinctSketch()
+
+    def add(self, value):
+        self.count += 1
+        item = jsoncodec.dumps(value, sort_keys=True, default=str)
+        h = _hash(item)
+        self.distinct.add(h)
+        x = None
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            x = float(value)
+        elif isinstance(value, str):
+            try:
+                x = float(value)
+            except ValueError:
+                pass
+        if x is None or not math.isfinite(x):
+            self.frequent.add(item, h)
+            return
+        self.numeric.add(x)
+        self.total += x
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+
+    def merge(self, other: 'ValueSketch'):
+        self.count += other.count
+        self.total += other.total
+        for attr, pick in (('min', min), ('max', max)):
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            setattr(self, attr, theirs if mine is None else mine if theirs is None else pick(mine, theirs))
+        self.numeric.merge(other.numeric)
+        self.frequent.merge(other.frequent)
+        self.distinct.merge(other.distinct)
+
+    def summary(self, quantiles: Iterable[float] = (0.05, 0.25, 0.5, 0.75, 0.95), top: int = 10) -> dict:
+        quantiles = list(quantiles)
+        numeric = None
+        if self.numeric.n:
+            numeric = {"count": self.numeric.n, "min": self.min, "max": self.max,
+                       "mean": self.total / self.numeric.n,
+                       "quantiles": {str(q): v for q, v in zip(quantiles, self.numeric.quantiles(quantiles))}}
+        ranked = sorted(self.frequent.top.items(), key=lambda kv: (-kv[1], kv[0]))[:top]
+        return {"count": self.count, "distinct": self.distinct.estimate(), "numeric": numeric,
+                "top": [{"value": jsoncodec.loads(item), "count": n} for item, n in ranked]}
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "numeric": self.numeric.to_dict(), "frequent": self.frequent.to_dict(),
+                "distinct": self.distinct.to_dict()}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'ValueSketch':
+        sk = cls()
+        sk.count, sk.total, sk.min, sk.max = d["count"], d["total"], d["min"], d["max"]
+        sk.numeric = QuantileSketch.from_dict(d["numeric"])
+        sk.frequent = FrequencySketch.from_dict(d["frequent"])
+        sk.distinct = DistinctSketch.from_dict(d["distinct"])
+        return sk
+
+def _upsert_sketches(rows: List[dict]):
+    upsert(db.session, KeySketch, rows, ['user_id', 'key_path', 'bucket', 'writer'], set_=['count', 'data'])
+
+class SketchStore:
+    """Per-process value sketches keyed by ``(user, key_path, bucket)``.
+
+    Ingest adds each payload's values at the key paths the user registered
+    (``SketchKey`` rows) to the current
+    ``SKETCH_BUCKET_SECONDS`` bucket, in constant time per payload. Every
+    ``SKETCH_FLUSH_SECONDS`` a background thread (started by the server
+    entry points) writes changed sketches to ``key_sketches`` under this
+    process's writer id and drops past buckets from memory. Readers merge
+    stored rows with the live ones.
+
+    Each live sketch has its own lock; the store-wide lock only guards the
+    ``_live`` map and the dirty set, so concurrent batches for different
+    users or key paths do not wait on each other.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = app.config['SKETCHES_ENABLED']
+        self.bucket_seconds = app.config['SKETCH_BUCKET_SECONDS']
+        self.interval = app.config['SKETCH_FLUSH_SECONDS']
+        self.writer = uuid.uuid4().hex
+        self._live: Dict[tuple, tuple] = {}  # key -> (ValueSketch, lock)
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        app.extensions['sketches'] = self
+
+    def observe(self, uid: str, rule_set, payloads: Iterable[dict], when: datetime = None):
+        if not self.enabled or not rule_set.sketch_paths:
+            return
+        bucket = bucket_of(when or datetime.now(timezone.utc), self.bucket_seconds)
+        payloads = list(payloads)
+        for key_path, steps in rule_set.sketch_paths:
+            values = [v for v in (resolve_path(p, steps) for p in payloads) if v is not _Missing]
+            if not values:
+                continue
+            key = (uid, key_path, bucket)
+            with self._lock:
+                entry = self._live.get(key)
+                if entry is None:
+                    entry = self._live[key] = (ValueSketch(), threading.Lock())
+            sketch, lock = entry
+            with lock:
+                for v in values:
+                    sketch.add(v)
+            # marked after the update so a flush racing with it is followed by another;
+            # re-inserted in case that flush dropped a past bucket meanwhile
+            with self._lock:
+                self._live.setdefault(key, entry)
+                self._dirty.add(key)
+
+    def flush(self) -> int:
+        """Write changed sketches in one transaction; returns how many."""
+        current = bucket_of(datetime.now(timezone.utc), self.bucket_seconds)
+        with self._lock:
+            keys = list(self._dirty)
+            entries = [self._live[k] for k in keys]
+            self._dirty.clear()
+        rows = []
+        for (uid, kp, b), (sketch, lock) in zip(keys, entries):
+            with lock:
+                rows.append({"user_id": uid, "key_path": kp, "bucket": b, "writer": self.writer,
+                             "count": sketch.count, "data": jsoncodec.dumps(sketch.to_dict())})
+        if not rows:
+            return 0
+        try:
+            for uid in {r["user_id"] for r in rows}:
+                ensure_user(db.session, uid)
+            _upsert_sketches(rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                self._dirty.update(keys)
+            raise
+        with self._lock:
+            for key in [k for k in self._live if k[2] < current and k not in self._dirty]:
+                del self._live[key]
+        return len(rows)
+
+    def merged(self, uid: str, key_paths: Iterable[str], lo: int = None, hi: int = None) -> Dict[str, ValueSketch]:
+        """Sketches of ``key_paths`` merged over buckets ``lo..hi`` (inclusive)."""
+        key_paths = set(key_paths)
+        in_range = lambda b: (lo is None or b >= lo) and (hi is None or b <= hi)
+        with self._lock:
+            entries = [(k, e) for k, e in self._live.items() if k[0] == uid and k[1] in key_paths and in_range(k[2])]
+        live = {}
+        for k, (sketch, lock) in entries:
+            with lock:
+                live[k] = ValueSketch.from_dict(sketch.to_dict())
+        q = db.select(KeySketch.key_path, KeySketch.bucket, KeySketch.writer, KeySketch.data).where(
+            KeySketch.user_id == uid, KeySketch.key_path.in_(key_paths))
+        if lo is not None:
+            q = q.where(KeySketch.bucket >= lo)
+        if hi is not None:
+            q = q.where(KeySketch.bucket <= hi)
+        with read_session() as session:
+            rows = session.execute(q).all()
+        out = {kp: ValueSketch() for kp in key_paths}
+        for kp, bucket, writer, data in rows:
+            if writer == self.writer and (uid, kp, bucket) in live:
+                continue
+            out[kp].merge(ValueSketch.from_dict(jsoncodec.loads(data)))
+        for (_, kp, _), sketch in live.items():
+            out[kp].merge(sketch)
+        return out
+
+    def start(self):
+        if not self.enabled or self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='sketch-flusher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._flush_logged()
+
+    def _flush_logged(self):
+        with self.app.app_context():
+            try:
+                self.flush()
+            except Exception:
+                log.exception("sketch flush failed")
+            finally:
+                db.session.remove()
+
+    def shutdown(self):
+        self._stop.set()
+        if self.enabled:
+            self._flush_logged()
+
+def get_sketches() -> SketchStore:
+    return current_app.extensions['sketches']
+
+def distributions(uid: str, key_paths: Iterable[str], from_dt: datetime = None, to_dt: datetime = None,
+                  quantiles: Iterable[float] = (0.05, 0.25, 0.5, 0.75, 0.95), top: int = 10) -> dict:
+    """Value distributions per key path over the buckets overlapping
+    ``[from_dt, to_dt]``; window edges are widened to whole buckets. Without
+    ``from_dt`` the window is the ``SKETCH_WINDOW_HOURS`` before ``to_dt``
+    (or now); 0 means all history."""
+    window = current_app.config['SKETCH_WINDOW_HOURS']
+    if from_dt is None and window:
+        from_dt = (to_dt or datetime.now(timezone.utc)) - timedelta(hours=window)
+    store = get_sketches()
+    size = store.bucket_seconds
+    lo = bucket_of(from_dt, size) if from_dt else None
+    hi = bucket_of(to_dt, size) if to_dt else None
+    merged = store.merged(uid, key_paths, lo, hi)
+    return {
+        "from": bucket_start(lo).isoformat() if lo is not None else None,
+        "to": bucket_start(hi + size).isoformat() if hi is not None else None,
+        "bucket_seconds": size,
+        "keys": {kp: merged[kp].summary(quantiles, top) for kp in sorted(merged)},
+    }
@@ -1,5 +1,6 @@
 const API_BASE = "/api";
 const USER_HEADER = { "X-User-Id": "demo_user" };
+const RULES_PAGE = 500;
 
 function tryParseJSON(text) {
   try {
@@ -139,54 +140,110 @@ async function saveRule() {
   }
 }
 
+let rulesEtag = null;
+const ruleRows = new Map(); // rule id -> { json, el }
+
+function renderRuleRow(r) {
+  const item = document.createElement("div");
+  item.className =
+    "list-group-item d-flex justify-content-between align-items-start";
+  const info = document.createElement("div");
+  info.innerHTML = `<div><b>${
+    r.name
+  }</b> — <span class="badge bg-secondary">${r.label}</span> <small>(p:${
+    r.priority
+  })</small> ${
+    r.active ? "" : '<span class="badge bg-warning text-dark">disabled</span>'
+  }</div>
+                    <div class="text-muted">${
+                      r.conditions.length
+                    } condition(s), ${
+    new Set(r.conditions.map((c) => c.group)).size
+  } group(s)</div>`;
+  const actions = document.createElement("div");
+  const toggle = document.createElement("button");
+  toggle.className = "btn btn-sm btn-outline-secondary me-1";
+  toggle.textContent = "Toggle";
+  toggle.onclick = async () => {
+    const res = await fetch(`${API_BASE}/rules/${r.id}/toggle`, {
+      method: "POST",
+      headers: USER_HEADER,
+    });
+    if (res.ok) {
+      const { active } = await res.json();
+      putRuleRow({ ...r, active });
+    }
+  };
+  const del = document.createElement("button");
+  del.className = "btn btn-sm btn-outline-danger";
+  del.textContent = "Delete";
+  del.onclick = async () => {
+    const res = await fetch(`${API_BASE}/rules/${r.id}`, {
+      method: "DELETE",
+      headers: USER_HEADER,
+    });
+    if (res.ok) removeRuleRow(r.id);
+  };
+  actions.appendChild(toggle);
+  actions.appendChild(del);
+  item.appendChild(info);
+  item.appendChild(actions);
+  return item;
+}
+
+// Insert or replace one row; returns its element. Unchanged rules keep theirs.
+function putRuleRow(r) {
+  const json = JSON.stringify(r);
+  const row = ruleRows.get(r.id);
+  if (row && row.json === json) return row.el;
+  const el = renderRuleRow(r);
+  if (row) {
+    row.el.replaceWith(el);
+  } else {
+    document.getElementById("rules-list").appendChild(el);
+  }
+  ruleRows.set(r.id, { json, el });
+  return el;
+}
+
+function removeRuleRow(id) {
+  const row = ruleRows.get(id);
+  if (row) {
+    row.el.remove();
+    ruleRows.delete(id);
+  }
+}
+
+async function fetchAllRules() {
+  const rules = [];
+  let cursor = null;
+  do {
+    const url = `${API_BASE}/rules?limit=${RULES_PAGE}${cursor ? `&after=${cursor}` : ""}`;
+    const headers = { ...USER_HEADER };
+    if (!cursor && rulesEtag) headers["If-None-Match"] = rulesEtag;
+    const res = await fetch(url, { headers });
+    if (res.status === 304) return null;
+    if (!cursor) rulesEtag = res.headers.get("ETag");
+    rules.push(...(await res.json()));
+    cursor = res.headers.get("X-Next-Cursor");
+  } while (cursor);
+  return rules;
+}
+
 async function loadRules() {
+  const rules = await fetchAllRules();
+  if (rules === null) return; // unchanged since the last load
   const list = document.getElementById("rules-list");
-  list.innerHTML = "";
-  const res = await fetch(`${API_BASE}/rules`, { headers: USER_HEADER });
-  const rules = await res.json();
+  const seen = new Set(rules.map((r) => r.id));
+  Array.from(ruleRows.keys())
+    .filter((id) => !seen.has(id))
+    .forEach(removeRuleRow);
+  let prev = null;
   rules.forEach((r) => {
-    const item = document.createElement("div");
-    item.className =
-      "list-group-item d-flex justify-content-between align-items-start";
-    const info = document.createElement("div");
-    info.innerHTML = `<div><b>${
-      r.name
-    }</b> — <span class="badge bg-secondary">${r.label}</span> <small>(p:${
-      r.priority
-    })</small> ${
-      r.active ? "" : '<span class="badge bg-warning text-dark">disabled</span>'
-    }</div>
-                      <div class="text-muted">${
-                        r.conditions.length
-                      } condition(s), ${
-      new Set(r.conditions.map((c) => c.group)).size
-    } group(s)</div>`;
-    const actions = document.createElement("div");
-    const toggle = document.createElement("button");
-    toggle.className = "btn btn-sm btn-outline-secondary me-1";
-    toggle.textContent = "Toggle";
-    toggle.onclick = async () => {
-      await fetch(`${API_BASE}/rules/${r.id}/toggle`, {
-        method: "POST",
-        headers: USER_HEADER,
-      });
-      loadRules();
-    };
-    const del = document.createElement("button");
-    del.className = "btn btn-sm btn-outline-danger";
-    del.textContent = "Delete";
-    del.onclick = async () => {
-      await fetch(`${API_BASE}/rules/${r.id}`, {
-        method: "DELETE",
-        headers: USER_HEADER,
-      });
-      loadRules();
-    };
-    actions.appendChild(toggle);
-    actions.appendChild(del);
-    item.appendChild(info);
-    item.appendChild(actions);
-    list.appendChild(item);
+    const el = putRuleRow(r);
+    const expected = prev ? prev.nextSibling : list.firstChild;
+    if (el !== expected) list.insertBefore(el, expected);
+    prev = el;
   });
 }
 
@@ -2,6 +2,7 @@ const API_BASE = "/api";
 const USER_HEADER = { "X-User-Id": "demo_user" };
 
 let pieChart, barChart;
+let currentStats = null;
 
 const labelColors = {
   Green: "#28a745",
@@ -13,6 +14,7 @@ const socket = io("/", {
   path: "/socket.io",
   transports: ["websocket", "polling"],
   upgrade: true,
+  auth: { user_id: USER_HEADER["X-User-Id"] },
 });
 
 socket.on("connect", () => {
@@ -20,17 +22,33 @@ socket.on("connect", () => {
 });
 
 function updateStats(stats) {
+  currentStats = stats;
   document.getElementById("total-count").textContent =
     stats.total_payloads ?? 0;
 
-  console.log("stats", stats);
-
   const labels = stats.by_label.map((r) => r.label);
   const counts = stats.by_label.map((r) => r.count);
   const colors = labels.map((label) => labelColors[label] || "#6c757d");
 
+  if (pieChart && barChart) {
+    pieChart.data.labels = labels;
+    Object.assign(pieChart.data.datasets[0], {
+      data: counts,
+      backgroundColor: colors,
+      hoverBackgroundColor: colors,
+    });
+    barChart.data.labels = labels;
+    Object.assign(barChart.data.datasets[0], {
+      data: counts,
+      backgroundColor: colors,
+      borderColor: colors,
+    });
+    pieChart.update("none");
+    barChart.update("none");
+    return;
+  }
+
   const pieCtx = document.getElementById("pieChart");
-  if (pieChart) pieChart.destroy();
   pieChart = new Chart(pieCtx, {
     type: "pie",
     data: {
@@ -52,7 +70,6 @@ function updateStats(stats) {
   });
 
   const barCtx = document.getElementById("barChart");
-  if (barChart) barChart.destroy();
   barChart = new Chart(barCtx, {
     type: "bar",
     data: {
@@ -79,9 +96,39 @@ function updateStats(stats) {
   });
 }
 
-socket.on("stats_update", function (stats) {
-  console.log("stats_update");
-  updateStats(stats);
+function hasFilters() {
+  return ["filter-label", "filter-from", "filter-to"].some(
+    (id) => document.getElementById(id).value.trim() !== ""
+  );
+}
+
+// Full unfiltered statistics, sent when this client subscribes.
+socket.on("stats_resync", function (stats) {
+  if (!hasFilters()) updateStats(stats);
+});
+
+// Increments since the previous tick: {total_payloads, by_label: {label: n}}.
+socket.on("stats_delta", function (delta) {
+  if (!currentStats) return;
+  if (document.getElementById("filter-to").value.trim() !== "") return;
+  const labelFilter = document.getElementById("filter-label").value.trim();
+  const counts = {};
+  currentStats.by_label.forEach((r) => (counts[r.label] = r.count));
+  Object.entries(delta.by_label || {}).forEach(([label, n]) => {
+    if (labelFilter && label !== labelFilter) return;
+    counts[label] = (counts[label] || 0) + n;
+  });
+  const total = (currentStats.total_payloads || 0) + delta.total_payloads;
+  updateStats({
+    total_payloads: total,
+    by_label: Object.keys(counts)
+      .sort()
+      .map((label) => ({
+        label,
+        count: counts[label],
+        percentage: total ? (counts[label] * 100.0) / total : 0.0,
+      })),
+  });
 });
 
 function setExportHref() {
@@ -0,0 +1,165 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+from flask import current_app
+from sqlalchemy import func
+from . import db
+from .models import LabelRollup, Payload, PayloadLabel, PayloadRollup, RetentionPolicy
+from .storage import read_session, upsert
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+def _bucket_size() -> int:
+    return current_app.config['ROLLUP_BUCKET_SECONDS']
+
+def bucket_of(dt: datetime, size: int = None) -> int:
+    """Epoch second at which the rollup bucket containing ``dt`` starts."""
+    size = size or _bucket_size()
+    return (_as_utc(dt) - EPOCH) // timedelta(seconds=size) * size
+
+def bucket_start(bucket: int) -> datetime:
+    return EPOCH + timedelta(seconds=bucket)
+
+def _upsert_increment(model, key_cols, value_col, rows):
+    upsert(db.session, model, rows, key_cols, add=[value_col])
+
+def record_rollups(uid: str, when: datetime, payloads: int, label_counts: Dict[str, int]):
+    """Add ingested counts to ``when``'s bucket; runs in the ingest transaction."""
+    bucket = bucket_of(when)
+    _upsert_increment(PayloadRollup, ['user_id', 'bucket'], 'payloads',
+                      [{"user_id": uid, "bucket": bucket, "payloads": payloads}])
+    _upsert_increment(LabelRollup, ['user_id', 'bucket', 'label'], 'count',
+                      [{"user_id": uid, "bucket": bucket, "label": lab, "count": n}
+                       for lab, n in label_counts.items() if n])
+
+def adjust_label_rollups(uid: str, diff: Dict[tuple, int]):
+    """Apply ``{(bucket, label): delta}`` corrections, e.g. after relabeling."""
+    _upsert_increment(LabelRollup, ['user_id', 'bucket', 'label'], 'count',
+                      [{"user_id": uid, "bucket": b, "label": lab, "count": n}
+                       for (b, lab), n in diff.items() if n])
+
+def _raw_counts(session, uid: str, label: Optional[str], lo: Optional[datetime], hi: Optional[datetime],
+                hi_inclusive: bool = True):
+    """Count payloads and label rows in a time range without loading rows:
+    one COUNT over payloads and one COUNT/GROUP BY label join, both served by
+    ix_payloads_user_received (and ix_payload_labels_label_payload when a
+    label is given)."""
+    def bounded(q):
+        if lo is not None:
+            q = q.where(Payload.received_at >= lo)
+        if hi is not None:
+            q = q.where(Payload.received_at <= hi if hi_inclusive else Payload.received_at < hi)
+        return q
+
+    total = session.execute(
+        bounded(db.select(func.count(Payload.id)).where(Payload.user_id == uid))
+    ).scalar() or 0
+    q = bounded(db.select(PayloadLabel.label, func.count())
+                .join(Payload, Payload.id == PayloadLabel.payload_id)
+                .where(Payload.user_id == uid))
+    if label:
+        q = q.where(PayloadLabel.label == label)
+    by_label = Counter(dict(session.execute(q.group_by(PayloadLabel.label)).all()))
+    return total, by_label
+
+def _rollup_counts(session, uid: str, label: Optional[str], first: Optional[int], end: Optional[int]):
+    def bounded(q, model):
+        if first is not None:
+            q = q.where(model.bucket >= first)
+        if end is not None:
+            q = q.where(model.bucket < end)
+        return q
+
+    total = session.execute(
+        bounded(db.select(func.sum(PayloadRollup.payloads)).where(PayloadRollup.user_id == uid), PayloadRollup)
+    ).scalar() or 0
+    q = bounded(db.select(LabelRollup.label, func.sum(LabelRollup.count))
+                .where(LabelRollup.user_id == uid), LabelRollup)
+    if label:
+        q = q.where(LabelRollup.label == label)
+    by_label = Counter({lab: int(n) for lab, n in session.execute(q.group_by(LabelRollup.label)).all() if n})
+    return int(total), by_label
+
+def compute_statistics(uid: str, label: Optional[str] = None,
+                       from_dt: Optional[datetime] = None, to_dt: Optional[datetime] = None) -> dict:
+    """Totals and label breakdown for ``[from_dt, to_dt]``.
+
+    Whole buckets inside the range are read from the rollup tables; the
+    partial buckets at either edge are counted from raw rows. An edge that
+    falls before the user's retention horizon, where raw rows are gone, is
+    widened to its whole bucket. With ``STATS_ROLLUPS`` off the whole range
+    is counted from raw rows (so pruned payloads are not included).
+    """
+    with read_session() as session:
+        return _compute_statistics(session, uid, label, from_dt, to_dt)
+
+def _compute_statistics(session, uid, label, from_dt, to_dt) -> dict:
+    lo = _as_utc(from_dt) if from_dt else None
+    hi = _as_utc(to_dt) if to_dt else None
+    size = _bucket_size()
+
+    first = None
+    if lo is not None:
+        first = bucket_of(lo, size)
+        if bucket_start(first) < lo:
+            first += size
+    end = bucket_of(hi, size) if hi is not None else None
+    horizon = session.execute(
+        db.select(RetentionPolicy.pruned_before).where(RetentionPolicy.user_id == uid)).scalar()
+    if horizon is not None:
+        if lo is not None and bucket_of(lo, size) < horizon:
+            first = bucket_of(lo, size)
+        if hi is not None and end < horizon:
+            end += size
+
+    if not current_app.config['STATS_ROLLUPS'] or first is not None and end is not None and first >= end:
+        total, by_label = _raw_counts(session, uid, label, lo, hi)
+    else:
+        total, by_label = _rollup_counts(session, uid, label, first, end)
+        if lo is not None and bucket_start(first) > lo:
+            t, c = _raw_counts(session, uid, label, lo, bucket_start(first), hi_inclusive=False)
+            total += t; by_label.update(c)
+        if hi is not None and bucket_start(end) <= hi:
+            t, c = _raw_counts(session, uid, label, bucket_start(end), hi)
+            total += t; by_label.update(c)
+
+    breakdown = [{"label": k, "count": v, "percentage": (v*100.0/total if total else 0.0)}
+                 for k, v in sorted(by_label.items(), key=lambda x: x[0])]
+    return {"total_payloads": total, "by_label": breakdown}
+
+def rebuild_rollups(batch_size: int = 10000):
+    """Recompute both rollup tables from raw payload rows. Buckets before a
+    user's retention horizon have no raw rows left and are kept as they are."""
+    size = _bucket_size()
+    payloads: Counter = Counter()
+    labels: Counter = Counter()
+    rows = db.session.execute(
+        db.select(Payload.user_id, Payload.received_at).execution_options(yield_per=batch_size))
+    for uid, received_at in rows:
+        payloads[(uid, bucket_of(received_at, size))] += 1
+    rows = db.session.execute(
+        db.select(Payload.user_id, Payload.received_at, PayloadLabel.label)
+        .join(PayloadLabel, PayloadLabel.payload_id == Payload.id)
+        .execution_options(yield_per=batch_size))
+    for uid, received_at, lab in rows:
+        labels[(uid, bucket_of(received_at, size), lab)] += 1
+
+    for model in (PayloadRollup, LabelRollup):
+        db.session.execute(db.delete(model).where(~db.select(RetentionPolicy.user_id).where(
+            RetentionPolicy.user_id == model.user_id, RetentionPolicy.pruned_before > model.bucket).exists()))
+    _insert_many(PayloadRollup, [{"user_id": u, "bucket": b, "payloads": n}
+                                 for (u, b), n in payloads.items()], batch_size)
+    _insert_many(LabelRollup, [{"user_id": u, "bucket": b, "label": lab, "count": n}
+                               for (u, b, lab), n in labels.items()], batch_size)
+    db.session.commit()
+    return len(payloads), len(labels)
+
+def _insert_many(model, rows: Iterable[dict], batch_size: int):
+    rows = list(rows)
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(db.insert(model), rows[i:i + batch_size])
@@ -0,0 +1,125 @@
+import importlib
+from contextlib import contextmanager
+from typing import List, Sequence
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from . import db
+
+STORAGE_PROFILES = ('default', 'throughput')
+READ_BIND = 'stats_read'
+
+def _sqlite_file(uri: str):
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:') or url.database.startswith('file:'):
+        return None
+    return url.database
+
+def configure(app):
+    """Set engine options for ``STORAGE_PROFILE`` before ``db.init_app``.
+
+    ``throughput`` (SQLite files only): a larger connection pool, a busy
+    timeout instead of immediate "database is locked" errors, and a separate
+    read-only engine that statistics reads use. ``STATS_READ_DATABASE_URL``
+    sets that read engine explicitly (e.g. a replica) for any backend.
+    """
+    cfg = app.config
+    if cfg['STORAGE_PROFILE'] not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown STORAGE_PROFILE {cfg['STORAGE_PROFILE']!r}")
+    read_uri = cfg['STATS_READ_DATABASE_URL']
+    path = _sqlite_file(cfg['SQLALCHEMY_DATABASE_URI'])
+    if cfg['STORAGE_PROFILE'] == 'throughput' and path:
+        options = cfg.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        options.setdefault('pool_size', cfg['SQLITE_POOL_SIZE'])
+        options.setdefault('max_overflow', cfg['SQLITE_POOL_SIZE'])
+        options.setdefault('connect_args', {}).setdefault('timeout', cfg['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0)
+        read_uri = read_uri or f"sqlite:///file:{path}?mode=ro&uri=true"
+    if read_uri:
+        cfg['SQLALCHEMY_BINDS'] = {**(cfg.get('SQLALCHEMY_BINDS') or {}), READ_BIND: read_uri}
+
+def install(app):
+    """Apply the profile's per-connection SQLite pragmas; call after ``db.init_app``."""
+    cfg = app.config
+    if cfg['STORAGE_PROFILE'] != 'throughput' or not _sqlite_file(cfg['SQLALCHEMY_DATABASE_URI']):
+        return
+    pragmas = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA cache_size=-{cfg['SQLITE_CACHE_KB']}",
+        f"PRAGMA mmap_size={cfg['SQLITE_MMAP_BYTES']}",
+        f"PRAGMA busy_timeout={cfg['SQLITE_BUSY_TIMEOUT_MS']}",
+        "PRAGMA temp_store=MEMORY",
+    )
+    with app.app_context():
+        engines = [db.engines[None]] + ([db.engines[READ_BIND]] if READ_BIND in db.engines else [])
+
+    def listener(statements):
+        def on_connect(dbapi_conn, _record):
+            cur = dbapi_conn.cursor()
+            for pragma in statements:
+                cur.execute(pragma)
+            cur.close()
+        return on_connect
+
+    event.listen(engines[0], 'connect', listener(pragmas))
+    for engine in engines[1:]:
+        event.listen(engine, 'connect', listener(pragmas[1:]))
+    # create the WAL files up front so read-only connections can open the database
+    with engines[0].connect():
+        pass
+
+@contextmanager
+def read_session():
+    """A session on the read engine if one is configured, else ``db.session``."""
+    engine = db.engines.get(READ_BIND)
+    if engine is None:
+        yield db.session
+        return
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+
+_ON_CONFLICT = {'postgresql': 'sqlalchemy.dialects.postgresql', 'sqlite': 'sqlalchemy.dialects.sqlite'}
+
+def upsert(session, model, rows: List[dict], keys: Sequence[str], set_: Sequence[str] = (),
+           add: Sequence[str] = ()) -> int:
+    """Insert ``rows``; where a row with the same ``keys`` exists, overwrite its
+    ``set_`` columns, increment its ``add`` columns by the new values, or
+    (with neither) leave it alone. Returns the rowcount.
+
+    PostgreSQL and SQLite use ``INSERT ... ON CONFLICT``. Other dialects look
+    each row up and then insert or update it, which is not atomic against a
+    concurrent insert of the same key.
+    """
+    if not rows:
+        return 0
+    module = _ON_CONFLICT.get(session.get_bind().dialect.name)
+    if module is None:
+        return _upsert_generic(session, model, rows, keys, set_, add)
+    table = model.__table__
+    stmt = importlib.import_module(module).insert(table)
+    values = {c: stmt.excluded[c] for c in set_}
+    values.update({c: table.c[c] + stmt.excluded[c] for c in add})
+    if values:
+        stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_=values)
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=list(keys))
+    return session.execute(stmt, rows[0] if len(rows) == 1 else rows).rowcount
+
+def _upsert_generic(session, model, rows, keys, set_=(), add=()) -> int:
+    table = model.__table__
+    count = 0
+    for row in rows:
+        where = [table.c[k] == row[k] for k in keys]
+        if session.execute(db.select(*[table.c[k] for k in keys]).where(*where)).first() is None:
+            session.execute(table.insert().values(**row))
+        elif set_ or add:
+            values = {c: row[c] for c in set_}
+            values.update({c: table.c[c] + row[c] for c in add})
+            session.execute(table.update().where(*where).values(**values))
+        else:
+            continue
+        count += 1
+    return count
@@ -0,0 +1,139 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+from . import db
+
+log = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    pass
+
+class WriteBehindQueue:
+    """Bounded in-process queue of labeled payloads awaiting persistence.
+
+    Requests enqueue ``(uid, rule_set, rows, received_at)`` and return; one
+    background writer drains up to ``WRITE_BEHIND_FLUSH_SIZE`` items, or
+    whatever arrived within ``WRITE_BEHIND_FLUSH_INTERVAL_MS``, per
+    transaction. When the queue is full ``submit`` waits up to
+    ``WRITE_BEHIND_BLOCK_SECONDS`` and then raises QueueFull.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = app.config['WRITE_BEHIND']
+        self.flush_size = app.config['WRITE_BEHIND_FLUSH_SIZE']
+        self.flush_interval = app.config['WRITE_BEHIND_FLUSH_INTERVAL_MS'] / 1000.0
+        self.block_seconds = app.config['WRITE_BEHIND_BLOCK_SECONDS']
+        self._queue = queue.Queue(maxsize=app.config['WRITE_BEHIND_MAX_QUEUE'])
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._oldest = None
+        self.written = 0
+        self.failed = 0
+        app.extensions['write_behind'] = self
+
+    def _ensure_started(self):
+        # started lazily so that forked workers each get their own writer
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def submit(self, uid, rule_set, rows):
+        if self._stopping:
+            raise QueueFull("shutting down")
+        item = (uid, rule_set, rows, datetime.now(timezone.utc), time.monotonic())
+        try:
+            self._queue.put(item, block=self.block_seconds > 0, timeout=self.block_seconds or None)
+        except queue.Full:
+            raise QueueFull("write-behind queue is full")
+        self._ensure_started()
+
+    def _take_batch(self):
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._oldest = batch[0][4]
+                self._write(batch)
+                self._oldest = None
+                for _ in batch:
+                    self._queue.task_done()
+            elif self._stopping:
+                return
+
+    def _write(self, batch):
+        from . import broadcaster
+        from .ingest import store_labeled
+        with self.app.app_context():
+            recorded = []
+            try:
+                for uid, rule_set, rows, received_at, _ in batch:
+                    ids, label_counts = store_labeled(uid, rule_set, rows, received_at=received_at)
+                    recorded.append((uid, len(ids), label_counts))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.failed += sum(len(item[2]) for item in batch)
+                log.exception("write-behind flush of %d items failed", len(batch))
+                return
+            finally:
+                db.session.remove()
+            self.written += sum(n for _, n, _ in recorded)
+            for uid, n, label_counts in recorded:
+                broadcaster.record(uid, n, label_counts)
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def lag_seconds(self) -> float:
+        """Age of the oldest item not yet committed."""
+        oldest = self._oldest
+        if oldest is None:
+            with self._queue.mutex:
+                oldest = self._queue.queue[0][4] if self._queue.queue else None
+        return time.monotonic() - oldest if oldest is not None else 0.0
+
+    def status(self) -> dict:
+        return {"enabled": self.enabled, "depth": self.depth(), "max_depth": self._queue.maxsize,
+                "lag_seconds": round(self.lag_seconds(), 3), "written": self.written, "failed": self.failed}
+
+    def flush(self, timeout: float = None):
+        """Wait until everything queued so far is committed."""
+        if self._thread is None:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def shutdown(self, timeout: float = 30):
+        self._stopping = True
+        self.flush(timeout)
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 2 + 1)
+
+def get_write_behind() -> WriteBehindQueue:
+    return current_app.extensions['write_behind']
@@ -0,0 +1,152 @@
+"""Rule engine and API benchmarks.
+
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --compare baseline.json --threshold 0.15
+
+Results are JSON: ``{"meta": {...}, "results": {name: {metric: value}}}``.
+Throughput metrics (``ops_per_sec``) are higher-is-better, latency metrics
+(``p50_ms``/``p95_ms``/``p99_ms``) lower-is-better. ``--compare`` exits with
+status 1 when any shared metric regressed by more than ``--threshold``.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from app.rule_engine import apply_rules, compile_rules, evaluate_rule, get_by_path
+from app.rule_index import RuleMatcher
+from app.rule_vector import apply_rules_batch
+from benchmarks.synthetic import SHAPES, make_payloads, make_rules, make_users, to_api_rule
+
+def _throughput(fn, items, min_seconds):
+    n, start = 0, time.perf_counter()
+    while True:
+        for item in items:
+            fn(item)
+        n += len(items)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return {"ops_per_sec": round(n / elapsed, 1)}
+
+def _percentiles(samples_ms):
+    s = sorted(samples_ms)
+    pick = lambda q: round(s[min(len(s) - 1, int(q * len(s)))], 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "n": len(s)}
+
+def bench_engine(quick=False):
+    min_s = 0.2 if quick else 1.0
+    n_rules = 50 if quick else 300
+    payloads = make_payloads(200 if quick else 1000, seed=1)
+    results = {}
+
+    for path in ("Price", "order.total.amount", "order.items[3].sku"):
+        results[f"get_by_path[{path}]"] = _throughput(lambda p: get_by_path(p, path), payloads, min_s)
+
+    for shape in SHAPES:
+        rules = make_rules(shape, n_rules, seed=2)
+        conds = rules[0]["conditions"]
+        results[f"evaluate_rule[{shape}]"] = _throughput(lambda p: evaluate_rule(p, conds), payloads, min_s)
+        results[f"apply_rules[{shape},dict]"] = _throughput(lambda p: apply_rules(p, rules), payloads[:50], min_s)
+        compiled = compile_rules(rules)
+        results[f"apply_rules[{shape},compiled]"] = _throughput(lambda p: apply_rules(p, compiled), payloads, min_s)
+        matcher = RuleMatcher(compiled)
+        results[f"apply_rules[{shape},matcher]"] = _throughput(matcher.apply, payloads, min_s)
+        batch = _throughput(lambda chunk: apply_rules_batch(chunk, compiled), [payloads], min_s)
+        results[f"apply_rules[{shape},vectorized]"] = {"ops_per_sec": round(batch["ops_per_sec"] * len(payloads), 1)}
+    return results
+
+def bench_api(quick=False):
+    from app import create_app, db
+
+    n_requests = 100 if quick else 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                          "STATS_BROADCAST_INTERVAL_MS": 1000})
+        with app.app_context():
+            db.create_all()
+        client = app.test_client()
+        users = make_users(3)
+        for i, uid in enumerate(users):
+            for rule in make_rules(SHAPES[i % len(SHAPES)], 20 if quick else 100, seed=i):
+                client.post("/api/rules", json=to_api_rule(rule), headers={"X-User-Id": uid})
+
+        payloads = make_payloads(n_requests, seed=3)
+        timings = []
+        for i, p in enumerate(payloads):
+            start = time.perf_counter()
+            rv = client.post("/api/process", json=p, headers={"X-User-Id": users[i % len(users)]})
+            timings.append((time.perf_counter() - start) * 1000)
+            assert rv.status_code == 200, rv.data
+        results = {"api/process": _percentiles(timings)}
+
+        start = time.perf_counter()
+        rv = client.post("/api/process/batch", json=payloads, headers={"X-User-Id": users[0]})
+        assert rv.status_code == 200, rv.data
+        results["api/process/batch"] = {"ops_per_sec": round(len(payloads) / (time.perf_counter() - start), 1)}
+
+        timings = []
+        for i in range(n_requests // 4):
+            start = time.perf_counter()
+            rv = client.get("/api/statistics", headers={"X-User-Id": users[i % len(users)]})
+            timings.append((time.perf_counter() - start) * 1000)
+            assert rv.status_code == 200, rv.data
+        results["api/statistics"] = _percentiles(timings)
+    return results
+
+def compare(results, baseline, threshold=0.15):
+    """Metrics that got worse than ``baseline`` by more than ``threshold``."""
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if not old or metric == "n":
+                continue
+            change = (old - value) / old if metric == "ops_per_sec" else (value - old) / old
+            if change > threshold:
+                regressions.append({"name": name, "metric": metric, "baseline": old,
+                                    "current": value, "change": round(change, 3)})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', choices=['engine', 'api'], help='Run one group')
+    parser.add_argument('--quick', action='store_true', help='Smaller inputs and shorter runs')
+    parser.add_argument('--output', help='Write results JSON here')
+    parser.add_argument('--compare', metavar='BASELINE', help='Flag regressions against a results JSON')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Allowed relative regression (default 0.15)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    if args.only in (None, 'engine'):
+        results.update(bench_engine(args.quick))
+    if args.only in (None, 'api'):
+        results.update(bench_api(args.quick))
+
+    doc = {"meta": {"created_at": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(),
+                    "platform": platform.platform(), "quick": args.quick},
+           "results": results}
+    for name, metrics in results.items():
+        print(f"{name:45s} " + "  ".join(f"{k}={v}" for k, v in metrics.items()))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['name']} {r['metric']}: {r['baseline']} -> {r['current']} ({r['change']:+.1%})")
+        if regressions:
+            return 1
+        print("No regressions.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""Synthetic users, rule sets and payload streams for the benchmarks."""
+import random
+from typing import Dict, List
+
+PRODUCTS = ["Chocolate", "Candy", "Gum", "Cookie", "Cake", "Soda", "Chips", "Tea"]
+COMPANIES = ["Google", "Amazon", "Apple", "Meta", "Netflix", "Oracle"]
+
+SHAPES = ("equality", "bands", "or_groups", "deep_paths")
+
+def make_rules(shape: str, n: int, seed: int = 0) -> List[Dict]:
+    """``n`` rule dicts (the shape ``apply_rules`` takes) of one of SHAPES."""
+    rnd = random.Random(seed)
+    rules = []
+    for i in range(n):
+        if shape == "equality":
+            conds = [(1, "=", "Product", f"{rnd.choice(PRODUCTS)}-{i % 500}"),
+                     (1, "=", "CompanyName", rnd.choice(COMPANIES))]
+        elif shape == "bands":
+            lo = rnd.uniform(0, 100)
+            conds = [(1, "=", "Product", rnd.choice(PRODUCTS)),
+                     (1, ">=", "Price", round(lo, 2)), (1, "<", "Price", round(lo + rnd.uniform(1, 10), 2))]
+        elif shape == "or_groups":
+            conds = []
+            for g in range(1, 6):
+                conds.append((g, "=", "CompanyName", rnd.choice(COMPANIES)))
+                conds.append((g, rnd.choice(["<", ">="]), "Qty", rnd.randint(0, 50)))
+        elif shape == "deep_paths":
+            conds = [(1, "=", f"order.items[{rnd.randint(0, 3)}].sku", f"sku-{rnd.randint(0, 200)}"),
+                     (1, ">", "order.total.amount", rnd.randint(0, 500))]
+        else:
+            raise ValueError(f"unknown rule shape {shape!r}")
+        rules.append({"id": i + 1, "label": f"L{rnd.randint(0, 19)}", "priority": rnd.randint(1, 100),
+                      "conditions": conds})
+    return rules
+
+def make_payload(rnd: random.Random) -> Dict:
+    return {
+        "Product": f"{rnd.choice(PRODUCTS)}-{rnd.randint(0, 499)}" if rnd.random() < 0.5 else rnd.choice(PRODUCTS),
+        "CompanyName": rnd.choice(COMPANIES),
+        "Price": round(rnd.uniform(0, 110), 2),
+        "Qty": rnd.randint(0, 60),
+        "order": {
+            "items": [{"sku": f"sku-{rnd.randint(0, 200)}", "qty": rnd.randint(1, 5)} for _ in range(4)],
+            "total": {"amount": rnd.randint(0, 600), "currency": "USD"},
+        },
+        "ts": rnd.random(),
+    }
+
+def make_payloads(n: int, seed: int = 0) -> List[Dict]:
+    rnd = random.Random(seed)
+    return [make_payload(rnd) for _ in range(n)]
+
+def make_users(n: int) -> List[str]:
+    return [f"bench_user_{i}" for i in range(n)]
+
+def to_api_rule(rule: Dict) -> Dict:
+    """Rule dict in the POST /api/rules body format."""
+    return {"name": f"rule {rule['id']}", "label": rule["label"], "priority": rule["priority"],
+            "conditions": [{"group": g, "operator": op, "key_path": k, "value": v}
+                           for g, op, k, v in rule["conditions"]]}
@@ -1,21 +1,137 @@
 import argparse
+import atexit
+import json
+import sys
 from app import create_app, db, socketio
 from app.models import seed_demo_data
+from app.migrations import upgrade_schema
+from app.stats import rebuild_rollups
+from app.payload_store import compact_payloads
+from app.retention import prune_expired
+from app.relabel import RelabelJob
+from app.bulk_label import label_inputs, rules_from_export
+from app.ingest import store_labeled
+from app.services import parse_iso_date
+from app.rule_cache import get_rule_set
+
+def run_relabel(app, args):
+    job = RelabelJob(
+        args.user,
+        from_dt=parse_iso_date(args.from_) if args.from_ else None,
+        to_dt=parse_iso_date(args.to) if args.to else None,
+        after_id=args.after_id,
+        dry_run=args.dry_run,
+        workers=app.config['RELABEL_WORKERS'] if args.workers is None else args.workers,
+        chunk_size=args.chunk_size or app.config['RELABEL_CHUNK_SIZE'],
+    )
+    job.on_progress = lambda j: print(f"{j.processed}/{j.total} payloads, {j.changed} changed, checkpoint {j.checkpoint}")
+    status = job.run().status()
+    print(f"{status['state']}: {status['processed']} payloads in {status['elapsed_seconds']}s, "
+          f"label diff {status['label_diff']}")
+    if status['error']:
+        print(f"error: {status['error']} (resume with --after-id {status['checkpoint']})")
+
+def run_label(app, args):
+    if bool(args.user) == bool(args.rules):
+        sys.exit("label: pass exactly one of --user or --rules")
+    if args.output == 'db' and not args.user:
+        sys.exit("label: --output db needs --user (stored labels reference the user's rules)")
+    if args.user:
+        rule_set = get_rule_set(args.user)
+        rule_dicts = [r.to_dict() for r in rule_set.rules]
+    else:
+        with open(args.rules) as f:
+            rule_dicts = rules_from_export(json.load(f))
+
+    def store(rows):
+        store_labeled(args.user, rule_set, rows)
+        db.session.commit()
+
+    out = open(args.out, 'w') if args.out else sys.stdout
+    try:
+        report = label_inputs(
+            args.inputs or ['-'], rule_dicts, out,
+            workers=app.config['RELABEL_WORKERS'] if args.workers is None else args.workers,
+            ordered=not args.unordered, single=args.single_label,
+            store=store if args.output == 'db' else None,
+            shard_bytes=args.shard_mb << 20,
+        )
+    finally:
+        if args.out:
+            out.close()
+    print(f"labeled {report['payloads']} payloads ({report['errors']} invalid lines) in {report['seconds']}s: "
+          f"{report['payloads_per_sec']} payloads/s, {report['mb_per_sec']} MB/s, "
+          f"{report['shards']} shards on {report['workers']} workers", file=sys.stderr)
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--initdb', action='store_true', help='Create DB tables')
     parser.add_argument('--loaddemo', action='store_true', help='Load demo rules')
+    parser.add_argument('--migrate', action='store_true', help='Add missing tables and indexes to an existing DB')
+    parser.add_argument('--rebuild-rollups', action='store_true', help='Recompute statistics rollups from stored payloads')
+    parser.add_argument('--compact-payloads', action='store_true',
+                        help='Rewrite stored payloads into the PAYLOAD_STORAGE format and drop unused bodies')
+    parser.add_argument('--prune', action='store_true', help='Delete raw payloads older than the retention policies')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM the SQLite file after --compact-payloads')
+    sub = parser.add_subparsers(dest='command')
+    relabel = sub.add_parser('relabel', help="Re-evaluate a user's stored payloads against the current rules")
+    relabel.add_argument('--user', required=True, help='User id (X-User-Id)')
+    relabel.add_argument('--from', dest='from_', help='ISO start of received_at range')
+    relabel.add_argument('--to', help='ISO end of received_at range')
+    relabel.add_argument('--after-id', type=int, default=0, help='Resume after this payload id (checkpoint)')
+    relabel.add_argument('--workers', type=int, default=None, help='Worker processes (0 = in-process)')
+    relabel.add_argument('--chunk-size', type=int, default=None)
+    relabel.add_argument('--dry-run', action='store_true', help='Only report the label count diff')
+    label = sub.add_parser('label', help='Label NDJSON files or stdin without the HTTP server')
+    label.add_argument('inputs', nargs='*', help="NDJSON files ('-' or none for stdin)")
+    label.add_argument('--user', help="Use this user's active rules from the database")
+    label.add_argument('--rules', help='Use rules from a GET /api/rules JSON export instead')
+    label.add_argument('--output', choices=['ndjson', 'db'], default='ndjson',
+                       help="'ndjson' writes labeled lines, 'db' stores payloads and labels for --user")
+    label.add_argument('-o', '--out', help='NDJSON output file (default stdout)')
+    label.add_argument('--workers', type=int, default=None, help='Worker processes (0 = in-process)')
+    label.add_argument('--unordered', action='store_true', help='Write shards as they finish instead of in input order')
+    label.add_argument('--single-label', action='store_true', help='Keep only the top-priority label')
+    label.add_argument('--shard-mb', type=int, default=4, help='Input shard size per task in MiB')
     args = parser.parse_args()
 
     app = create_app()
     with app.app_context():
         if args.initdb:
-            db.create_all()
+            upgrade_schema()
             print("DB initialized.")
+        if args.migrate:
+            created = upgrade_schema()
+            print(f"Migrated DB ({len(created)} columns/indexes created).")
         if args.loaddemo:
             seed_demo_data()
             print("Loaded demo rules.")
+        if args.rebuild_rollups:
+            upgrade_schema()
+            buckets, label_buckets = rebuild_rollups()
+            print(f"Rebuilt rollups ({buckets} payload buckets, {label_buckets} label buckets).")
+        if args.compact_payloads:
+            upgrade_schema()
+            stats = compact_payloads(on_progress=lambda s: print(f"{s['rewritten']} payloads rewritten"))
+            if args.vacuum and db.engine.dialect.name == 'sqlite':
+                with db.engine.connect() as conn:
+                    conn.exec_driver_sql('VACUUM')
+            print(f"Compacted payloads: {stats['rewritten']} rewritten, {stats['recompressed']} bodies recompressed, "
+                  f"{stats['orphans_deleted']} unused bodies deleted, {stats['bytes_before']} -> {stats['bytes_after']} bytes.")
+        if args.prune:
+            upgrade_schema()
+            deleted = prune_expired()
+            print(f"Pruned {sum(deleted.values())} payloads for {len(deleted)} users.")
+        if args.command == 'relabel':
+            run_relabel(app, args)
+            return
+        if args.command == 'label':
+            run_label(app, args)
+            return
+    atexit.register(app.extensions['write_behind'].shutdown)
+    atexit.register(app.extensions['sketches'].shutdown)
+    app.extensions['retention'].start()
+    app.extensions['sketches'].start()
     socketio.run(app, debug=True)
 
 if __name__ == "__main__":
@@ -1,18 +1,26 @@
 import json
+from unittest.mock import ANY
 import pytest
 from app import create_app, db
 
-@pytest.fixture
-def client():
-    app = create_app()
-    app.config.update({
-        "TESTING": True,
-        "SQLALCHEMY_DATABASE_URI": "sqlite://",
-    })
+H = {"X-User-Id": "u1"}
+
+def make_client(**config):
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", **config})
     with app.app_context():
         db.create_all()
-    client = app.test_client()
-    yield client
+    return app.test_client()
+
+def add_rule(client, label, key_path, operator, value, priority=10, headers=H):
+    rv = client.post("/api/rules", json={
+        "name": f"{label} {key_path} {operator} {value}", "label": label, "priority": priority,
+        "conditions": [{"group": 1, "key_path": key_path, "operator": operator, "value": value}]
+    }, headers=headers)
+    return rv.get_json()["id"]
+
+@pytest.fixture
+def client():
+    yield make_client()
 
 def test_rules_crud(client):
     rule = {
@@ -54,3 +62,231 @@ def test_process_and_stats(client):
     assert rv.status_code == 200
     stats = rv.get_json()
     assert stats["total_payloads"] == 1
+
+def test_rule_cache_invalidation(client):
+    rid = add_rule(client, "Green", "Price", "<", 2)
+    assert client.post("/api/process", json={"Price": 1}, headers=H).get_json()["labels"] == ["Green"]
+
+    client.post(f"/api/rules/{rid}/toggle", headers=H)
+    assert client.post("/api/process", json={"Price": 1}, headers=H).get_json()["labels"] == []
+    client.post(f"/api/rules/{rid}/toggle", headers=H)
+
+    # a change committed by another worker is picked up through the version counter
+    from app.models import Rule, bump_rules_version
+    with client.application.app_context():
+        Rule.query.filter_by(id=rid).update({"label": "Blue"})
+        bump_rules_version("u1")
+        db.session.commit()
+    assert client.post("/api/process", json={"Price": 1}, headers=H).get_json()["labels"] == ["Blue"]
+
+def test_label_memo_skips_unreferenced_fields(client):
+    add_rule(client, "Green", "Price", "<", 2)
+    memo = client.application.extensions["label_memo"]
+    for i in range(5):
+        assert client.post("/api/process", json={"Price": 1, "ts": i}, headers=H).get_json()["labels"] == ["Green"]
+    assert client.post("/api/process", json={"Price": 3, "ts": 9}, headers=H).get_json()["labels"] == []
+    assert memo.status()["hits"] == 4 and memo.status()["misses"] == 2
+
+def test_process_batch(client):
+    add_rule(client, "Green", "Price", "<", 2)
+    add_rule(client, "Blue", "Price", ">=", 0, priority=5)
+
+    rv = client.post("/api/process/batch", json=[{"Price": 1}, {"Price": 3}, {"Other": 1}], headers=H)
+    assert rv.status_code == 200
+    res = rv.get_json()["results"]
+    assert [r["labels"] for r in res] == [["Blue", "Green"], ["Blue"], []]
+
+    ndjson = '{"Price": 1}\n\n{"Price": 7}\n'
+    rv = client.post("/api/process/batch?single_label=true", data=ndjson,
+                     content_type="application/x-ndjson", headers=H)
+    assert [r["labels"] for r in rv.get_json()["results"]] == [["Blue"], ["Blue"]]
+
+    rv = client.post("/api/process/batch", data='{"Price": 1}\n[1]\n', headers=H)
+    assert rv.status_code == 400 and "Line 2" in rv.get_json()["error"]
+
+    stats = client.get("/api/statistics", headers=H).get_json()
+    assert stats["total_payloads"] == 5
+    assert {r["label"]: r["count"] for r in stats["by_label"]} == {"Blue": 4, "Green": 1}
+
+def test_process_early_exit_modes(client):
+    for label, prio, val in [("Blue", 5, 0), ("Blue", 6, 1), ("Green", 10, 2), ("Red", 20, 3)]:
+        add_rule(client, label, "Price", ">=", val, priority=prio)
+
+    def process(query):
+        return client.post(f"/api/process?{query}", json={"Price": 5}, headers=H).get_json()
+
+    assert process("mode=all")["applied_rule_ids"] == [1, 2, 3, 4]
+    assert process("mode=first") == {**process("single_label=true"), "processed_at": ANY}
+    assert process("mode=first")["applied_rule_ids"] == [1]
+    assert process("mode=top_k&k=2")["labels"] == ["Blue", "Green"]
+    assert process("mode=top_k&k=2")["applied_rule_ids"] == [1, 3]
+    assert process("mode=dedup")["applied_rule_ids"] == [1, 3, 4]
+    assert client.post("/api/process?mode=top_k", json={}, headers=H).status_code == 400
+    assert client.post("/api/process/batch?mode=fast", json=[{}], headers=H).status_code == 400
+
+    client.application.config["VECTORIZE_MIN_BATCH"] = 2
+    rv = client.post("/api/process/batch?mode=top_k&k=2", json=[{"Price": 5}, {"Price": 2}], headers=H)
+    assert [r["applied_rule_ids"] for r in rv.get_json()["results"]] == [[1, 3], [1, 3]]
+    rv = client.post("/api/process/stream?mode=first", data='{"Price": 1}\n', headers=H)
+    assert json.loads(rv.get_data(as_text=True).splitlines()[0])["applied_rule_ids"] == [1]
+
+def test_process_stream(client):
+    add_rule(client, "Green", "Price", "<", 2)
+    client.application.config["STREAM_CHUNK_SIZE"] = 2
+    body = '{"Price": 1}\n{"Price": 5}\nnot json\n\n{"Price": 0}\n'
+    rv = client.post("/api/process/stream", data=body, content_type="application/x-ndjson", headers=H)
+    assert rv.status_code == 200
+    lines = [json.loads(l) for l in rv.get_data(as_text=True).splitlines()]
+    assert lines[0] == {"line": 1, "labels": ["Green"], "applied_rule_ids": [1]}
+    assert lines[1]["labels"] == []
+    assert lines[2] == {"line": 3, "error": "invalid JSON"}
+    assert lines[3]["line"] == 5 and lines[3]["labels"] == ["Green"]
+    assert lines[4]["summary"]["processed"] == 3 and lines[4]["summary"]["errors"] == 1
+    assert client.get("/api/statistics", headers=H).get_json()["total_payloads"] == 3
+
+def test_stats_deltas_go_to_the_users_room(client, monkeypatch):
+    from app import socketio, broadcaster
+    app = client.application
+    monkeypatch.setattr(broadcaster, "interval", 60)
+    broadcaster.flush()
+    s1 = socketio.test_client(app, auth={"user_id": "u1"})
+    s2 = socketio.test_client(app, auth={"user_id": "u2"})
+    assert s1.get_received()[0]["name"] == "stats_resync"
+    s2.get_received()
+
+    add_rule(client, "Green", "Price", ">=", 0, priority=1)
+    client.post("/api/process", json={"Price": 1}, headers=H)
+    client.post("/api/process/batch", json=[{"Price": 2}, {"Other": 1}], headers=H)
+    broadcaster.flush()
+
+    received = s1.get_received()
+    assert [m["name"] for m in received] == ["stats_delta"]
+    assert received[0]["args"][0] == {"total_payloads": 3, "by_label": {"Green": 2}}
+    assert s2.get_received() == []
+
+def test_write_behind_queue():
+    client = make_client(WRITE_BEHIND=True, WRITE_BEHIND_FLUSH_INTERVAL_MS=10)
+    app = client.application
+    add_rule(client, "Green", "Price", "<", 2)
+
+    assert client.post("/api/process", json={"Price": 1}, headers=H).get_json()["labels"] == ["Green"]
+    assert client.post("/api/process/batch", json=[{"Price": 1}, {"Price": 3}], headers=H).status_code == 200
+    writer = app.extensions["write_behind"]
+    assert writer.flush(timeout=5)
+    assert client.get("/api/statistics", headers=H).get_json()["total_payloads"] == 3
+    status = client.get("/api/ingest/queue").get_json()
+    assert status["enabled"] and status["depth"] == 0 and status["written"] == 3
+
+    writer.shutdown()
+    assert client.post("/api/process", json={"Price": 1}, headers=H).status_code == 503
+
+def test_export_payloads_streams_pages(client):
+    import gzip
+    add_rule(client, "Green", "Price", "<", 2)
+    client.post("/api/process/batch", json=[{"Price": i, "meta": {"sku": f"s{i}"}} for i in range(5)], headers=H)
+    client.post("/api/process", json={"Price": 0}, headers={"X-User-Id": "u2"})
+    client.application.config["EXPORT_PAGE_SIZE"] = 2
+
+    rv = client.get("/api/payloads/export?keys=Price,meta.sku", headers=H)
+    lines = rv.get_data(as_text=True).splitlines()
+    assert lines[0] == "id,received_at,labels,Price,meta.sku"
+    assert [l.split(",")[2:] for l in lines[1:]] == [
+        ["Green", "0", "s0"], ["Green", "1", "s1"], ["", "2", "s2"], ["", "3", "s3"], ["", "4", "s4"]]
+
+    rv = client.get("/api/payloads/export?format=ndjson&label=Green&gzip=1", headers=H)
+    rows = [json.loads(l) for l in gzip.decompress(rv.data).decode().splitlines()]
+    assert [r["payload"]["Price"] for r in rows] == [0, 1]
+    assert all(r["labels"] == ["Green"] for r in rows)
+
+def test_metrics_endpoint(tmp_path):
+    client = make_client(METRICS_ENABLED=True, PROFILE_SAMPLE_N=2)
+    client.application.extensions["metrics"].profile_dir = str(tmp_path)
+    add_rule(client, "Green", "Price", "<", 2)
+    add_rule(client, "Other", "Category", "!=", "food", priority=20)
+    client.post("/api/process", json={"Price": 1}, headers=H)
+    client.post("/api/process", json={"Name": "x"}, headers=H)
+
+    text = client.get("/api/metrics").get_data(as_text=True)
+    assert 'ass_payloads_processed_total{endpoint="process"} 2' in text
+    assert 'ass_rule_matches_total{rule_id="1"} 1' in text
+    assert "ass_missing_path_total 2" in text
+    assert 'ass_process_stage_seconds_count{stage="evaluate"} 2' in text
+    assert "# TYPE ass_write_behind_depth gauge" in text
+    assert len(list(tmp_path.glob("process-*.prof"))) == 1
+
+    assert make_client().get("/api/metrics").status_code == 404
+
+def test_rule_selectivity_endpoint():
+    client = make_client(LABEL_MEMO_SIZE=0, ADAPTIVE_SAMPLE_N=1, ADAPTIVE_REORDER_EVERY=2)
+    client.post("/api/rules", json={
+        "name": "Cheap gum", "label": "Green", "priority": 10,
+        "conditions": [{"group": 1, "key_path": "Product", "operator": "!=", "value": "Candy"},
+                       {"group": 1, "key_path": "Price", "operator": "!=", "value": 1}]
+    }, headers=H)
+    for price in (1, 1, 1, 2):
+        assert client.post("/api/process", json={"Product": "Gum", "Price": price}, headers=H).status_code == 200
+
+    data = client.get("/api/rules/selectivity", headers=H).get_json()
+    assert data["samples"] == 4 and data["reorders"] == 2
+    conds = data["rules"][0]["groups"][0]["conditions"]
+    assert [c["key_path"] for c in conds] == ["Price", "Product"]
+    assert conds[0]["pass_rate"] == 0.25 and conds[1]["pass_rate"] == 1.0
+    assert data["rules"][0]["groups"][0]["match_rate"] == 0.25
+
+    data = client.delete("/api/rules/selectivity", headers=H).get_json()
+    assert data["samples"] == 0
+    assert [c["key_path"] for c in data["rules"][0]["groups"][0]["conditions"]] == ["Product", "Price"]
+
+def test_selectivity_reset_reaches_every_worker(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'shared.db'}"
+    cfg = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": uri, "LABEL_MEMO_SIZE": 0, "ADAPTIVE_SAMPLE_N": 1}
+    workers = [create_app(cfg), create_app(cfg)]
+    with workers[0].app_context():
+        db.create_all()
+    a, b = (w.test_client() for w in workers)
+    add_rule(a, "L", "Price", "<", 2)
+    for client in (a, b):
+        client.post("/api/process", json={"Price": 1}, headers=H)
+    assert b.get("/api/rules/selectivity", headers=H).get_json()["samples"] == 1
+    assert a.delete("/api/rules/selectivity", headers=H).get_json()["samples"] == 0
+    assert b.get("/api/rules/selectivity", headers=H).get_json()["samples"] == 0
+
+def test_list_rules_pages_and_conditional_get(client):
+    from sqlalchemy import event
+    for i, prio in enumerate([5, 1, 5, 3, 1]):
+        client.post("/api/rules", json={
+            "name": f"r{i}", "label": "L", "priority": prio,
+            "conditions": [{"group": 1, "key_path": "Price", "operator": "<", "value": i},
+                           {"group": 2, "key_path": "Name", "operator": "=", "value": {"x": [i]}}]
+        }, headers=H)
+
+    with client.application.app_context():
+        engine = db.engine
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    pages, cursor = [], None
+    while True:
+        rv = client.get("/api/rules", query_string={"limit": 2, **({"after": cursor} if cursor else {})}, headers=H)
+        pages.append(rv.get_json())
+        cursor = rv.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    event.remove(engine, "before_cursor_execute", listener)
+    assert len(statements) == 3 * len(pages)
+    rules = [r for page in pages for r in page]
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert [(r["priority"], r["id"]) for r in rules] == [(1, 2), (1, 5), (3, 4), (5, 1), (5, 3)]
+    assert rules[0]["conditions"][1]["value"] == {"x": [1]}
+
+    client.application.config["RULES_PAGE_SIZE"] = 2
+    rv = client.get("/api/rules", headers=H)  # unpaged unless limit or after is given
+    etag = rv.headers["ETag"]
+    assert rv.get_json() == rules and "X-Next-Cursor" not in rv.headers
+    assert len(client.get("/api/rules?after=", headers=H).get_json()) == 2
+    rv = client.get("/api/rules", headers={**H, "If-None-Match": etag})
+    assert rv.status_code == 304 and rv.headers["ETag"] == etag
+    assert client.get("/api/rules", headers={"X-User-Id": "u2", "If-None-Match": etag}).status_code == 200
+    client.post(f"/api/rules/{rules[0]['id']}/toggle", headers=H)
+    assert client.get("/api/rules", headers={**H, "If-None-Match": etag}).status_code == 200
+    assert client.get("/api/rules?after=!!", headers=H).status_code == 400
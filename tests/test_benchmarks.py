@@ -0,0 +1,16 @@
+from benchmarks.run_benchmarks import compare
+from benchmarks.synthetic import SHAPES, make_payloads, make_rules
+from app.rule_engine import apply_rules, compile_rules
+from app.rule_index import RuleMatcher
+
+def test_compare_flags_only_regressions():
+    baseline = {"a": {"ops_per_sec": 100.0}, "b": {"p99_ms": 10.0, "n": 5}, "c": {"ops_per_sec": 1.0}}
+    current = {"a": {"ops_per_sec": 80.0}, "b": {"p99_ms": 10.5, "n": 50}, "new": {"ops_per_sec": 1.0}}
+    assert [(r["name"], r["metric"]) for r in compare(current, baseline, 0.15)] == [("a", "ops_per_sec")]
+
+def test_synthetic_rule_shapes_evaluate():
+    payloads = make_payloads(50)
+    for shape in SHAPES:
+        rules = compile_rules(make_rules(shape, 30))
+        matcher = RuleMatcher(rules)
+        assert [matcher.apply(p) for p in payloads] == [apply_rules(p, rules) for p in payloads]
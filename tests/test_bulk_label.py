@@ -0,0 +1,107 @@
+import io
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from app import create_app, db
+from app.bulk_label import file_shards, label_inputs
+from app.ingest import store_labeled
+from app.rule_cache import get_rule_set
+from app.stats import compute_statistics
+
+RULES = [
+    {"id": 1, "label": "Green", "priority": 10, "conditions": [(1, "<", "Price", 2)]},
+    {"id": 2, "label": "Cheap", "priority": 5, "conditions": [(1, "<", "Price", 1)]},
+]
+
+def _write_input(path, n=50):
+    lines = [json.dumps({"Price": i % 4, "n": i}) for i in range(n)]
+    lines[7] = "{not json"
+    if n > 20:
+        lines[20] = "[1, 2]"
+    path.write_text("\n".join(lines) + "\n")
+    return lines
+
+def _expected(lines):
+    out = []
+    for i, line in enumerate(lines):
+        if i in (7, 20):
+            continue
+        price = json.loads(line)["Price"]
+        rule_ids = [r for r, hit in ((2, price < 1), (1, price < 2)) if hit]
+        out.append({"labels": [{1: "Green", 2: "Cheap"}[r] for r in rule_ids], "applied_rule_ids": rule_ids,
+                    "payload": json.loads(line)})
+    return out
+
+def test_file_shards_end_on_line_breaks(tmp_path):
+    path = tmp_path / "in.ndjson"
+    _write_input(path)
+    shards = file_shards(str(path), 64)
+    data = path.read_bytes()
+    assert shards[0][1] == 0 and shards[-1][2] == len(data)
+    assert all(data[end - 1:end] == b"\n" for _, _, end in shards)
+    assert all(a[2] == b[1] for a, b in zip(shards, shards[1:]))
+
+@pytest.mark.parametrize("workers,ordered", [(0, True), (2, True), (2, False)])
+def test_label_inputs_writes_ndjson(tmp_path, workers, ordered):
+    path = tmp_path / "in.ndjson"
+    lines = _write_input(path)
+    out = io.StringIO()
+    report = label_inputs([str(path)], RULES, out, workers=workers, ordered=ordered, shard_bytes=100)
+    rows = [json.loads(l) for l in out.getvalue().splitlines()]
+    errors = [r for r in rows if "error" in r]
+    labeled = [r for r in rows if "error" not in r]
+    assert report["payloads"] == 48 and report["errors"] == 2 and report["shards"] > 4
+    assert {e["offset"] for e in errors} == {sum(len(l) + 1 for l in lines[:i]) for i in (7, 20)}
+    expected = _expected(lines)
+    if ordered:
+        assert labeled == expected
+    else:
+        assert sorted(labeled, key=lambda r: r["payload"]["n"]) == expected
+
+def test_label_inputs_stores_into_db(tmp_path):
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    client.post("/api/rules", json={"name": "Low", "label": "Green", "priority": 10,
+                                    "conditions": [{"group": 1, "key_path": "Price", "operator": "<", "value": 2}]},
+                headers={"X-User-Id": "u1"})
+    path = tmp_path / "in.ndjson"
+    _write_input(path)
+    with app.app_context():
+        rule_set = get_rule_set("u1")
+        out = io.StringIO()
+
+        def store(rows):
+            store_labeled("u1", rule_set, rows)
+            db.session.commit()
+
+        label_inputs([str(path)], [r.to_dict() for r in rule_set.rules], out, store=store, shard_bytes=200)
+        assert len(out.getvalue().splitlines()) == 2
+        stats = compute_statistics("u1")
+    assert stats["total_payloads"] == 48
+    assert stats["by_label"][0]["count"] == 25
+
+def test_label_command_with_rules_export(tmp_path):
+    path = tmp_path / "in.ndjson"
+    lines = _write_input(path, 10)
+    rules = tmp_path / "rules.json"
+    rules.write_text(json.dumps([
+        {"id": 1, "label": "Green", "priority": 10, "active": True,
+         "conditions": [{"group": 1, "key_path": "Price", "operator": "<", "value": 2}]},
+        {"id": 2, "label": "Off", "priority": 1, "active": False,
+         "conditions": [{"group": 1, "key_path": "Price", "operator": "<", "value": 9}]},
+    ]))
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'cli.db'}")
+    root = Path(__file__).parent.parent
+    proc = subprocess.run([sys.executable, "run.py", "label", "--rules", str(rules), "--workers", "0", "-"],
+                          input=path.read_bytes(), capture_output=True, cwd=root, env=env, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+    rows = [json.loads(l) for l in proc.stdout.decode().splitlines()]
+    assert [r["labels"] for r in rows if "error" not in r] == [["Green"] if json.loads(l)["Price"] < 2 else []
+                                                                for i, l in enumerate(lines) if i != 7]
+    assert [r["line"] for r in rows if "error" in r] == [8]
+    assert b"labeled 9 payloads (1 invalid lines)" in proc.stderr
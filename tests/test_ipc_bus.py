@@ -0,0 +1,123 @@
+import json
+import multiprocessing
+import socket
+import statistics
+import threading
+import time
+import urllib.request
+from app.ipc_bus import UnixSocketManager
+
+WORKERS = 3
+USERS = 40  # well past the kernel's default datagram queue length of 10
+
+def _serve(port, bus_dir, db_url):
+    from app import create_app, socketio
+    app = create_app({"SQLALCHEMY_DATABASE_URI": db_url, "SOCKETIO_BUS_DIR": bus_dir,
+                      "STATS_BROADCAST_INTERVAL_MS": 2000})
+    socketio.run(app, host="127.0.0.1", port=port, allow_unsafe_werkzeug=True, log_output=False)
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _http(url, data=None, headers=None):
+    req = urllib.request.Request(url, data=data.encode() if data is not None else None, headers=headers or {})
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return resp.read().decode()
+
+class _Dashboard:
+    """A Socket.IO client on the Engine.IO long-polling transport."""
+
+    def __init__(self, base, uid):
+        sid = json.loads(_http(f"{base}/socket.io/?EIO=4&transport=polling")[1:])["sid"]
+        self.url = f"{base}/socket.io/?EIO=4&transport=polling&sid={sid}"
+        _http(self.url, "40" + json.dumps({"user_id": uid}))
+        self.deltas = []
+
+    def poll_until_delta(self, deadline):
+        while not self.deltas and time.monotonic() < deadline:
+            for pkt in _http(self.url).split("\x1e"):
+                if pkt == "2":
+                    _http(self.url, "3")
+                elif pkt.startswith("42"):
+                    event, data = json.loads(pkt[2:])
+                    if event == "stats_delta":
+                        self.deltas.append((data, time.monotonic()))
+
+def test_one_flush_for_many_users_reaches_every_worker(tmp_path):
+    from app import create_app, db
+    db_url = f"sqlite:///{tmp_path / 'bus.db'}"
+    with create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": db_url}).app_context():
+        db.create_all()
+    ctx = multiprocessing.get_context('spawn')
+    ports = [_free_port() for _ in range(WORKERS)]
+    procs = [ctx.Process(target=_serve, args=(port, str(tmp_path / "bus"), db_url), daemon=True) for port in ports]
+    for p in procs:
+        p.start()
+    try:
+        bases = [f"http://127.0.0.1:{port}" for port in ports]
+        for base in bases:
+            for _ in range(300):
+                try:
+                    _http(f"{base}/api/ingest/queue")
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        users = [f"u{i}" for i in range(USERS)]
+        dashboards = [_Dashboard(base, uid) for base in bases for uid in users]
+        # every dashboard's first poll returns its stats_resync; start long-polling after it
+        for d in dashboards:
+            d.poll_until_delta(time.monotonic())
+        deadline = time.monotonic() + 30
+        threads = [threading.Thread(target=d.poll_until_delta, args=(deadline,)) for d in dashboards]
+        for t in threads:
+            t.start()
+        for uid in users:  # all within one broadcast interval of the first worker
+            _http(f"{bases[0]}/api/process", '{"Price": 1}', {"X-User-Id": uid, "Content-Type": "application/json"})
+        sent = time.monotonic()
+        for t in threads:
+            t.join(40)
+    finally:
+        for p in procs:
+            p.terminate()
+
+    for d in dashboards:
+        assert [data for data, _ in d.deltas] == [{"total_payloads": 1, "by_label": {}}], d.url
+    latencies = sorted(t - sent for d in dashboards[USERS:] for _, t in d.deltas)
+    print(f"\nsocket.io bus: {WORKERS} workers, {USERS} users in one flush, cross-worker delivery "
+          f"p50 {statistics.median(latencies) * 1e3:.1f} ms, max {latencies[-1] * 1e3:.1f} ms "
+          f"after the last ingest (broadcast interval 2000 ms)")
+
+def test_large_messages_are_fragmented(tmp_path):
+    import socket
+    receiver = UnixSocketManager(str(tmp_path))
+    receiver._ensure_process()
+    receiver.path = str(tmp_path / "peer.sock")
+    receiver._listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver._listener.bind(receiver.path)
+    sender = UnixSocketManager(str(tmp_path))
+    data = {"method": "emit", "event": "stats_resync", "data": {"by_label": ["x" * 100] * 5000}}
+    publisher = threading.Thread(target=sender._publish, args=(data,))
+    publisher.start()
+    assert next(receiver._listen()) == data
+    publisher.join(5)
+    assert sender.dropped == 0
+    receiver._listener.close()
+
+def test_stale_sockets_are_removed(tmp_path):
+    import socket
+    stale = tmp_path / "1-dead.sock"
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(str(stale))
+    sock.close()
+    manager = UnixSocketManager(str(tmp_path))
+    manager._publish({"method": "emit", "event": "x", "data": {}})
+    assert not stale.exists()
+
+def test_create_app_uses_bus_when_configured(tmp_path):
+    from app import create_app, socketio
+    create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SOCKETIO_BUS_DIR": str(tmp_path)})
+    assert isinstance(socketio.server.manager, UnixSocketManager)
+    create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    assert not isinstance(socketio.server.manager, UnixSocketManager)
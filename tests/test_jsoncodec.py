@@ -0,0 +1,45 @@
+import json
+import pytest
+from app import create_app, db, jsoncodec
+from app.models import Payload
+
+@pytest.mark.parametrize("doc", [{"b": 1, "a": [1.5, None, "é"]}, {"big": 2 ** 70 + 1, "neg": -(2 ** 64) - 1}, [True, {"x": {}}]])
+def test_codec_round_trips(doc):
+    assert jsoncodec.loads(jsoncodec.dumps(doc)) == doc
+    assert jsoncodec.loads(jsoncodec.dumps(doc).encode()) == doc
+
+def test_codec_accepts_what_the_stdlib_accepts():
+    assert jsoncodec.loads('{"x": NaN}')["x"] != jsoncodec.loads('{"x": NaN}')["x"]
+    with pytest.raises(ValueError):
+        jsoncodec.loads("{nope")
+    assert jsoncodec.dumps({"b": 1, "a": 2}, sort_keys=True) == '{"a":2,"b":1}'
+
+def test_ingest_stores_the_request_body():
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    body = '{"Price": 1,  "z": {"b": 2, "a": 1}}'
+    rv = client.post("/api/process", data="\ufeff" + body + "\n", content_type="application/json")
+    assert rv.status_code == 200
+    assert client.post("/api/process", data="[1]").status_code == 400
+    assert client.post("/api/process", data=b"\xff\xfe").status_code == 400
+    client.post("/api/process/batch", data='{"a": 1}\n\n{"a":  2}\n', content_type="application/x-ndjson")
+    with app.app_context():
+        assert [p.payload_json for p in Payload.query.order_by(Payload.id)] == [body, '{"a": 1}', '{"a":  2}']
+    assert json.loads(client.get("/api/statistics").data)["total_payloads"] == 3
+
+def test_big_integers_stay_exact():
+    assert jsoncodec.loads(b'[123456789012345678901234567891]') == [123456789012345678901234567891]
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    client.post("/api/rules", data='{"name": "Big", "label": "Big", "conditions": '
+                '[{"group": 1, "key_path": "id", "operator": "=", "value": 123456789012345678901234567890}]}',
+                content_type="application/json")
+    rules = json.loads(client.get("/api/rules").data)
+    assert rules[0]["conditions"][0]["value"] == 123456789012345678901234567890
+    for payload_id, labels in ((123456789012345678901234567891, []), (123456789012345678901234567890, ["Big"])):
+        rv = client.post("/api/process", data=f'{{"id": {payload_id}}}', content_type="application/json")
+        assert json.loads(rv.data)["labels"] == labels
@@ -0,0 +1,69 @@
+import time
+import pytest
+from app import create_app, db
+from app.relabel import RelabelJob
+
+H = {"X-User-Id": "u1"}
+
+@pytest.fixture
+def client():
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "RELABEL_WORKERS": 0})
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    rv = client.post("/api/rules", json={
+        "name": "Low", "label": "Green", "priority": 10,
+        "conditions": [{"group": 1, "key_path": "Price", "operator": "<", "value": 2}]
+    }, headers=H)
+    client.rule_id = rv.get_json()["id"]
+    client.post("/api/process/batch", json=[{"Price": i} for i in range(10)], headers=H)
+    yield client
+
+def _label_counts(client):
+    return {r["label"]: r["count"] for r in client.get("/api/statistics", headers=H).get_json()["by_label"]}
+
+def _wait(client, job_id):
+    for _ in range(200):
+        status = client.get(f"/api/relabel/{job_id}", headers=H).get_json()
+        if status["state"] in ("done", "failed"):
+            return status
+        time.sleep(0.02)
+    raise AssertionError("relabel job did not finish")
+
+def test_relabel_dry_run_then_apply(client):
+    client.put(f"/api/rules/{client.rule_id}", json={"label": "Blue", "conditions": [
+        {"group": 1, "key_path": "Price", "operator": "<", "value": 5}]}, headers=H)
+
+    rv = client.post("/api/relabel", json={"dry_run": True, "chunk_size": 3}, headers=H)
+    assert rv.status_code == 202
+    status = _wait(client, rv.get_json()["id"])
+    assert status["state"] == "done" and status["processed"] == 10
+    assert status["label_diff"] == {"Blue": 5, "Green": -2}
+    assert _label_counts(client) == {"Green": 2}
+
+    status = _wait(client, client.post("/api/relabel", json={"chunk_size": 3}, headers=H).get_json()["id"])
+    assert status["changed"] == 5
+    assert _label_counts(client) == {"Blue": 5}
+    assert client.get(f"/api/relabel/{status['id']}", headers={"X-User-Id": "u2"}).status_code == 404
+
+def test_relabel_in_process_pool_resumes_from_checkpoint(client):
+    client.post(f"/api/rules/{client.rule_id}/toggle", headers=H)
+    with client.application.app_context():
+        from app.models import Payload
+        fifth_id = Payload.query.order_by(Payload.id).offset(4).first().id
+        job = RelabelJob("u1", after_id=fifth_id, workers=2, chunk_size=2).run()
+    assert job.state == "done" and job.processed == 5
+    # only the first two payloads (ids before the checkpoint) keep their label
+    assert _label_counts(client) == {"Green": 2}
+
+def test_relabel_workers_are_validated_and_capped(client):
+    for field in ("workers", "chunk_size"):
+        for bad in (0, -1, "2", 1.5, True, None):
+            rv = client.post("/api/relabel", json={field: bad, "dry_run": True}, headers=H)
+            assert rv.status_code == 400, (field, bad)
+    client.application.config["RELABEL_WORKERS"] = 2
+    rv = client.post("/api/relabel", json={"workers": 10 ** 6, "chunk_size": 10 ** 9, "dry_run": True}, headers=H)
+    assert rv.status_code == 202
+    job = client.application.extensions["relabel_jobs"][rv.get_json()["id"]]
+    assert job.workers == 2 and job.chunk_size == 50000
+    assert _wait(client, job.id)["state"] == "done"
@@ -1,5 +1,5 @@
 import pytest
-from app.rule_engine import apply_rules, evaluate_rule
+from app.rule_engine import apply_rules, evaluate_rule, get_by_path, compile_rules, CompiledRule, _Missing
 
 def test_basic_rule_match():
     payload = {"Product": "Chocolate", "Price": 1.8}
@@ -30,3 +30,23 @@ def test_apply_all_matching_rules_priority_sort():
     labels, ids = apply_rules(payload, rules)
     assert labels == ["Yellow"]
     assert ids == [2]
+
+def test_get_by_path_nested_and_missing():
+    payload = {"a": {"b": [{"c": 1}, {"c": 2}, {"c": 3}, {"c": 4}]}}
+    assert get_by_path(payload, "a.b[3].c") == 4
+    assert get_by_path(payload, "a.b[9].c") is _Missing
+    assert get_by_path(payload, "a.x") is _Missing
+    assert get_by_path(payload, "a.b[x]") is _Missing
+
+def test_compiled_rules_match_uncompiled():
+    rules = [
+        {"id":1,"label":"Green","priority":10,"conditions":[(1,"=", "Product","Chocolate"), (1,"<", "Price","2")]},
+        {"id":2,"label":"Green","priority":5,"conditions":[(1,"=","CompanyName","Google"), (2,"=","CompanyName","Amazon"), (2,"<","Price",2.5)]},
+        {"id":3,"label":"Red","priority":30,"conditions":[(1,">=","Price","abc")]},
+    ]
+    compiled = compile_rules(rules)
+    assert isinstance(compiled[0], CompiledRule)
+    for payload in [{"Product":"Chocolate","Price":"1.5"}, {"CompanyName":"Amazon","Price":2},
+                    {"CompanyName":"Google"}, {"Price":9}, {}]:
+        assert apply_rules(payload, compiled) == apply_rules(payload, rules)
+    assert apply_rules({"CompanyName":"Amazon","Price":"1","Product":"Chocolate"}, compiled) == (["Green"], [2, 1])
@@ -0,0 +1,114 @@
+import random
+from app.rule_engine import apply_rules, compile_rules
+from app.rule_index import RuleMatcher
+
+NAN = float("nan")  # one shared object, so identity-based shortcuts would show up
+
+def _random_rules(rnd, n):
+    keys = ["Product", "Price", "Qty", "a.b[1].c"]
+    rules = []
+    for i in range(n):
+        conds = []
+        for g in range(1, rnd.randint(1, 3) + 1):
+            for _ in range(rnd.randint(1, 3)):
+                key = rnd.choice(keys)
+                op = rnd.choice(["=", "!=", "<", "<=", ">", ">="])
+                if key == "Product" or op in ("=", "!=") and rnd.random() < 0.3:
+                    val = rnd.choice(["Chocolate", "Candy", "Gum", 3, "x", NAN])
+                else:
+                    val = rnd.choice([0, 1, 2, 2.5, 5, "4", "nope", NAN])
+                conds.append((g, op, key, val))
+        rules.append({"id": i + 1, "label": rnd.choice("ABCDE"), "priority": rnd.randint(1, 5), "conditions": conds})
+    return rules
+
+def _random_payload(rnd):
+    p = {}
+    if rnd.random() < 0.9: p["Product"] = rnd.choice(["Chocolate", "Candy", "Gum", 3, NAN])
+    if rnd.random() < 0.9: p["Price"] = rnd.choice([0, 1, 1.5, 2, 2.5, 3, 5, 7, "2", "abc", None, True, NAN])
+    if rnd.random() < 0.5: p["Qty"] = rnd.choice([0, 2, 4, "4", [1]])
+    if rnd.random() < 0.5: p["a"] = {"b": [{"c": 1}, {"c": rnd.choice([0, 2, 5, "Gum"])}]}
+    return p
+
+def test_matcher_agrees_with_apply_rules():
+    rnd = random.Random(7)
+    for _ in range(20):
+        rules = _random_rules(rnd, 40)
+        compiled = compile_rules(rules)
+        matcher = RuleMatcher(compiled)
+        for _ in range(100):
+            payload = _random_payload(rnd)
+            assert matcher.apply(payload) == apply_rules(payload, compiled)
+
+def test_matcher_uses_index_for_price_bands():
+    rules = [
+        {"id": 1, "label": "Green", "priority": 10, "conditions": [(1, "=", "Product", "Chocolate"), (1, "<", "Price", 2)]},
+        {"id": 2, "label": "Yellow", "priority": 20, "conditions": [(1, ">=", "Price", 2), (1, "<", "Price", 5)]},
+        {"id": 3, "label": "Red", "priority": 30, "conditions": [(1, ">=", "Price", 5)]},
+    ]
+    matcher = RuleMatcher(rules)
+    assert [e[0] for e in matcher.candidates({"Product": "Candy", "Price": 3})] == [1]
+    assert matcher.apply({"Product": "Chocolate", "Price": "1"}) == (["Green"], [1])
+    assert matcher.apply({"Product": "Chocolate", "Price": 5}) == (["Red"], [3])
+
+def test_vectorized_batch_agrees_with_apply_rules():
+    from app.rule_vector import apply_rules_batch
+    rnd = random.Random(11)
+    for _ in range(10):
+        rules = _random_rules(rnd, 40)
+        payloads = [_random_payload(rnd) for _ in range(300)]
+        compiled = compile_rules(rules)
+        assert apply_rules_batch(payloads, compiled) == [apply_rules(p, compiled) for p in payloads]
+
+def test_equal_memo_keys_label_identically():
+    from app.label_memo import memo_key
+    from app.rule_cache import RuleSet
+    rnd = random.Random(13)
+    for _ in range(10):
+        rule_set = RuleSet("u1", 1, compile_rules(_random_rules(rnd, 40)))
+        seen = {}
+        for _ in range(300):
+            payload = _random_payload(rnd)
+            payload["ts"] = rnd.random()
+            result = apply_rules(payload, rule_set.rules)
+            assert seen.setdefault(memo_key(rule_set, payload), result) == result
+        assert len(seen) < 300
+
+def test_adaptive_reordering_keeps_results():
+    from app.rule_cache import RuleSet
+    from app.rule_stats import observe, reorder
+    rnd = random.Random(17)
+    for _ in range(10):
+        rules = _random_rules(rnd, 40)
+        reference = compile_rules(rules)
+        rule_set = RuleSet("u1", 1, compile_rules(rules))
+        payloads = [_random_payload(rnd) for _ in range(200)]
+        for p in payloads[:50]:
+            observe(rule_set, p)
+        reorder(rule_set)
+        for p in payloads:
+            assert rule_set.matcher.apply(p) == apply_rules(p, reference)
+
+def test_reorder_puts_selective_condition_first():
+    from app.rule_cache import RuleSet
+    from app.rule_stats import observe, reorder
+    rule_set = RuleSet("u1", 1, compile_rules([
+        {"id": 1, "label": "A", "priority": 1, "conditions": [(1, "!=", "Product", "x"), (1, "!=", "Qty", 3)]}]))
+    for i in range(50):
+        observe(rule_set, {"Product": "Gum", "Qty": 3 + i % 2})
+    reorder(rule_set)
+    assert [c.key_path for c in rule_set.rules[0].groups[0]] == ["Qty", "Product"]
+    assert rule_set.matcher.apply({"Product": "Gum", "Qty": 4}) == (["A"], [1])
+
+def test_early_exit_modes_agree_with_full_apply():
+    from app.ingest import limit_result
+    from app.rule_cache import RuleSet
+    rnd = random.Random(19)
+    for _ in range(10):
+        rule_set = RuleSet("u1", 1, compile_rules(_random_rules(rnd, 40)))
+        for _ in range(100):
+            payload = _random_payload(rnd)
+            full = rule_set.matcher.apply(payload)
+            for mode in ((1, True), (2, True), (3, False), (None, True)):
+                limited = rule_set.matcher.apply_limited(payload, *mode)
+                assert limited == limit_result(rule_set, *full, mode)
+                assert limited[0] == full[0][:mode[0]]
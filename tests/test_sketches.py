@@ -0,0 +1,116 @@
+import random
+from datetime import datetime, timedelta, timezone
+from app import create_app, db, jsoncodec
+from app.sketches import DistinctSketch, QuantileSketch, SketchStore, ValueSketch, _hash
+
+def test_quantile_sketch_rank_error_and_merge():
+    rnd = random.Random(3)
+    values = [rnd.random() * 100 for _ in range(50000)]
+    a, b = QuantileSketch(), QuantileSketch()
+    for i, x in enumerate(values):
+        (a if i % 2 else b).add(x)
+    a.merge(b)
+    ordered = sorted(values)
+    for q, est in zip((0.1, 0.5, 0.9), a.quantiles((0.1, 0.5, 0.9))):
+        rank = sum(1 for x in ordered if x <= est) / len(ordered)
+        assert abs(rank - q) < 0.02
+    assert a.n == 50000 and sum(map(len, a.levels)) < 1000
+
+def test_distinct_sketch_estimate():
+    sk = DistinctSketch()
+    for i in range(20000):
+        sk.add(_hash(str(i % 5000)))
+    assert abs(sk.estimate() - 5000) < 5000 * 0.1
+
+def test_value_sketch_top_items_and_round_trip():
+    rnd = random.Random(5)
+    sk = ValueSketch()
+    for _ in range(5000):
+        sk.add(rnd.choice(["Chocolate"] * 6 + ["Candy"] * 3 + [f"item{rnd.randint(0, 500)}"]))
+    for price in (1, 2, "3", 4.5, True):
+        sk.add(price)
+    copy = ValueSketch.from_dict(jsoncodec.loads(jsoncodec.dumps(sk.to_dict())))
+    summary = copy.summary(quantiles=(0.5,), top=2)
+    assert [t["value"] for t in summary["top"]] == ["Chocolate", "Candy"]
+    assert summary["numeric"]["count"] == 4 and summary["numeric"]["max"] == 4.5
+    assert summary["count"] == 5005
+
+def test_distributions_endpoint_merges_workers_and_windows():
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    h = {"X-User-Id": "u1"}
+    client.post("/api/rules", json={
+        "name": "Low", "label": "Green", "priority": 10,
+        "conditions": [{"group": 1, "key_path": "Price", "operator": "<", "value": 2}]
+    }, headers=h)
+    rv = client.put("/api/statistics/distributions/keys", json={"keys": ["Product", "a[x]"]}, headers=h)
+    assert rv.status_code == 400
+    rv = client.put("/api/statistics/distributions/keys", json={"keys": ["Product"]}, headers=h)
+    assert rv.get_json() == {"keys": ["Product"], "tracked": ["Product"]}  # rule keys are not sketched by default
+    rv = client.put("/api/statistics/distributions/keys", json={"keys": ["Product", "Price"]}, headers=h)
+    assert rv.get_json() == {"keys": ["Price", "Product"], "tracked": ["Price", "Product"]}
+
+    old = app.extensions["sketches"]
+    earlier = datetime.now(timezone.utc) - timedelta(hours=2)
+    last_week = datetime.now(timezone.utc) - timedelta(days=7)
+    with app.app_context():
+        from app.rule_cache import get_rule_set
+        old.observe("u1", get_rule_set("u1"), [{"Price": i, "Product": "Gum"} for i in range(100)], when=earlier)
+        old.observe("u1", get_rule_set("u1"), [{"Price": 1000}] * 50, when=last_week)
+        assert old.flush() == 3 and not old._live
+    SketchStore(app)
+    for price in (1, 2, 3):
+        client.post("/api/process", json={"Price": price, "Product": "Candy"}, headers=h)
+    client.post("/api/process/batch", json=[{"Price": 5}, {"Other": 1}], headers=h)
+
+    data = client.get("/api/statistics/distributions?quantiles=0.5&top=1", headers=h).get_json()
+    assert data["keys"]["Price"]["count"] == 104
+    assert data["keys"]["Product"]["top"] == [{"value": "Gum", "count": 100}]
+    assert 45 <= data["keys"]["Price"]["numeric"]["quantiles"]["0.5"] <= 55
+    # the default window is SKETCH_WINDOW_HOURS back; older buckets need an explicit from
+    since = (last_week - timedelta(hours=1)).isoformat()
+    data = client.get("/api/statistics/distributions", query_string={"from": since}, headers=h).get_json()
+    assert data["keys"]["Price"]["count"] == 154
+
+    since = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
+    data = client.get("/api/statistics/distributions", query_string={"keys": "Price", "from": since}, headers=h).get_json()
+    assert list(data["keys"]) == ["Price"] and data["keys"]["Price"]["count"] == 4
+    assert data["keys"]["Price"]["numeric"]["min"] == 1.0
+    assert client.get("/api/statistics/distributions?quantiles=2", headers=h).status_code == 400
+
+def test_sketch_keys_do_not_invalidate_compiled_rules():
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    h = {"X-User-Id": "u1"}
+    client.post("/api/rules", json={"name": "Low", "label": "Green", "priority": 10,
+                                    "conditions": [{"group": 1, "key_path": "Price", "operator": "<", "value": 2}]},
+                headers=h)
+    etag = client.get("/api/rules", headers=h).headers["ETag"]
+    with app.app_context():
+        from app.rule_cache import get_rule_set
+        before = get_rule_set("u1")
+        client.put("/api/statistics/distributions/keys", json={"keys": ["Product"]}, headers=h)
+        after = get_rule_set("u1")
+    assert after is before and after.version == before.version
+    assert [kp for kp, _ in after.sketch_paths] == ["Product"]
+    assert client.get("/api/rules", headers={**h, "If-None-Match": etag}).status_code == 304
+
+def test_sketch_store_observe_concurrently():
+    import threading
+    from app.rule_cache import RuleSet
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    store = app.extensions["sketches"]
+    rule_set = RuleSet("u", 1, [], sketch_keys=["a", "b"])
+    batch = [{"a": i, "b": str(i % 7)} for i in range(200)]
+    threads = [threading.Thread(target=lambda uid=uid: [store.observe(uid, rule_set, batch) for _ in range(20)])
+               for uid in ("u1", "u2", "u1", "u2")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    counts = {(k[0], k[1]): sketch.count for k, (sketch, _) in store._live.items()}
+    assert counts == {(u, kp): 2 * 20 * 200 for u in ("u1", "u2") for kp in ("a", "b")}
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from app import create_app, db
+from app.models import Payload, PayloadLabel, User
+from app.stats import compute_statistics, rebuild_rollups
+
+T0 = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def app():
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "ROLLUP_BUCKET_SECONDS": 60})
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id="u1"))
+        for i in range(200):
+            p = Payload(user_id="u1", payload_json="{}", received_at=T0 + timedelta(seconds=7 * i))
+            db.session.add(p); db.session.flush()
+            db.session.add(PayloadLabel(payload_id=p.id, rule_id=1, label="Green" if i % 3 else "Red"))
+            if i % 5 == 0:
+                db.session.add(PayloadLabel(payload_id=p.id, rule_id=2, label="Green"))
+        db.session.commit()
+        rebuild_rollups()
+        yield app
+
+def _brute(label, lo, hi):
+    total, counts = 0, {}
+    for i in range(200):
+        t = T0 + timedelta(seconds=7 * i)
+        if (lo and t < lo) or (hi and t > hi):
+            continue
+        total += 1
+        labs = ["Green" if i % 3 else "Red"] + (["Green"] if i % 5 == 0 else [])
+        for lab in labs:
+            if not label or lab == label:
+                counts[lab] = counts.get(lab, 0) + 1
+    return total, counts
+
+@pytest.mark.parametrize("rollups", [True, False])
+@pytest.mark.parametrize("label", [None, "Red"])
+@pytest.mark.parametrize("lo,hi", [
+    (None, None),
+    (T0 + timedelta(seconds=30), None),
+    (None, T0 + timedelta(seconds=601)),
+    (T0 + timedelta(seconds=95), T0 + timedelta(seconds=1000)),
+    (T0 + timedelta(seconds=60), T0 + timedelta(seconds=120)),
+    (T0 + timedelta(seconds=61), T0 + timedelta(seconds=80)),
+])
+def test_statistics_match_raw_rows(app, rollups, label, lo, hi):
+    app.config["STATS_ROLLUPS"] = rollups
+    with app.app_context():
+        stats = compute_statistics("u1", label, lo, hi)
+    total, counts = _brute(label, lo, hi)
+    assert stats["total_payloads"] == total
+    assert {r["label"]: r["count"] for r in stats["by_label"]} == counts
+
+def test_upgrade_schema_adds_indexes_to_existing_db(tmp_path):
+    import shutil
+    from pathlib import Path
+    from app.migrations import upgrade_schema
+    path = tmp_path / "old.db"
+    shutil.copy(Path(__file__).parent.parent / "instance" / "ass.db", path)
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}"})
+    with app.app_context():
+        created = upgrade_schema()
+        assert {"ix_payloads_user_received", "ix_payload_labels_label_payload", "payloads.body_hash",
+                "rollups"} <= set(created)
+        assert upgrade_schema() == []
+        raw = Payload.query.filter_by(user_id="demo_user").count()
+        assert raw == 61 and compute_statistics("demo_user")["total_payloads"] == raw
+
+def test_pruned_payloads_stay_in_statistics(app):
+    from app.retention import prune_expired, set_policy
+    with app.app_context():
+        set_policy("u1", 30)
+        db.session.commit()
+        now = T0 + timedelta(days=30, seconds=700)
+        assert prune_expired(now=now, batch_size=7) == {"u1": 95}  # cutoff rounds down to T0 + 660s
+        assert Payload.query.count() == 105 and PayloadLabel.query.count() == 105 + 21
+
+        rebuild_rollups()
+        for lo, hi in [(None, None), (T0 + timedelta(seconds=660), None), (None, T0 + timedelta(seconds=1000))]:
+            total, counts = _brute(None, lo, hi)
+            stats = compute_statistics("u1", None, lo, hi)
+            assert stats["total_payloads"] == total
+            assert {r["label"]: r["count"] for r in stats["by_label"]} == counts
+        # edges inside the pruned range are answered for their whole bucket
+        stats = compute_statistics("u1", None, T0 + timedelta(seconds=65), T0 + timedelta(seconds=100))
+        assert stats["total_payloads"] == _brute(None, T0 + timedelta(seconds=60), T0 + timedelta(seconds=119))[0]
+        assert prune_expired(now=now) == {"u1": 0}
+
+def test_retention_policy_api(app):
+    client = app.test_client()
+    h = {"X-User-Id": "u2"}
+    assert client.get("/api/retention", headers=h).get_json()["effective_days"] == 0
+    assert client.put("/api/retention", json={"raw_days": -1}, headers=h).status_code == 400
+    body = client.put("/api/retention", json={"raw_days": 7}, headers=h).get_json()
+    assert body["raw_days"] == 7 and body["pruned_before"] is None
+
+def test_pruning_deletes_expired_sketches(app):
+    from app.models import KeySketch
+    from app.retention import prune_expired, set_policy
+    app.config["SKETCH_BUCKET_SECONDS"] = 3600
+    with app.app_context():
+        t0 = int(T0.timestamp())
+        for bucket in (t0 - 3600, t0, t0 + 3600):
+            db.session.add(KeySketch(user_id="u1", key_path="Price", bucket=bucket, writer="w", count=1, data="{}"))
+        set_policy("u1", 30)
+        db.session.commit()
+        prune_expired(now=T0 + timedelta(days=30, seconds=3600))
+        assert sorted(b for b, in db.session.query(KeySketch.bucket)) == [t0 + 3600]
@@ -0,0 +1,82 @@
+import threading
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.storage import READ_BIND
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'stress.db'}",
+                      "STORAGE_PROFILE": "throughput", "STATS_BROADCAST_INTERVAL_MS": 1000})
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.engines[None].dispose()
+        db.engines[READ_BIND].dispose()
+
+def test_throughput_profile_pragmas(app):
+    with app.app_context():
+        with db.engines[None].connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        with db.engines[READ_BIND].connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text("DELETE FROM payloads"))
+
+def test_parallel_writers_and_readers(app):
+    client = app.test_client()
+    client.post("/api/rules", json={
+        "name": "Low", "label": "Green", "priority": 10,
+        "conditions": [{"group": 1, "key_path": "Price", "operator": "<", "value": 5}]
+    }, headers={"X-User-Id": "w0"})
+    writers, batches, per_batch = 4, 15, 20
+    errors = []
+    done = threading.Event()
+
+    def write(n):
+        c = app.test_client()
+        for _ in range(batches):
+            rv = c.post("/api/process/batch", json=[{"Price": i % 10} for i in range(per_batch)],
+                        headers={"X-User-Id": f"w{n}"})
+            if rv.status_code != 200:
+                errors.append(rv.get_data(as_text=True))
+
+    def read():
+        c = app.test_client()
+        while not done.is_set():
+            rv = c.get("/api/statistics", headers={"X-User-Id": "w0"})
+            if rv.status_code != 200:
+                errors.append(rv.get_data(as_text=True))
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(writers)]
+    for t in readers + threads:
+        t.start()
+    for t in threads:
+        t.join()
+    done.set()
+    for t in readers:
+        t.join()
+
+    assert errors == []
+    stats = client.get("/api/statistics", headers={"X-User-Id": "w0"}).get_json()
+    assert stats["total_payloads"] == batches * per_batch
+    assert stats["by_label"] == [{"label": "Green", "count": batches * per_batch // 2, "percentage": 50.0}]
+
+def test_generic_upsert_matches_on_conflict(app):
+    from app.models import LabelRollup, User
+    from app.storage import _upsert_generic, upsert
+    rows = [{"user_id": "u1", "bucket": 0, "label": "A", "count": 2}, {"user_id": "u1", "bucket": 60, "label": "A", "count": 1}]
+    with app.app_context():
+        db.session.add(User(id="u1"))
+        for write in (upsert, _upsert_generic):
+            db.session.query(LabelRollup).delete()
+            write(db.session, LabelRollup, rows, ["user_id", "bucket", "label"], add=["count"])
+            write(db.session, LabelRollup, rows[:1], ["user_id", "bucket", "label"], add=["count"])
+            assert sorted((r.bucket, r.count) for r in LabelRollup.query) == [(0, 4), (60, 1)]
+            write(db.session, LabelRollup, rows[:1], ["user_id", "bucket", "label"], set_=["count"])
+            assert write(db.session, LabelRollup, rows, ["user_id", "bucket", "label"]) == 0
+            assert sorted((r.bucket, r.count) for r in LabelRollup.query) == [(0, 2), (60, 1)]
+        assert _upsert_generic(db.session, User, [{"id": "u1"}, {"id": "u2"}], ["id"]) == 1
@@ -2,14 +2,20 @@ import eventlet
 
 eventlet.monkey_patch()
 
-from app import create_app, db
+from app import create_app
 from app.models import seed_demo_data
+from app.migrations import upgrade_schema
+import atexit
 import os
 
 
 app = create_app()
+atexit.register(app.extensions['write_behind'].shutdown)
+atexit.register(app.extensions['sketches'].shutdown)
 
 with app.app_context():
-    db.create_all()
+    upgrade_schema()
     if os.environ.get("SEED_DEMO", "false").lower() in {"1","true","yes"}:
-        seed_demo_data()
\ No newline at end of file
+        seed_demo_data()
+app.extensions['retention'].start()
+app.extensions['sketches'].start()
\ No newline at end of file